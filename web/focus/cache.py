@@ -0,0 +1,424 @@
+""" Cache
+
+This module holds the response cache of the Focus and GPASS operations.
+The results are cached per operation and per citizen. The BSN (or administration number) is only used in
+hashed form (HMAC-SHA256), so it is never kept as a cache key. Entries are never returned after they have
+expired and are removed whether they are accessed or not.
+
+When the application runs in uWSGI the cache is shared by the worker processes of the node, it is stored in
+the uWSGI cache that is configured in uwsgi.ini. Elsewhere each process has its own cache.
+A worker that misses an entry that another worker is retrieving already waits for that result, instead of
+calling the backend as well.
+
+The cache is disabled by default, a TTL per operation is set by the FOCUS_CACHE_TTL_<OPERATION> variables,
+see config.py. Operations that are revalidated return an expired result for FOCUS_CACHE_STALE_TTL_<OPERATION>
+seconds more, while the result is refreshed in the background.
+"""
+import heapq
+import hmac
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from hashlib import sha256
+
+from .concurrency import get_executor
+from .config import get_cache_backend, get_cache_key, get_cache_name, get_cache_purge_interval, get_cache_size, \
+    get_cache_stale_ttl, get_cache_ttl
+from .deadline import remaining
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running in uWSGI
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# The interval in seconds at which a worker checks whether another worker has cached the result it waits for
+CLAIM_POLL_INTERVAL = 0.05
+# The maximum time in seconds that a worker waits for the result of another worker
+CLAIM_TIMEOUT = 9
+# The number of threads per worker that refresh stale entries
+REVALIDATE_WORKERS = 2
+
+
+def hash_bsn(bsn):
+    """ The keyed hash of a BSN (or another personal number), to use in cache keys """
+    return hmac.new(get_cache_key(), str(bsn).encode(), sha256).hexdigest()
+
+
+def cache_key(operation, bsn, **kwargs):
+    """ The cache key of an operation call, the other arguments are part of the key as well """
+    return f"{operation}:{hash_bsn(bsn)}:{json.dumps(kwargs, sort_keys=True)}"
+
+
+@lru_cache(maxsize=None)
+def _signature(method):
+    return inspect.signature(method)
+
+
+def call_key(method, operation, key, args, kwargs):
+    """
+    The cache key of a call of a FocusConnection or GpassConnection method
+    :param key: name of the argument that identifies the citizen
+    :param args: the positional arguments of the call, including self
+    :param kwargs: the keyword arguments of the call
+    """
+    arguments = _signature(method).bind(*args, **kwargs).arguments
+    del arguments["self"]
+    return cache_key(operation, arguments.pop(key), **arguments)
+
+
+class TTLCache:
+    """
+    A thread safe cache with a time to live per entry and a maximum number of entries
+    When the cache is full the least recently used entry is evicted
+    """
+
+    def __init__(self, maxsize, timer=time.monotonic):
+        self._maxsize = maxsize
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key: (expires, value), least recently used first
+        self._expiries = []             # heap of (expires, key)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :return: the value of key or MISSING if the key is not in the cache
+        """
+        with self._lock:
+            self._purge()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        """ Store value for ttl seconds """
+        if ttl <= 0 or self._maxsize <= 0:
+            return
+        with self._lock:
+            self._purge()
+            expires = self._timer() + ttl
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            heapq.heappush(self._expiries, (expires, key))
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def purge(self):
+        """ Remove the expired entries """
+        with self._lock:
+            self._purge()
+
+    def _purge(self):
+        now = self._timer()
+        while self._expiries and self._expiries[0][0] <= now:
+            expires, key = heapq.heappop(self._expiries)
+            entry = self._entries.get(key)
+            # The key may have been stored again or been evicted since
+            if entry is not None and entry[0] == expires:
+                del self._entries[key]
+        if len(self._expiries) > 2 * self._maxsize:
+            # Drop the expiries of entries that have been replaced or evicted
+            self._expiries = [(expires, key) for key, (expires, _) in self._entries.items()]
+            heapq.heapify(self._expiries)
+
+    def claim(self, key, ttl):
+        """ The calls within a process are coalesced by single_flight.py already """
+        return True
+
+    def release(self, key):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiries = []
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._entries)
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "maxsize": self._maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class UwsgiCache:
+    """
+    A cache that is shared by the uWSGI workers, the values are stored as JSON
+    uWSGI evicts the least recently used entry when the cache is full (purge_lru) and removes expired entries.
+    uWSGI expiry has a resolution of seconds, so the exact expiry time is stored with the value
+    """
+
+    def __init__(self, name, timer=time.time):
+        self._name = name
+        self._timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def get(self, key):
+        """
+        :return: the value of key or MISSING if the key is not in the cache
+        """
+        data = uwsgi.cache_get(key, self._name)
+        entry = json.loads(data) if data else None
+        if entry is None or entry["expires"] <= self._timer():
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return entry["value"]
+
+    def set(self, key, value, ttl):
+        """ Store value for ttl seconds """
+        if ttl <= 0:
+            return
+        data = json.dumps({"expires": self._timer() + ttl, "value": value})
+        # Round down, but 0 would mean that the entry never expires
+        if not uwsgi.cache_update(key, data, max(int(ttl), 1), self._name):
+            # e.g. the value is larger than the cache can hold
+            self.failures += 1
+            logger.debug(f"Failed to cache {len(data)} bytes")
+
+    def claim(self, key, ttl):
+        """
+        Claim the retrieval of the value of key, so that other workers wait for it
+        :param ttl: the maximum time in seconds of the claim, in case the worker does not release it
+        :return: True if the claim is made, False if another worker has claimed the key already
+        """
+        # cache_set fails when the key exists already
+        return bool(uwsgi.cache_set(f"{key}:claim", b"1", max(int(ttl), 1), self._name))
+
+    def release(self, key):
+        uwsgi.cache_del(f"{key}:claim", self._name)
+
+    def wait(self, key, timeout, interval=CLAIM_POLL_INTERVAL):
+        """
+        Wait for the value of key while another worker has claimed it
+        :return: the value, or MISSING when the claim is released without a value or when the timeout expires
+        """
+        waited = 0
+        while waited < timeout and uwsgi.cache_exists(f"{key}:claim", self._name):
+            time.sleep(interval)
+            waited += interval
+            if uwsgi.cache_exists(key, self._name):
+                break
+        return self.get(key)
+
+    def purge(self):
+        # Expired entries are removed by the uWSGI cache sweeper
+        pass
+
+    def clear(self):
+        uwsgi.cache_clear(self._name)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _purge_periodically(cache, interval):
+    while True:
+        time.sleep(interval)
+        cache.purge()
+
+
+def _create_cache():
+    if get_cache_backend() == "uwsgi" and uwsgi is not None:
+        return UwsgiCache(get_cache_name())
+
+    cache = TTLCache(get_cache_size())
+    # A daemon thread removes the expired entries that are not accessed
+    threading.Thread(target=_purge_periodically, args=(cache, get_cache_purge_interval()),
+                     name="cache purge", daemon=True).start()
+    return cache
+
+
+def get_cache():
+    """
+    Get the cache of this process, create it on first use
+    This is the uWSGI cache when running in uWSGI, unless FOCUS_CACHE_BACKEND is local
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = _create_cache()
+        return _cache
+
+
+def _load(cache, key, ttl, load):
+    """ Load the value of a missed key and cache it, or wait for the worker that is loading it already """
+    timeout = remaining()
+    if timeout is None:
+        timeout = CLAIM_TIMEOUT
+    if not cache.claim(key, timeout):
+        value = cache.wait(key, timeout)
+        if value is not MISSING:
+            return value
+        return load()
+
+    try:
+        value = load()
+        if value is not None:
+            cache.set(key, value, ttl)
+    finally:
+        cache.release(key)
+    return value
+
+
+def cached(operation, key="bsn"):
+    """
+    Cache the result of a FocusConnection or GpassConnection operation
+    The result is cached by operation, the hashed BSN and the other arguments of the call.
+    Results that are None (failed responses) are not cached
+    :param operation: name of the operation, its TTL is get_cache_ttl(operation)
+    :param key: name of the argument that identifies the citizen
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            ttl = get_cache_ttl(operation)
+            if ttl <= 0:
+                return method(self, *args, **kwargs)
+
+            cache = get_cache()
+            entry_key = call_key(method, operation, key, (self, *args), kwargs)
+            value = cache.get(entry_key)
+            if value is not MISSING:
+                return value
+            return _load(cache, entry_key, ttl, lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class _Revalidation:
+    """ The results of stale-while-revalidate lookups of an operation """
+
+    def __init__(self):
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def stats(self):
+        return dict(vars(self))
+
+
+_revalidations = {}
+_revalidating = set()
+_revalidation_lock = threading.Lock()
+
+
+def _revalidation(operation):
+    with _revalidation_lock:
+        return _revalidations.setdefault(operation, _Revalidation())
+
+
+def _store(cache, key, value, ttl, stale_ttl):
+    if value is not None:
+        cache.set(key, {"fresh_until": time.time() + ttl, "value": value}, ttl + stale_ttl)
+
+
+def _refresh(cache, key, ttl, stale_ttl, load, revalidation):
+    """ Refresh a stale entry, at most one refresh of an entry runs at a time in a worker and on the node """
+    with _revalidation_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+    try:
+        if not cache.claim(key, CLAIM_TIMEOUT):
+            # Another worker refreshes the entry
+            return
+        try:
+            _store(cache, key, load(), ttl, stale_ttl)
+            revalidation.refreshes += 1
+        except Exception as error:
+            revalidation.refresh_failures += 1
+            logger.warning(f"Failed to refresh a cache entry: {type(error)} {error}")
+        finally:
+            cache.release(key)
+    finally:
+        with _revalidation_lock:
+            _revalidating.discard(key)
+
+
+def revalidated(operation, key="bsn"):
+    """
+    Cache the result of a FocusConnection or GpassConnection operation with stale-while-revalidate
+    A result is fresh for get_cache_ttl(operation) seconds. After that it is returned for another
+    get_cache_stale_ttl(operation) seconds while it is refreshed in the background.
+    Results that are None (failed responses) are not cached
+    :param operation: name of the operation
+    :param key: name of the argument that identifies the citizen
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            ttl = get_cache_ttl(operation)
+            if ttl <= 0:
+                return method(self, *args, **kwargs)
+
+            cache = get_cache()
+            revalidation = _revalidation(operation)
+            entry_key = call_key(method, operation, key, (self, *args), kwargs)
+            stale_ttl = get_cache_stale_ttl(operation)
+
+            def load():
+                return method(self, *args, **kwargs)
+
+            entry = cache.get(entry_key)
+            if entry is MISSING:
+                revalidation.misses += 1
+                value = load()
+                _store(cache, entry_key, value, ttl, stale_ttl)
+                return value
+
+            if entry["fresh_until"] <= time.time():
+                revalidation.stale += 1
+                # Not within the context of the request, a refresh is not bound to the request deadline
+                get_executor("revalidate", REVALIDATE_WORKERS).submit(
+                    _refresh, cache, entry_key, ttl, stale_ttl, load, revalidation)
+            else:
+                revalidation.hits += 1
+            return entry["value"]
+        return wrapper
+    return decorator
+
+
+def get_cache_stats():
+    """ The statistics of the cache and of the stale-while-revalidate operations of this worker """
+    with _revalidation_lock:
+        revalidations = {operation: revalidation.stats() for operation, revalidation in _revalidations.items()}
+    return {
+        "cache": get_cache().stats(),
+        "revalidated": revalidations,
+    }
@@ -0,0 +1,147 @@
+""" Circuit breaker
+
+This module holds a circuit breaker per backend operation, e.g. "focus getAanvragen" or "gpass pas".
+A breaker opens after a number of consecutive failures (errors or timeouts). While it is open the calls of its
+operation fail immediately. After a while one call is let through to probe the backend (half open), when it
+succeeds the breaker closes again, when it fails the breaker opens again.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from requests import ConnectionError
+
+from .config import get_breaker_reset_timeout, get_breaker_threshold
+from .deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ConnectionError):
+    """ The call has not been made because the circuit breaker of the operation is open """
+
+
+class _Call:
+    def __init__(self):
+        self.failure = False
+        # Whether this call has opened the breaker
+        self.opened = False
+
+    def failed(self):
+        """ Count the call as a failure, for a call that did not raise an exception, e.g. a 5xx response """
+        self.failure = True
+
+
+class CircuitBreaker:
+    def __init__(self, name, threshold, reset_timeout, timer=time.monotonic):
+        """
+        :param name: name of the operation
+        :param threshold: the number of consecutive failures that opens the breaker
+        :param reset_timeout: the number of seconds that the breaker stays open before it lets a probe through
+        """
+        self.name = name
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.short_circuits = 0
+        self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+
+    def _transition(self, state):
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.transitions[state] += 1
+
+    def _allow(self):
+        with self._lock:
+            if self.state == OPEN and self._timer() - self._opened_at >= self._reset_timeout:
+                self._transition(HALF_OPEN)
+            if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+                self.short_circuits += 1
+                raise CircuitOpenError(f"Circuit breaker {self.name} is open")
+            if self.state == HALF_OPEN:
+                self._probing = True
+
+    def _record(self, failure):
+        """ :return: whether the breaker has been opened """
+        with self._lock:
+            self._probing = False
+            if not failure:
+                self._failures = 0
+                if self.state != CLOSED:
+                    self._transition(CLOSED)
+                return False
+
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self._threshold):
+                self._opened_at = self._timer()
+                self._transition(OPEN)
+                return True
+            return False
+
+    def _release(self):
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self):
+        """
+        Guard a call of the operation
+        An exception within the block counts as a failure, except when the request deadline had been exceeded before
+        :raises CircuitOpenError: when the breaker is open
+        """
+        self._allow()
+        call = _Call()
+        try:
+            yield call
+        except DeadlineExceeded:
+            # The backend has not been called
+            self._release()
+            raise
+        except Exception:
+            call.opened = self._record(failure=True)
+            raise
+        call.opened = self._record(call.failure)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self._failures,
+                "short_circuits": self.short_circuits,
+                "transitions": dict(self.transitions),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """ Get the circuit breaker of an operation, create it on first use """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, get_breaker_threshold(), get_breaker_reset_timeout())
+            _breakers[name] = breaker
+        return breaker
+
+
+def get_breakers():
+    with _breakers_lock:
+        return dict(_breakers)
+
+
+def reset_breakers():
+    """ Forget all breakers, they are created again (closed) on their next use """
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,158 @@
+""" Client pool
+
+This module holds a pool of SOAP clients. A zeep client is not safe to use from more than one thread at a time,
+so each call checks a client out of the pool and returns it afterwards.
+Clients are created on demand up to the size of the pool, when all clients are in use a call waits for one
+to be returned, at most until the deadline of the request.
+The checkout wait is exposed as a histogram at /status/metrics, the state of the pool at /status/pool.
+"""
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from requests import ConnectionError
+
+from .deadline import DeadlineExceeded, get_timeout
+from .metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# The maximum time in seconds to wait for a client when the request has no deadline
+MAX_WAIT = 9
+
+
+class ClientPool:
+    """ A checkout/checkin pool of clients """
+
+    def __init__(self, factory, size, close=None):
+        """
+        Initializes the pool with one client
+        :param factory: function that creates a client, returns None when no client can be created
+        :param size: the maximum number of clients
+        :param close: function that releases the resources of a client that is no longer used
+        """
+        self._factory = factory
+        self._size = size
+        self._close = close
+        self._closed = False
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        client = factory()
+        if client is not None:
+            self._created = 1
+            self._idle.put(client)
+
+    def is_alive(self):
+        """ Tells whether a client has been created """
+        return self._created > 0
+
+    def _create(self):
+        """
+        Create a new client if the pool is not full
+        :return: the new client, or None if the pool is full
+        :raises ConnectionError: when the client could not be created
+        """
+        with self._lock:
+            if self._created >= self._size:
+                return None
+            self._created += 1
+
+        client = self._factory()
+        if client is None:
+            with self._lock:
+                self._created -= 1
+            raise ConnectionError('Failed to establish a connection with Focus')
+        return client
+
+    def _wait(self):
+        start = time.monotonic()
+        try:
+            return self._idle.get(timeout=get_timeout(MAX_WAIT))
+        except queue.Empty:
+            raise DeadlineExceeded('No Focus client available') from None
+        finally:
+            wait_time = time.monotonic() - start
+            with self._lock:
+                self.waits += 1
+                self.wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def _checkout(self):
+        if not self.is_alive():
+            # The connection is being re-established, do not wait for it
+            raise ConnectionError('No connection with Focus')
+        with self._lock:
+            self.checkouts += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        return self._create() or self._wait()
+
+    @contextmanager
+    def client(self):
+        """
+        Check out a client for the duration of the with block
+        The time it takes to get a client is recorded in the pool_wait histogram, see metrics.py
+        """
+        start = time.perf_counter()
+        try:
+            client = self._checkout()
+        except Exception:
+            observe("pool_wait", {}, time.perf_counter() - start, error=True)
+            raise
+        observe("pool_wait", {}, time.perf_counter() - start)
+        try:
+            yield client
+        finally:
+            self._checkin(client)
+
+    def _checkin(self, client):
+        with self._lock:
+            if not self._closed:
+                self._idle.put(client)
+                return
+        # The pool has been replaced while the client was in use
+        self._close_client(client)
+
+    def _close_client(self, client):
+        if self._close is not None:
+            try:
+                self._close(client)
+            except Exception as error:
+                logger.warning(f'Failed to close a client: {type(error)} {error}')
+
+    def close(self):
+        """
+        Close the pool when it has been replaced
+        The idle clients are closed now, the clients that are in use when they are returned
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close_client(client)
+
+    def stats(self):
+        """ The number of clients and the time that checkouts had to wait for a client """
+        with self._lock:
+            return {
+                "size": self._size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+            }
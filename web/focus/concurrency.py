@@ -0,0 +1,36 @@
+""" Concurrency
+
+This module holds the bounded thread pools that are used to call the backends concurrently.
+The pools are created lazily, so that each (forked) uWSGI worker gets its own threads.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    """
+    Get the named executor of this process, create it on first use
+    :param name: name of the executor, also used as prefix for its thread names
+    :param max_workers: the maximum number of threads in the executor
+    :return: ThreadPoolExecutor
+    """
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            _executors[name] = executor
+        return executor
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Schedule fn on the executor within a copy of the current context,
+    so that the request deadline is also known in the executor thread
+    :return: Future
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
@@ -6,10 +6,14 @@ The actual values are retrieved from shell variables that are stored outside of
 
 """
 import os
+import tempfile
 
 
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Key for hashing BSNs in cache keys when FOCUS_CACHE_KEY is not set, created before the workers are forked
+_CACHE_KEY = os.urandom(32)
+
 
 def get_variable(v, default_value=None):
     """Try to read variable, If it fails return None or a specified other default value
@@ -29,11 +33,14 @@ def check_env():
                     if not get_variable(v)]
     if missing_vars:
         raise Exception('Missing environment variables {}'.format(', '.join(missing_vars)))
+    if config['interpreter'] not in ['bs4', 'lxml']:
+        raise Exception('Unknown FOCUS_INTERPRETER {}, use bs4 or lxml'.format(config['interpreter']))
 
 
 config = {
     'wsdl': get_variable('FOCUS_WSDL'),
-    'session_verify': get_variable('FOCUS_CERTIFICATE', False)  # Default don't check the certificate
+    'session_verify': get_variable('FOCUS_CERTIFICATE', False),  # Default don't check the certificate
+    'interpreter': get_variable('FOCUS_INTERPRETER', 'bs4')  # Interpret responses with BeautifulSoup or lxml
 }
 
 credentials = {
@@ -47,6 +54,10 @@ urls = {
     'swagger': "/focus/swagger.yaml",
     'health': "/status/health",
     'data': "/status/data",
+    'metrics': "/status/metrics",
+    'circuits': "/status/circuits",
+    'cache': "/status/cache",
+    'pool': "/status/pool",
     'aanvragen': "/focus/aanvragen",
     'document': "/focus/document",
     'combined': "/focus/combined",
@@ -59,6 +70,11 @@ def get_TMA_certificate():
         return f.read()
 
 
+def get_saml_cache_size():
+    """ The maximum number of verified SAML tokens that are remembered per worker process, 0 disables """
+    return int(get_variable('FOCUS_SAML_CACHE_SIZE', 1000))
+
+
 def get_gpass_bearer_token():
     return get_variable('GPASS_TOKEN')
 
@@ -67,5 +83,185 @@ def get_gpass_api_location():
     return get_variable('GPASS_API_LOCATION')
 
 
+def get_gpass_pool_connections():
+    """ The number of GPASS hosts to keep connections to per worker process """
+    return int(get_variable('GPASS_POOL_CONNECTIONS', 2))
+
+
+def get_gpass_pool_maxsize():
+    """ The maximum number of connections per GPASS host that are kept alive per worker process """
+    return int(get_variable('GPASS_POOL_MAXSIZE', 10))
+
+
+def get_gpass_max_workers():
+    """
+    The maximum number of GPASS pas details that are retrieved at the same time per worker process
+    These calls have their own threads, they are made from the threads that retrieve the combined sections
+    """
+    return int(get_variable('GPASS_MAX_WORKERS', 4))
+
+
 def get_key():
     return os.getenv("FERNET_KEY")
+
+
+def get_request_deadline():
+    """ The time budget in seconds for all backend calls of a request, the frontend waits 9 seconds """
+    return float(get_variable('FOCUS_REQUEST_DEADLINE', 9))
+
+
+def get_client_pool_size():
+    """ The maximum number of Focus SOAP clients per worker process, one client is used per concurrent call """
+    return int(get_variable('FOCUS_CLIENT_POOL_SIZE', 4))
+
+
+def get_wsdl_cache_path():
+    """ The file in which the remote WSDL and schema files are cached, empty to disable the cache """
+    return get_variable('FOCUS_WSDL_CACHE', os.path.join(tempfile.gettempdir(), 'focus_wsdl_cache.db'))
+
+
+def get_wsdl_cache_timeout():
+    """ The number of seconds that a cached WSDL or schema file is used """
+    return int(get_variable('FOCUS_WSDL_CACHE_TIMEOUT', 24 * 60 * 60))
+
+
+def get_reconnect_delay():
+    """ The number of seconds before the first retry of a failed connection with Focus """
+    return float(get_variable('FOCUS_RECONNECT_DELAY', 1))
+
+
+def get_reconnect_max_delay():
+    """ The maximum number of seconds between the retries of a failed connection with Focus """
+    return float(get_variable('FOCUS_RECONNECT_MAX_DELAY', 60))
+
+
+def get_negative_cache():
+    """ Whether the sections that have been empty for a citizen are remembered, so that they are not requested again """
+    return get_variable('FOCUS_NEGATIVE_CACHE', 'false').lower() == 'true'
+
+
+def get_negative_cache_capacity():
+    """ The number of citizens per section for which the negative cache keeps its error rate """
+    return int(get_variable('FOCUS_NEGATIVE_CACHE_CAPACITY', 500000))
+
+
+def get_negative_cache_error_rate():
+    """ The probability that the negative cache tells that a section is empty while it is not """
+    return float(get_variable('FOCUS_NEGATIVE_CACHE_ERROR_RATE', 0.001))
+
+
+def get_negative_cache_interval():
+    """ The number of seconds after which the negative cache starts forgetting, entries live one to two intervals """
+    return float(get_variable('FOCUS_NEGATIVE_CACHE_INTERVAL', 3600))
+
+
+def get_single_flight():
+    """ Whether identical concurrent Focus and GPASS calls are coalesced into a single backend call """
+    return get_variable('FOCUS_SINGLE_FLIGHT', 'true').lower() == 'true'
+
+
+def get_breaker_threshold():
+    """ The number of consecutive failures of a Focus or GPASS operation that opens its circuit breaker """
+    return int(get_variable('FOCUS_BREAKER_THRESHOLD', 5))
+
+
+def get_breaker_reset_timeout():
+    """ The number of seconds that a circuit breaker stays open before the operation is tried again """
+    return float(get_variable('FOCUS_BREAKER_RESET_TIMEOUT', 30))
+
+
+def get_server_timing():
+    """ Whether the responses tell the duration of their stages (SAML, SOAP calls, parsing, GPASS, JSON) in a Server-Timing header """
+    return get_variable('FOCUS_SERVER_TIMING', 'false').lower() == 'true'
+
+
+def get_trace_exporter():
+    """ The exporter of the request traces: jsonl (a file, see get_trace_file) or log. Empty (default) disables tracing """
+    return get_variable('FOCUS_TRACE_EXPORTER', '')
+
+
+def get_trace_file():
+    """ The file to which the jsonl exporter appends the spans of the requests """
+    return get_variable('FOCUS_TRACE_FILE', os.path.join(tempfile.gettempdir(), 'focus_traces.jsonl'))
+
+
+def get_slow_request_threshold():
+    """ The number of seconds after which a request is logged with its stages and payload shape, 0 disables the log """
+    return float(get_variable('FOCUS_SLOW_REQUEST_THRESHOLD', 3))
+
+
+def get_profiling():
+    """ Whether internal callers can profile a request with an X-Focus-Profile header, see profiling.py """
+    return get_variable('FOCUS_PROFILING', 'false').lower() == 'true'
+
+
+def get_profiler():
+    """ The profiler: cprofile (default, the thread of the request) or sampling (all threads) """
+    return get_variable('FOCUS_PROFILER', 'cprofile')
+
+
+def get_profile_dir():
+    """ The directory to which the profiles are written """
+    return get_variable('FOCUS_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'focus_profiles'))
+
+
+def get_profile_networks():
+    """ The comma separated networks of the callers that can profile a request, default only the local host """
+    return get_variable('FOCUS_PROFILE_NETWORKS', '127.0.0.1/32,::1/128')
+
+
+def get_preload():
+    """ Whether the Focus client is built when a uWSGI worker starts instead of on its first request """
+    return get_variable('FOCUS_PRELOAD', 'true').lower() == 'true'
+
+
+def get_combined_concurrent():
+    """ Whether the sections of the combined response are retrieved concurrently """
+    return get_variable('FOCUS_COMBINED_CONCURRENT', 'true').lower() == 'true'
+
+
+def get_combined_max_workers():
+    """ The maximum number of sections that are retrieved at the same time per worker process """
+    return int(get_variable('FOCUS_COMBINED_MAX_WORKERS', 8))
+
+
+def get_cache_ttl(operation):
+    """
+    The number of seconds that the results of a Focus operation are cached, 0 (default) disables caching
+    FOCUS_CACHE_TTL_<OPERATION> overrides FOCUS_CACHE_TTL for a single operation
+    """
+    return float(get_variable(f'FOCUS_CACHE_TTL_{operation.upper()}', get_variable('FOCUS_CACHE_TTL', 0)))
+
+
+def get_cache_stale_ttl(operation):
+    """
+    The number of seconds that an expired result of a revalidated operation is returned while it is refreshed,
+    0 (default) disables stale results. FOCUS_CACHE_STALE_TTL_<OPERATION> overrides FOCUS_CACHE_STALE_TTL
+    """
+    return float(get_variable(f'FOCUS_CACHE_STALE_TTL_{operation.upper()}', get_variable('FOCUS_CACHE_STALE_TTL', 0)))
+
+
+def get_cache_backend():
+    """ The uWSGI cache that is shared by the workers (uwsgi, default) or a cache per worker process (local) """
+    return get_variable('FOCUS_CACHE_BACKEND', 'uwsgi')
+
+
+def get_cache_name():
+    """ The name of the uWSGI cache, see uwsgi.ini """
+    return get_variable('FOCUS_CACHE_NAME', 'focus')
+
+
+def get_cache_size():
+    """ The maximum number of cached results per worker process, for the local cache """
+    return int(get_variable('FOCUS_CACHE_SIZE', 1000))
+
+
+def get_cache_purge_interval():
+    """ The interval in seconds at which expired cache entries are removed """
+    return float(get_variable('FOCUS_CACHE_PURGE_INTERVAL', 10))
+
+
+def get_cache_key():
+    """ The key for hashing BSNs in cache keys """
+    key = get_variable('FOCUS_CACHE_KEY')
+    return key.encode() if key else _CACHE_KEY
@@ -0,0 +1,85 @@
+""" Deadline
+
+This module holds the time budget of a request.
+The deadline is set once per request and limits the timeout of every Focus and GPASS call
+that is made for that request, including the calls that run in executor threads.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from requests import Session
+from requests.exceptions import Timeout
+
+from focus.config import get_request_deadline
+
+_current_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Timeout):
+    """ The time budget of the request has been used up before a backend call could be made """
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self._expires_at - time.monotonic(), 0.0)
+
+    def timeout(self, maximum=None):
+        """
+        The timeout to use for a backend call
+        :param maximum: the timeout of the call when there is no hurry
+        :return: the maximum, limited to the time that remains
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Request deadline exceeded')
+        return remaining if maximum is None else min(maximum, remaining)
+
+
+@contextmanager
+def deadline(seconds):
+    """ Set the deadline for all backend calls within the context """
+    token = _current_deadline.set(Deadline(seconds))
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def request_deadline(func):
+    """ Decorator to run a request handler within the configured request deadline """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with deadline(get_request_deadline()):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def remaining():
+    """ The number of seconds left for the current request, None if there is no deadline """
+    current = _current_deadline.get()
+    return None if current is None else current.remaining()
+
+
+def get_timeout(maximum):
+    """
+    The timeout to use for a backend call
+    :param maximum: the timeout of the call without a deadline
+    :return: the maximum, limited to the time that remains for the current request
+    """
+    current = _current_deadline.get()
+    if current is None:
+        return maximum
+    return current.timeout(maximum)
+
+
+class DeadlineSession(Session):
+    """ A requests Session that limits the timeout of each request to the current deadline """
+
+    def request(self, method, url, **kwargs):
+        kwargs['timeout'] = get_timeout(kwargs.get('timeout'))
+        return super().request(method, url, **kwargs)
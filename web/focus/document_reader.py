@@ -0,0 +1,297 @@
+""" Document reader
+
+This module reads the document out of a getDocument SOAP response while the response is being received.
+The document is either base64 encoded in the dataHandler element or, for an MTOM/XOP response, a separate
+MIME part that the dataHandler element refers to.
+
+The document is decoded chunk by chunk into a spool file that is kept in memory up to SPOOL_SIZE bytes
+and written to disk beyond that. The file name of the document follows the document data in the response,
+so the document can only be sent to the client once the whole response has been read.
+"""
+import base64
+import re
+from abc import ABC, abstractmethod
+from email.message import Message
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote
+
+from lxml import etree
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+_WHITESPACE = b" \t\r\n"
+_DATA_HANDLER_START = re.compile(rb"<(?:[\w.-]+:)?dataHandler(?:\s[^>]*)?>")
+_XOP_INCLUDE = etree.XPath('//*[local-name()="dataHandler"]/*[local-name()="Include"]/@href')
+_FILE_NAME = etree.XPath('string(//*[local-name()="fileName"][1])')
+
+
+class _Base64Decoder:
+    """ Decodes base64 data that arrives in chunks of any size """
+
+    def __init__(self, out):
+        self._out = out
+        self._rest = b""
+
+    def write(self, data):
+        data = self._rest + bytes(data).translate(None, _WHITESPACE)
+        end = len(data) - len(data) % 4
+        if end:
+            self._out.write(base64.b64decode(data[:end]))
+        self._rest = data[end:]
+
+    def close(self):
+        if self._rest:
+            raise ValueError("Incomplete base64 document data")
+
+
+class DocumentReader(ABC):
+    """
+    Base class of the readers, feed the reader with the chunks of the response and close it afterwards
+    After closing:
+    - found tells whether the document has been written to the spool file
+    - xml holds the SOAP message without the document data
+    - raw holds the complete response when the document has not been found
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.found = False
+        self.xml = b""
+        self._raw = []
+
+    @property
+    def raw(self):
+        return None if self.found else b"".join(self._raw)
+
+    def _retain(self, chunk):
+        # The response is only kept until the document data starts
+        if not self.found:
+            self._raw.append(bytes(chunk))
+
+    def _document_found(self):
+        self.found = True
+        self._raw = []
+
+    @abstractmethod
+    def feed(self, chunk):
+        """ Read the next chunk of the response """
+
+    @abstractmethod
+    def close(self):
+        """ Finish reading, raises ValueError when the response is incomplete """
+
+
+class InlineDocumentReader(DocumentReader):
+    """ Reads a SOAP message with the base64 encoded document in the dataHandler element """
+
+    def __init__(self, spool):
+        super().__init__(spool)
+        self._buffer = bytearray()
+        self._decoder = _Base64Decoder(spool)
+        self._state = self._search
+
+    def feed(self, chunk):
+        self._retain(chunk)
+        self._state(chunk)
+
+    def _search(self, chunk):
+        start = max(len(self._buffer) - 256, 0)
+        self._buffer += chunk
+        match = _DATA_HANDLER_START.search(self._buffer, start)
+        if match:
+            rest = bytes(self._buffer[match.end():])
+            del self._buffer[match.end():]
+            self._state = self._data
+            self._data(rest)
+
+    def _data(self, chunk):
+        end = chunk.find(b"<")
+        data = chunk if end < 0 else chunk[:end]
+        if not self.found and data.strip(_WHITESPACE):
+            self._document_found()
+        self._decoder.write(data)
+        if end >= 0:
+            self._state = self._tail
+            self._tail(chunk[end:])
+
+    def _tail(self, chunk):
+        # The remainder of the message, after the document data
+        self._buffer += chunk
+
+    def close(self):
+        if self._state == self._data:
+            raise ValueError("Incomplete document response")
+        self._decoder.close()
+        self.xml = bytes(self._buffer)
+
+
+class MultipartDocumentReader(DocumentReader):
+    """
+    Reads an MTOM/XOP multipart response
+    The first part is the SOAP message, the document is the part that its dataHandler element includes
+    """
+
+    def __init__(self, spool, boundary):
+        super().__init__(spool)
+        self._delimiter = b"\r\n--" + boundary.encode()
+        # A CRLF is prepended, so the first delimiter is found like all others
+        self._buffer = bytearray(b"\r\n")
+        self._state = self._preamble
+        self._part = 0
+        self._root = BytesIO()
+        self._writer = None
+        self._content_id = None
+
+    def feed(self, chunk):
+        self._retain(chunk)
+        self._buffer += chunk
+        while self._state():
+            pass
+
+    def _preamble(self):
+        index = self._buffer.find(self._delimiter)
+        if index < 0:
+            return False
+        del self._buffer[:index + len(self._delimiter)]
+        self._state = self._delimiter_end
+        return True
+
+    def _delimiter_end(self):
+        if len(self._buffer) < 2:
+            return False
+        if self._buffer[:2] == b"--":
+            self._state = self._epilogue
+        else:
+            self._state = self._headers
+        return True
+
+    def _headers(self):
+        index = self._buffer.find(b"\r\n\r\n")
+        if index < 0:
+            return False
+        headers = Message()
+        for line in bytes(self._buffer[:index]).decode("latin-1").split("\r\n"):
+            name, _, value = line.partition(":")
+            if value:
+                headers[name.strip()] = value.strip()
+        del self._buffer[:index + 4]
+        self._start_part(headers)
+        self._state = self._body
+        return True
+
+    def _start_part(self, headers):
+        self._part += 1
+        content_id = headers.get("Content-ID", "").strip("<>")
+        if self._part == 1:
+            # The SOAP message, kept in memory
+            self._writer = self._root
+        elif self._content_id is not None and content_id == self._content_id:
+            self._document_found()
+            if headers.get("Content-Transfer-Encoding", "binary").lower() == "base64":
+                self._writer = _Base64Decoder(self.spool)
+            else:
+                self._writer = self.spool
+        else:
+            self._writer = None
+
+    def _body(self):
+        index = self._buffer.find(self._delimiter)
+        if index < 0:
+            # Keep enough bytes to recognize a delimiter that is split over two chunks
+            end = len(self._buffer) - len(self._delimiter)
+            if end > 0:
+                self._write(self._buffer[:end])
+                del self._buffer[:end]
+            return False
+        self._write(self._buffer[:index])
+        del self._buffer[:index + len(self._delimiter)]
+        self._end_part()
+        self._state = self._delimiter_end
+        return True
+
+    def _write(self, data):
+        if self._writer is not None:
+            self._writer.write(bytes(data))
+
+    def _end_part(self):
+        if isinstance(self._writer, _Base64Decoder):
+            self._writer.close()
+        if self._part == 1:
+            self._read_root()
+        self._writer = None
+
+    def _read_root(self):
+        root = self._root.getvalue()
+        self._root = None
+        include = _XOP_INCLUDE(etree.fromstring(root))
+        if include:
+            # href="cid:<url encoded content id>"
+            href = include[0]
+            self._content_id = unquote(href[len("cid:"):] if href.startswith("cid:") else href)
+            self.xml = root
+        else:
+            # The document may still be inline in the SOAP message
+            inline = InlineDocumentReader(self.spool)
+            inline.feed(root)
+            inline.close()
+            if inline.found:
+                self._document_found()
+            self.xml = inline.xml
+
+    def _epilogue(self):
+        self._buffer = bytearray()
+        return False
+
+    def close(self):
+        if self.found and self._state != self._epilogue:
+            raise ValueError("Incomplete multipart document response")
+
+
+def document_reader(response, spool):
+    """
+    Get the reader for the response
+    :param response: the (streamed) requests response of a getDocument call
+    :param spool: the file to write the document to
+    :return: DocumentReader
+    """
+    content_type = Message()
+    content_type["Content-Type"] = response.headers.get("Content-Type", "text/xml")
+    if content_type.get_content_type() == "multipart/related" and content_type.get_param("boundary"):
+        return MultipartDocumentReader(spool, content_type.get_param("boundary"))
+    return InlineDocumentReader(spool)
+
+
+def read_document(response, chunk_size=CHUNK_SIZE):
+    """
+    Read the document of a getDocument response while it is being received
+    :param response: the (streamed) requests response of a getDocument call
+    :param chunk_size: the number of bytes to read at a time
+    :return: the closed DocumentReader, its spool file holds the document when it has been found
+    """
+    reader = document_reader(response, SpooledTemporaryFile(max_size=SPOOL_SIZE))
+    for chunk in response.iter_content(chunk_size):
+        reader.feed(chunk)
+    reader.close()
+    return reader
+
+
+def get_file_name(xml):
+    """ The file name of the document in a getDocument SOAP message """
+    return _FILE_NAME(etree.fromstring(xml))
+
+
+def iter_document(reader, chunk_size=CHUNK_SIZE):
+    """
+    Yield the document that a reader has found, the spool file is closed afterwards
+    """
+    try:
+        reader.spool.seek(0)
+        while True:
+            chunk = reader.spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        reader.spool.close()
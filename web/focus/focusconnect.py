@@ -4,25 +4,105 @@ This module represents a connection with Focus.
 The connection can be established, re-established (reset method)
 The connection exposes the aanvragen and document methods of the underlying Focus SOAP API
 """
-import base64
-import re
 import logging
-import xmltodict
-from bs4 import BeautifulSoup
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 
-from requests import Session, ConnectionError
+from requests import ConnectionError, HTTPError, Response, Timeout
 from requests.auth import HTTPBasicAuth
 from zeep import Client
+from zeep.cache import SqliteCache
 from zeep.transports import Transport
-
-from .focusinterpreter import convert_aanvragen, convert_jaaropgaven, convert_uitkeringsspecificaties, convert_e_aanvraag_TOZO, convert_stadspas
+from zeep.wsdl import Document
+
+from .cache import cached
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .client_pool import ClientPool
+from .config import get_client_pool_size, get_reconnect_delay, get_reconnect_max_delay, get_wsdl_cache_path, \
+    get_wsdl_cache_timeout
+from .deadline import DeadlineSession
+from .document_reader import get_file_name, iter_document, read_document
+from . import focusinterpreter, focusinterpreter_lxml
+from .focusinterpreter import parse_aanvragen
 from .measure_time import MeasureTime
+from .request_log import record_size
+from .negative_cache import negative_cached
+from .single_flight import coalesced
+from .tracing import REQUEST_ID_HEADER, get_request_id
 
 logger = logging.getLogger(__name__)
 
 
 LOG_RAW = False
 
+# Set while an operation should not read the response body up front, see FocusSession
+_stream_response = ContextVar("stream_response", default=False)
+
+# The modules that can be used to interpret the Focus responses, see config.py
+INTERPRETERS = {
+    'bs4': focusinterpreter,
+    'lxml': focusinterpreter_lxml,
+}
+
+
+# The start tag of a SOAP envelope, with or without a namespace prefix
+_SOAP_ENVELOPE = re.compile(rb"<(?:[\w.-]+:)?Envelope[\s>]")
+
+# The parsed WSDL documents by location, shared by all clients of the process
+_wsdl_documents = {}
+_wsdl_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def get_wsdl_cache():
+    """ The cache on disk of the remote WSDL and schema files, None if disabled """
+    path = get_wsdl_cache_path()
+    return SqliteCache(path=path, timeout=get_wsdl_cache_timeout()) if path else None
+
+
+def create_client(location, transport):
+    """
+    Create a client for the WSDL at location
+    The WSDL is parsed by the first client, the next clients share the parsed document
+    """
+    with _wsdl_lock:
+        client = Client(wsdl=_wsdl_documents.get(location, location), transport=transport)
+        if isinstance(client.wsdl, Document):
+            _wsdl_documents[location] = client.wsdl
+        return client
+
+
+class InvalidResponseError(HTTPError):
+    """ The response is no answer of Focus, e.g. an error page of a proxy """
+
+
+class FocusSession(DeadlineSession):
+    """
+    Streams the responses of the operations that are called within streamed_response()
+    Passes the id of the request on to Focus, when the request is traced
+    """
+
+    def request(self, *args, **kwargs):
+        if _stream_response.get():
+            kwargs['stream'] = True
+        request_id = get_request_id()
+        if request_id is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{REQUEST_ID_HEADER: request_id})
+        return super().request(*args, **kwargs)
+
+
+@contextmanager
+def streamed_response():
+    token = _stream_response.set(True)
+    try:
+        yield
+    finally:
+        _stream_response.reset(token)
+
 
 class FocusConnection:
     """ This class encapsulates the (SOAP) connection with Focus"""
@@ -35,26 +115,33 @@ class FocusConnection:
         """
         self._config = config
         self._credentials = credentials
-        self._client = self._initialize_client()
+        self._interpreter = INTERPRETERS[config.get('interpreter', 'bs4')]
+        self._factory = self._initialize_client
+        self._reconnect_lock = threading.Lock()
+        self._reconnecting = False
+        self._pool = self._create_pool()
+        if not self._pool.is_alive():
+            self.reset()
 
     def _initialize_client(self):
         """
         Use the configuration details that have been supplied at object creation time to establish a
         connection to the Focus SOAP API.
-        The resulting service should be registered by the caller with the object in self._client
+        Each client has its own session, the clients are created on demand by the client pool
         :return: Object
         """
         logger.info('Establishing a connection with Focus')
 
-        session = Session()
+        # The timeout of each operation is limited by the deadline of the request
+        session = FocusSession()
         session.auth = HTTPBasicAuth(self._credentials['username'], self._credentials['password'])
 
         timeout = 9    # Timeout period for getting WSDL and operations in seconds
 
         try:
-            transport = Transport(session=session, timeout=timeout, operation_timeout=timeout)
+            transport = Transport(session=session, timeout=timeout, operation_timeout=timeout, cache=get_wsdl_cache())
 
-            client = Client(wsdl=self._config['wsdl'], transport=transport)
+            client = create_client(self._config['wsdl'], transport)
 
             return client
         except ConnectionError as e:
@@ -65,28 +152,133 @@ class FocusConnection:
             logger.error('Failed to establish a connection with Focus: {} {}'.format(type(error), str(error)))
             return None
 
+    def _create_pool(self):
+        return ClientPool(self._factory, get_client_pool_size(), close=self._close_client)
+
+    @staticmethod
+    def _close_client(client):
+        """ Close the connections of a client that is no longer used """
+        transport = getattr(client, "transport", None)
+        if transport is not None:
+            transport.session.close()
+
+    def _check_response(self, response, content):
+        """
+        Check that a response is an answer of Focus, zeep does not raise an exception for a 5xx response with
+        raw_response. A SOAP fault has status 500 as well (SOAP 1.1), it is an answer and not an error
+        :raises InvalidResponseError: for a response that is not SOAP, or a 5xx response without a SOAP fault
+        """
+        if _SOAP_ENVELOPE.search(content) is None or \
+                (response.status_code >= 500 and self._interpreter.parse_soap_response(content)[1] is None):
+            raise InvalidResponseError(f"Invalid response from Focus with status {response.status_code}",
+                                       response=response)
+
+    @contextmanager
+    def _guard(self, operation):
+        """
+        Guard a Focus call with the circuit breaker of its operation
+        The connection is re-established when the call could not connect to Focus, or when it timed out and that
+        opened the breaker. Other failures (e.g. a single timeout or a server error) leave the clients in place
+        """
+        call = None
+        reset = False
+        try:
+            with get_breaker(f"focus {operation}").guard() as call:
+                yield call
+        except ConnectionError as error:
+            reset = not isinstance(error, CircuitOpenError)
+            raise
+        except Timeout:
+            reset = call is not None and call.opened
+            raise
+        finally:
+            if reset:
+                self.reset()
+
     def reset(self):
-        self._client = self._initialize_client()
+        """
+        Re-establish the connection in a background thread, at most one reconnect runs at a time
+        The current clients are used until the new connection is available.
+        While there is no connection at all the calls fail immediately
+        """
+        with self._reconnect_lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect, name="focus reconnect", daemon=True).start()
+
+    def _reconnect(self):
+        """ Try to connect until it succeeds, the delay between the attempts doubles up to a maximum """
+        delay = get_reconnect_delay()
+        try:
+            while True:
+                pool = self._create_pool()
+                if pool.is_alive():
+                    replaced, self._pool = self._pool, pool
+                    # The clients of the replaced pool are closed when the calls that use them are finished
+                    replaced.close()
+                    return
+                logger.warning(f'Reconnecting to Focus in {delay} seconds')
+                time.sleep(delay)
+                delay = min(delay * 2, get_reconnect_max_delay())
+        finally:
+            with self._reconnect_lock:
+                self._reconnecting = False
 
     def is_alive(self):
         """
         Tells whether the connection with Focus is available.
         :return: boolean
         """
-        return self._client is not None
+        return self._pool.is_alive()
 
-    def _log_soap_faultstring(self, raw_xml, prefix=''):
-        result = re.search(r'<faultstring>.*<\/faultstring>', raw_xml)
-        if result:
-            faultstring = result.group(0)
+    def pool_stats(self):
+        """ The state of the client pool, see ClientPool.stats """
+        return self._pool.stats()
 
+    @staticmethod
+    def _log_soap_fault(faultstring, content, prefix='', level=logging.ERROR):
+        """
+        Log why a response has no body
+        :param faultstring: the faultstring of the response, if any
+        :param content: the raw response, logged when there is no faultstring
+        """
+        if faultstring is not None:
             # remove the ever changing number
             faultstring = re.sub(r'nl.amsterdam.dwi.onlineklantbeeld.model.DocumentLocatie#\d+', 'nl.amsterdam.dwi.onlineklantbeeld.model.DocumentLocatie', faultstring)
 
-            logger.error(f'{prefix} {faultstring}')
+            logger.log(level, f'{prefix} {faultstring}')
         else:
-            logger.error(f'{prefix} {raw_xml}')
+            logger.log(level, f'{prefix} {content.decode("utf-8", errors="replace")}')
 
+    def _call(self, operation, log_prefix, log_level=logging.ERROR, **kwargs):
+        """
+        Call a Focus SOAP operation and parse its raw response once
+        :param operation: the name of the SOAP operation
+        :param log_prefix: the message to log when the response has no body
+        :param kwargs: the parameters of the operation
+        :return: the return element of the response, to be handed to the converters of the interpreter.
+                 None if the response has no return element (e.g. a SOAP fault)
+        :raises InvalidResponseError: when the response is no answer of Focus, see _check_response
+        """
+        with self._guard(operation), MeasureTime("soap", operation=operation), \
+                self._pool.client() as client, client.settings(raw_response=True):
+            response = getattr(client.service, operation)(**kwargs)
+            content = response.content
+            self._check_response(response, content)
+        record_size(operation, len(content))
+        if LOG_RAW:
+            print(content.decode("utf-8"))
+
+        with MeasureTime("parse", operation=operation):
+            body, faultstring = self._interpreter.parse_soap_response(content)
+        if body is None:
+            # This can return something else apparently. Lets log this so we can debug this.
+            self._log_soap_fault(faultstring, content, log_prefix, log_level)
+        return body
+
+    @coalesced('aanvragen')
+    @cached('aanvragen')
     def aanvragen(self, bsn, url_root):
         """
         Retrieve the aanvragen from Focus
@@ -95,76 +287,78 @@ class FocusConnection:
         :return: Dictionary
         """
 
-        with self._client.settings(raw_response=True):
-            # Get raw response as string remove any newlines
-            raw_aanvragen = self._client.service.getAanvragen(bsn=bsn).content.decode("utf-8").replace("\n", "")
-            # Get the return component out of the SOAP message
-            result = re.search(r"<return>.*<\/return>", raw_aanvragen)
-            if not result:
-                # This can return something else apparently. Lets log this so we can debug this.
-                self._log_soap_faultstring(raw_aanvragen, "no body?")
-                return []
-            xml_aanvragen = result.group(0)
-            # Translate the response to a Dictionary
-            aanvragen = xmltodict.parse(xml_aanvragen)["return"]
-            # Convert dict types for lists, ints and bools
-            aanvragen = convert_aanvragen(aanvragen, url_root)
+        with self._guard("getAanvragen"), MeasureTime("soap", operation="getAanvragen"), \
+                self._pool.client() as client, client.settings(raw_response=True):
+            response = client.service.getAanvragen(bsn=bsn)
+            raw_aanvragen = response.content
+            self._check_response(response, raw_aanvragen)
+        record_size("getAanvragen", len(raw_aanvragen))
+        # Parse and convert the return component of the SOAP message in one pass
+        with MeasureTime("parse", operation="getAanvragen"):
+            aanvragen, faultstring = parse_aanvragen(raw_aanvragen, url_root)
+        if aanvragen is None:
+            # This can return something else apparently. Lets log this so we can debug this.
+            self._log_soap_fault(faultstring, raw_aanvragen, "no body?")
+            return []
 
         return aanvragen
 
+    @coalesced('jaaropgaven')
+    @cached('jaaropgaven')
     def jaaropgaven(self, bsn, url_root):
-        with self._client.settings(raw_response=True):
-            raw_jaaropgaven = self._client.service.getJaaropgaven(bsn=bsn).content.decode("utf-8").replace("\n", "")
-            result = re.search(r"<return>.*<\/return>", raw_jaaropgaven)
-            if not result:
-                # This can return something else apparently. Lets log this so we can debug this.
-                self._log_soap_faultstring(raw_jaaropgaven, "no body jaaropgaven?")
-                return []
-            xml_jaaropgaven = result.group(0)
-            jaaropgaven = convert_jaaropgaven(xml_jaaropgaven, url_root)
-            return jaaropgaven
-
+        body = self._call('getJaaropgaven', "no body jaaropgaven?", bsn=bsn)
+        if body is None:
+            return []
+        with MeasureTime("parse", operation="getJaaropgaven"):
+            return self._interpreter.convert_jaaropgaven(body, url_root)
+
+    @coalesced('uitkeringsspecificaties')
+    @cached('uitkeringsspecificaties')
     def uitkeringsspecificaties(self, bsn, url_root):
-        with self._client.settings(raw_response=True):
-            raw_specificaties = self._client.service.getUitkeringspecificaties(bsn=bsn).content.decode("utf-8").replace("\n", "")
-
-            result = re.search(r"<return>.*<\/return>", raw_specificaties)
-            if not result:
-                # This can return something else apparently. Lets log this so we can debug this.
-                self._log_soap_faultstring(raw_specificaties, "no body uitkeringspec?")
-                return []
-            xml_uitkeringspec = result.group(0)
-            uitkeringsspecificaties = convert_uitkeringsspecificaties(xml_uitkeringspec, url_root)
-            return uitkeringsspecificaties
-
+        body = self._call('getUitkeringspecificaties', "no body uitkeringspec?", bsn=bsn)
+        if body is None:
+            return []
+        with MeasureTime("parse", operation="getUitkeringspecificaties"):
+            return self._interpreter.convert_uitkeringsspecificaties(body, url_root)
+
+    @negative_cached('tozodocumenten')
+    @coalesced('tozodocumenten')
+    @cached('tozodocumenten')
     def EAanvragenTozo(self, bsn, url_root):
-        with self._client.settings(raw_response=True):
-            raw_tozo_documenten = self._client.service.getEAanvraagTOZO(bsn=bsn).content.decode("utf-8").replace("\n", "")
-            tree = BeautifulSoup(raw_tozo_documenten, features="lxml-xml")
-            aanvragen = tree.find('getEAanvraagTOZOResponse')
-            if not aanvragen:
-                try:
-                    faultsstring = tree.find('faultstring')
-                    logger.debug(faultsstring)
-                except Exception as e:
-                    logger.exception(e)
-                return []
-            tozo_documenten = convert_e_aanvraag_TOZO(tree, url_root)
-            return tozo_documenten
-
+        # Most clients do not have any TOZO documents, the response is empty then
+        body = self._call('getEAanvraagTOZO', "no body tozo?", logging.DEBUG, bsn=bsn)
+        if body is None:
+            return []
+        with MeasureTime("parse", operation="getEAanvraagTOZO"):
+            return self._interpreter.convert_e_aanvraag_TOZO(body, url_root)
+
+    @negative_cached('stadspas', empty=lambda: None)
+    @coalesced('stadspas')
+    @cached('stadspas')
     def stadspas(self, bsn):
-        with self._client.settings(raw_response=True):
-            with MeasureTime("stadspas soap"):
-                raw_stadspas = self._client.service.getStadspas(bsn=bsn).content.decode("utf-8").replace("\n", "")
-            tree = BeautifulSoup(raw_stadspas, features="lxml-xml")
-            if LOG_RAW:
-                print(tree.prettify())
-            stadspas = tree.find('getStadspasResponse')
-            if not stadspas:
-                self._log_soap_faultstring(raw_stadspas, 'no stadspas?')
-            data = convert_stadspas(tree)
-
-            return data
+        body = self._call('getStadspas', 'no stadspas?', bsn=bsn)
+        if body is None:
+            return None
+        with MeasureTime("parse", operation="getStadspas"):
+            return self._interpreter.convert_stadspas(body)
+
+    @staticmethod
+    def _process_reply(client, operation, response, content):
+        """
+        Deserialize a raw response like the client does for a call without raw_response
+        :param client: the client that has called the operation
+        :param operation: the name of the operation that has been called
+        :param response: the raw response, its content has been read already
+        :param content: the content of the response
+        :return: the result of the operation
+        """
+        reply = Response()
+        reply.status_code = response.status_code
+        reply.headers = response.headers
+        reply.encoding = response.encoding
+        reply._content = content
+        binding = client.service._binding
+        return binding.process_reply(client, binding.get(operation), reply)
 
     def document(self, bsn, id, isBulk, isDms):
         """
@@ -177,30 +371,40 @@ class FocusConnection:
         """
         header_value = {'Accept': 'application/xop+xml'}
 
-        # Get the document
-        with self._client.settings(raw_response=True, extra_http_headers=header_value):
-            raw_document = self._client.service.getDocument(id=id, bsn=bsn, isBulk=isBulk, isDms=isDms)
-
-        tree = BeautifulSoup(raw_document.content, features="lxml-xml")
-        data_element = tree.find('dataHandler')
-        if not data_element:
-            doc = self._client.service.getDocument(id=id, bsn=bsn, isBulk=isBulk, isDms=isDms)
-            if doc['dataHandler']:
-                data = doc['dataHandler']
-                filename = doc['fileName']
-                logger.error("fallback document method is used")
+        with self._guard("getDocument"), MeasureTime("soap", operation="getDocument"), \
+                self._pool.client() as client:
+            # Get the document, it is read while it is being received
+            with client.settings(raw_response=True, extra_http_headers=header_value), streamed_response():
+                response = client.service.getDocument(id=id, bsn=bsn, isBulk=isBulk, isDms=isDms)
+            try:
+                reader = read_document(response)
+            finally:
+                response.close()
+
+            if reader.found:
+                filename = get_file_name(reader.xml)
+                size = reader.spool.tell()
+                data = iter_document(reader)
             else:
-                return None
-        else:
-            data = data_element.text
-            data = base64.b64decode(data)
-            filename = tree.find('fileName').text
+                reader.spool.close()
+                self._check_response(response, reader.raw)
+                # The document was not recognized in the response, deserialize the response that has been read
+                doc = self._process_reply(client, 'getDocument', response, reader.raw)
+                if doc and doc['dataHandler']:
+                    data = doc['dataHandler']
+                    filename = doc['fileName']
+                    size = len(data)
+                    logger.error("fallback document method is used")
+                else:
+                    return None
+        record_size("getDocument", size)
         mime_type = "application/pdf" if ".pdf" in filename else "application/octet-stream"
 
         document = {
             "fileName": filename,
             "contents": data,
             "mime_type": mime_type,
+            "size": size,
         }
 
         return document
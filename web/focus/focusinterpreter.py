@@ -6,14 +6,19 @@ See also the convert_aanvragen method for a more detailed explanation.
 """
 import logging
 from datetime import date
+from io import BytesIO
 
 from bs4 import BeautifulSoup
 from dateutil import parser
+from lxml import etree
 
 from focus.config import urls
+from focus.request_log import count
 
 logger = logging.getLogger(__name__)
 
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
 
 def _to_str(obj, key):
     value = obj.get(key, None)
@@ -117,6 +122,28 @@ def _convert_product(product, url_root):
     product["_meest_recent"] = most_recent
 
 
+def _convert_soort_product(idx_soort_product, soort_product, url_root):
+    """
+    Convert the products of one soortProduct
+    :param idx_soort_product: the index of the soortProduct in the aanvragen response
+    :param soort_product: the soortProduct object
+    :param url_root: the root of the url
+    :return: The list of converted products
+    """
+    _to_list(soort_product, "product")
+    for idx_product, product in enumerate(soort_product["product"]):
+        product["_id"] = f"{idx_soort_product}-{idx_product}"
+        product["soortProduct"] = soort_product["naam"]
+        _convert_product(product, url_root)
+    return soort_product["product"]
+
+
+def _count_producten(producten):
+    """ Record the number of producten and their processtappen in the slow request log, see request_log.py """
+    count("producten", len(producten))
+    count("processtappen", sum(len(product['processtappen']) for product in producten if 'processtappen' in product))
+
+
 def convert_aanvragen(aanvragen, url_root):
     """Convert the aanvragen response to a uniformly formatted object
     When converting SOAP to json arrays of only one value gets translated into an object
@@ -140,21 +167,145 @@ def convert_aanvragen(aanvragen, url_root):
         # Type corrections
         _to_list(aanvragen, "soortProduct")
         for idx_soort_product, soort_product in enumerate(aanvragen["soortProduct"]):
-            _to_list(soort_product, "product")
-            for idx_product, product in enumerate(soort_product["product"]):
-                product["_id"] = f"{idx_soort_product}-{idx_product}"
-                product["soortProduct"] = soort_product["naam"]
-                _convert_product(product, url_root)
-                producten.append(product)
+            producten += _convert_soort_product(idx_soort_product, soort_product, url_root)
     except Exception as error:
         logger.error('Failed to convert aanvragen: {}'.format(str(error)))
         raise error
 
-    stappen = [len(product['processtappen']) for product in producten if 'processtappen' in product]
-    print("Aantal producten: %i, Stappen: %i" % (len(producten), sum(stappen)))
+    _count_producten(producten)
     return producten
 
 
+def _element_name(element):
+    local_name = etree.QName(element).localname
+    return f"{element.prefix}:{local_name}" if element.prefix else local_name
+
+
+def _attribute_name(element, name):
+    """ The name of an attribute as written, e.g. xsi:nil instead of {http://www.w3.org/2001/XMLSchema-instance}nil """
+    qname = etree.QName(name)
+    if qname.namespace is None:
+        return name
+    if qname.namespace == XML_NAMESPACE:
+        return f"xml:{qname.localname}"
+    prefix = next((prefix for prefix, uri in element.nsmap.items() if uri == qname.namespace and prefix), None)
+    return f"{prefix}:{qname.localname}" if prefix else name
+
+
+def _element_text(text):
+    # Newlines are removed from the raw response before it was handed to xmltodict
+    return text.replace("\n", "").strip()
+
+
+def _push_value(obj, key, value):
+    """ Add a value to obj, a repeated key turns the value into a list (as xmltodict does) """
+    if key not in obj:
+        obj[key] = value
+    elif isinstance(obj[key], list):
+        obj[key].append(value)
+    else:
+        obj[key] = [obj[key], value]
+
+
+def _element_to_dict(element):
+    """
+    Convert an lxml element to the same object that xmltodict would produce for it
+    Elements with only text become strings, empty elements become None
+    :param element: lxml element
+    :return: Dictionary, string or None
+    """
+    obj = {}
+    # xmltodict does not process namespaces, it keeps the declarations and the prefixed names of the attributes
+    parent = element.getparent()
+    inherited = {} if parent is None else parent.nsmap
+    for prefix, uri in element.nsmap.items():
+        if prefix not in inherited or inherited[prefix] != uri:
+            obj["@xmlns" if prefix is None else f"@xmlns:{prefix}"] = _element_text(uri)
+    for name, value in element.attrib.items():
+        obj[f"@{_attribute_name(element, name)}"] = _element_text(value)
+
+    text = [element.text or ""]
+    for child in element:
+        if isinstance(child.tag, str):
+            _push_value(obj, _element_name(child), _element_to_dict(child))
+        text.append(child.tail or "")
+    text = _element_text("".join(text))
+
+    if not obj:
+        return text or None
+    if text:
+        obj["#text"] = text
+    return obj
+
+
+def _iterparse_return(content):
+    """
+    Parse a raw SOAP response incrementally
+    Yields the return element as soon as it starts, followed by each of its children once it has been read.
+    A child is released after it has been handled, so the tree never holds more than one child.
+    When the response has no return element, the faultstring element is yielded instead.
+    :param content: The raw response (bytes)
+    :return: generator of lxml elements
+    """
+    return_element = None
+    for event, element in etree.iterparse(BytesIO(content), events=("start", "end")):
+        if return_element is None:
+            if event == "start" and _element_name(element) == "return":
+                return_element = element
+                yield return_element
+            elif event == "end" and etree.QName(element).localname == "faultstring":
+                yield element
+        elif element is return_element:
+            return
+        elif event == "end" and element.getparent() is return_element:
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del return_element[0]
+
+
+def parse_aanvragen(content, url_root):
+    """
+    Parse the raw getAanvragen SOAP response and convert it in a single pass
+    Each soortProduct is converted (see convert_aanvragen) as soon as it has been read and then discarded,
+    so the complete response is never held as a tree or as a dictionary
+    :param content: The raw response (bytes)
+    :param url_root: This value is used to construct a reference to the associating documents
+    :return: (producten, faultstring) The list of aanvraag producten, None if the response has no return element,
+             and the faultstring of the response, if any
+    """
+    try:
+        producten, faultstring = _convert_aanvragen_elements(_iterparse_return(content), url_root)
+    except etree.XMLSyntaxError as error:
+        logger.error('Failed to parse aanvragen: {}'.format(str(error)))
+        return None, None
+    except Exception as error:
+        logger.error('Failed to convert aanvragen: {}'.format(str(error)))
+        raise error
+
+    if producten is not None:
+        _count_producten(producten)
+    return producten, faultstring
+
+
+def _convert_aanvragen_elements(elements, url_root):
+    producten = None
+    faultstring = None
+    idx_soort_product = 0
+    for element in elements:
+        name = _element_name(element)
+        if producten is None:
+            if name == "return":
+                producten = []
+            else:
+                faultstring = element.text
+        elif name == "soortProduct":
+            soort_product = _element_to_dict(element)
+            producten += _convert_soort_product(idx_soort_product, soort_product, url_root)
+            idx_soort_product += 1
+    return producten, faultstring
+
+
 def get_document_id(doc):
     return doc.find('id', recursive=False).string
 
@@ -168,9 +319,8 @@ def get_document_id(doc):
 #   | 'BIBI'
 #   | 'PART'
 #   | 'BBZ';
-def convert_jaaropgaven(jaaropgaven_xml, document_root):
+def convert_jaaropgaven(tree, document_root):
     jaar_opgaven_list = []
-    tree = BeautifulSoup(jaaropgaven_xml, features="lxml-xml")
     documents = tree.select('document')
     for doc in documents:
         id = get_document_id(doc)
@@ -191,9 +341,8 @@ def convert_jaaropgaven(jaaropgaven_xml, document_root):
     # uitkeringspecificatie is maandelijks
 
 
-def convert_uitkeringsspecificaties(uitkeringspec_xml, document_root):
+def convert_uitkeringsspecificaties(tree, document_root):
     jaar_opgaven_list = []
-    tree = BeautifulSoup(uitkeringspec_xml, features="lxml-xml")
     documents = tree.select('document')
     for doc in documents:
         id = get_document_id(doc)
@@ -240,20 +389,23 @@ def convert_e_aanvraag_TOZO(tree, document_root):
     return jaar_opgaven_list
 
 
+def _find_text(element, name):
+    node = element.find(name)
+    return None if node is None else node.text
+
+
 def has_groene_stip(fondsen):
     # Client needs to have a "toekenning" of a certain type
     passed = False
     for f in fondsen:
-        besluit = f.find("besluit").text
-        if besluit != "toekenning":
+        if f["besluit"] != "toekenning":
             continue
 
-        soort_fonds = f.find("soortFonds").text
-        if soort_fonds not in ["3555", "3556", "3557", "3558"]:
+        if f["soortFonds"] not in ["3555", "3556", "3557", "3558"]:
             continue
 
-        start = parser.isoparse(f.find("dtbegin").text).date()
-        end = parser.isoparse(f.find("dteinde").text).date()
+        start = parser.isoparse(f["dtbegin"]).date()
+        end = parser.isoparse(f["dteinde"]).date()
 
         today = date.today()
         if not (start < today < end):
@@ -265,21 +417,12 @@ def has_groene_stip(fondsen):
     return passed
 
 
-def convert_stadspas(tree):
-    administratienummer_node = tree.find("administratienummer")
-    if not administratienummer_node:
-        return None
-
-    adminstratienummer = administratienummer_node.text
-    fondsen = tree.find('fondsen').find_all('fonds', recursive=False)
-    passed = has_groene_stip(fondsen)
-
+def get_stadspas_type(fondsen):
     pas_type = None
     for fonds in fondsen:
-        soort = fonds.find("soortFonds").text
+        soort = fonds["soortFonds"]
 
-        besluit = fonds.find("besluit").text
-        if besluit != "toekenning":
+        if fonds["besluit"] != "toekenning":
             continue
 
         if soort == "3555":
@@ -288,11 +431,48 @@ def convert_stadspas(tree):
             pas_type = "partner"
         elif soort == "3557":
             pas_type = "kind"
+    return pas_type
+
 
-    if not passed:
+def convert_fondsen(adminstratienummer, fondsen):
+    """
+    Convert the stadspas fondsen of a client
+    :param adminstratienummer: the administratienummer of the client
+    :param fondsen: list of dictionaries with the besluit, soortFonds, dtbegin and dteinde of each fonds
+    :return: Dictionary with the administratienummer and pas type, empty if the client has no groene stip
+    """
+    if not has_groene_stip(fondsen):
         return {}
 
     return {
         "adminstratienummer": adminstratienummer,
-        "type": pas_type,
+        "type": get_stadspas_type(fondsen),
     }
+
+
+def convert_stadspas(tree):
+    administratienummer_node = tree.find("administratienummer")
+    if not administratienummer_node:
+        return None
+
+    adminstratienummer = administratienummer_node.text
+    fondsen = [
+        {name: _find_text(fonds, name) for name in ["besluit", "soortFonds", "dtbegin", "dteinde"]}
+        for fonds in tree.find('fondsen').find_all('fonds', recursive=False)
+    ]
+    return convert_fondsen(adminstratienummer, fondsen)
+
+
+def parse_soap_response(content):
+    """
+    Parse a raw Focus SOAP response
+    :param content: the raw response (bytes)
+    :return: (body, faultstring) the return element to hand to the converters of this module and
+             the faultstring of the response, both None if absent
+    """
+    tree = BeautifulSoup(content, features="lxml-xml")
+    body = tree.find('return')
+    if body is not None:
+        return body, None
+    fault = tree.find('faultstring')
+    return None, None if fault is None else fault.text
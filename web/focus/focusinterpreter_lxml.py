@@ -0,0 +1,155 @@
+""" Focus Interpreter (lxml)
+
+This module offers the converters of the focusinterpreter module on top of lxml instead of BeautifulSoup.
+All lookups are precompiled XPath expressions. Like BeautifulSoup the expressions match elements by their
+local name, and a lookup of a single element takes the first match in document order.
+
+The backend that is used is selected by the FOCUS_INTERPRETER setting, see config.py
+"""
+import logging
+
+from lxml import etree
+
+from focus.config import urls
+from focus.focusinterpreter import convert_fondsen
+
+logger = logging.getLogger(__name__)
+
+
+def _descendant(name):
+    return f'descendant::*[local-name()="{name}"][1]'
+
+
+def _child(name):
+    return f'*[local-name()="{name}"][1]'
+
+
+_RETURN = etree.XPath('descendant-or-self::*[local-name()="return"][1]')
+_FAULTSTRING = etree.XPath('descendant-or-self::*[local-name()="faultstring"][1]')
+
+_ALL_DOCUMENTS = etree.XPath('descendant-or-self::*[local-name()="document"]')
+_DOCUMENT_ID = etree.XPath(_child("id"))
+_DOCUMENT_TITLE = etree.XPath(f'{_descendant("documentCode")}/{_descendant("omschrijving")}')
+_DOCUMENT_END_DATE = etree.XPath(_descendant("einddatumDocument"))
+_DOCUMENT_VARIANT = etree.XPath(_descendant("variant"))
+
+_ALL_DOCUMENTGEGEVENS = etree.XPath('descendant-or-self::*[local-name()="documentgegevens"]')
+_DOCUMENTGEGEVENS = {
+    name: etree.XPath(_descendant(name))
+    for name in ["documentId", "isBulk", "isDms", "datumDocument", "documentCodeId", "documentCode", "documentOmschrijving"]
+}
+
+_ADMINISTRATIENUMMER = etree.XPath('descendant-or-self::*[local-name()="administratienummer"][1]')
+_ALL_FONDS = etree.XPath('descendant-or-self::*[local-name()="fondsen"][1]/*[local-name()="fonds"]')
+_FONDS = {
+    name: etree.XPath(_descendant(name))
+    for name in ["besluit", "soortFonds", "dtbegin", "dteinde"]
+}
+
+
+def _text(element):
+    return "".join(element.itertext())
+
+
+def _first_text(element, xpath):
+    """
+    The text of the first element that xpath finds
+    :raises ValueError: when there is no such element
+    """
+    found = xpath(element)
+    if not found:
+        raise ValueError(f"Element not found: {xpath.path}")
+    return _text(found[0])
+
+
+def _optional_text(element, xpath, default=None):
+    found = xpath(element)
+    return _text(found[0]) if found else default
+
+
+def _document_url(document_root, id, bulk="false", dms="false"):
+    doc_url = urls['document'][1:]
+    return f"{document_root}{doc_url}?id={id}&isBulk={bulk}&isDms={dms}"
+
+
+def _get_document_id(doc):
+    found = _DOCUMENT_ID(doc)
+    if not found:
+        raise ValueError("Document without id")
+    return found[0].text
+
+
+def convert_jaaropgaven(tree, document_root):
+    jaar_opgaven_list = []
+    for doc in _ALL_DOCUMENTS(tree):
+        id = _get_document_id(doc)
+        jaar_opgaven_list.append({
+            'title': _first_text(doc, _DOCUMENT_TITLE),
+            'datePublished': _first_text(doc, _DOCUMENT_END_DATE),
+            'id': id,
+            'url': _document_url(document_root, id),
+            'type': '',
+        })
+    return jaar_opgaven_list
+
+
+def convert_uitkeringsspecificaties(tree, document_root):
+    jaar_opgaven_list = []
+    for doc in _ALL_DOCUMENTS(tree):
+        id = _get_document_id(doc)
+        jaar_opgaven_list.append({
+            'id': id,
+            'title': _first_text(doc, _DOCUMENT_TITLE),
+            'datePublished': _first_text(doc, _DOCUMENT_END_DATE),
+            'url': _document_url(document_root, id),
+            'type': _optional_text(doc, _DOCUMENT_VARIANT, ''),
+        })
+    return jaar_opgaven_list
+
+
+def convert_e_aanvraag_TOZO(tree, document_root):
+    jaar_opgaven_list = []
+    for doc in _ALL_DOCUMENTGEGEVENS(tree):
+        values = {name: _first_text(doc, xpath) for name, xpath in _DOCUMENTGEGEVENS.items()}
+        jaar_opgaven_list.append({
+            'id': values['documentId'],
+            'datePublished': values['datumDocument'],
+            'url': _document_url(document_root, values['documentId'], values['isBulk'], values['isDms']),
+            'documentCodeId': values['documentCodeId'],
+            'type': values['documentCode'],
+            'description': values['documentOmschrijving'],
+        })
+    return jaar_opgaven_list
+
+
+def convert_stadspas(tree):
+    found = _ADMINISTRATIENUMMER(tree)
+    if not found:
+        return None
+
+    adminstratienummer = _text(found[0])
+    fondsen = [
+        {name: _optional_text(fonds, xpath) for name, xpath in _FONDS.items()}
+        for fonds in _ALL_FONDS(tree)
+    ]
+    return convert_fondsen(adminstratienummer, fondsen)
+
+
+def parse_soap_response(content):
+    """
+    Parse a raw Focus SOAP response
+    :param content: the raw response (bytes)
+    :return: (body, faultstring) the return element to hand to the converters of this module and
+             the faultstring of the response, both None if absent
+    """
+    try:
+        root = etree.fromstring(content)
+    except etree.XMLSyntaxError as error:
+        logger.error('Failed to parse Focus response: {}'.format(str(error)))
+        return None, None
+
+    body = _RETURN(root)
+    if body:
+        return body[0], None
+    fault = _FAULTSTRING(root)
+    return None, _text(fault[0]) if fault else None
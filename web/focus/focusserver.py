@@ -5,15 +5,20 @@ The server uses the Focus connection class to handle the physical connection wit
 The server interprets requests, execute the corresponding action and return JSON responses
 """
 import logging
+from concurrent.futures import wait
+from functools import partial
 
 from flask import jsonify, request, Response, make_response
 
+from .concurrency import get_executor, submit
+from .deadline import DeadlineExceeded, remaining
 from .measure_time import MeasureTime
+from .request_log import count
 from .gpass_connect import GpassConnection
 from .saml import get_bsn_from_request
-from requests import ConnectionError
+from requests import ConnectionError, Timeout
 
-from .config import get_gpass_bearer_token, get_gpass_api_location
+from .config import get_gpass_bearer_token, get_gpass_api_location, get_combined_concurrent, get_combined_max_workers
 from .utils import volledig_administratienummer
 
 logger = logging.getLogger(__name__)
@@ -32,12 +37,12 @@ class FocusServer:
     def is_alive(self):
         return self._focus_connection.is_alive()
 
-    def _no_connection_response(self):
+    @staticmethod
+    def _no_connection_response():
         """
         Returns a response telling that the Focus API is not accessible
-        Reset the connection so that it will be re-established on the next call
+        The connection re-establishes itself when it is lost, see FocusConnection._guard
         """
-        self._focus_connection.reset()
         return Response(
             'Focus connectivity failed',
             content_type='text/plain',
@@ -63,6 +68,10 @@ class FocusServer:
         """
         return Response('OK', content_type='text/plain')
 
+    def pool_stats(self):
+        """ The number of Focus clients and the time that calls had to wait for one """
+        return self._focus_connection.pool_stats()
+
     def status_data(self):
         """
         If the connection with the Focus SOAP API is alive it is assumed that the data is available
@@ -75,6 +84,8 @@ class FocusServer:
         except Exception:
             pass
 
+        # Re-establish the connection in the background, if this is not in progress already
+        self._focus_connection.reset()
         return self._no_connection_response()
 
     def aanvragen(self):
@@ -99,7 +110,8 @@ class FocusServer:
             logger.exception("Failed to retrieve aanvragen (unknown error): {} {}".format(type(error), str(error)), exc_info=error)
             return self._no_connection_response()
 
-        return jsonify(aanvragen)
+        with MeasureTime("json"):
+            return jsonify(aanvragen)
 
     def _collect_stadspas_data(self, bsn):
         # 2 stage, first get admin number from focus, then data from gpass
@@ -120,40 +132,113 @@ class FocusServer:
             "type": stadspas_data["type"]
         }
 
+    @staticmethod
+    def _measured(name, section):
+        """
+        Retrieve a section, unless the request deadline has passed already
+        A section that has waited for an executor thread until after the deadline frees the thread right away
+        """
+        if remaining() == 0:
+            raise DeadlineExceeded('Request deadline exceeded')
+        with MeasureTime("section", section=name):
+            return section()
+
+    @staticmethod
+    def _count_sections(content):
+        """ Record the cardinalities of the combined response in the slow request log, see request_log.py """
+        count("documenten", sum(len(content[key] or []) for key in ("jaaropgaven", "uitkeringsspecificaties",
+                                                                    "tozodocumenten")))
+        stadspassen = (content["stadspassaldo"] or {}).get("stadspassen") or []
+        count("stadspassen", len(stadspassen))
+        count("budgets", sum(len(stadspas["budgets"]) for stadspas in stadspassen))
+
+    @staticmethod
+    def _section_status(key, error):
+        """
+        Tells the status of a section that failed, the error is logged
+        :return: "timeout" or "error"
+        """
+        if isinstance(error, Timeout):
+            logger.error("Timeout retrieving combined section {}: {}".format(key, type(error)))
+            return "timeout"
+        logger.exception("Failed to retrieve combined section {}: {} {}".format(key, type(error), str(error)), exc_info=error)
+        return "error"
+
+    def _retrieve_sections(self, sections):
+        """
+        Retrieve the sections of a combined response, either one after another or concurrently
+        Sections that fail or do not finish within the request deadline are left empty
+        :param sections: list of (key, timer name, callable) tuples
+        :return: (content, status) Dictionaries with the result and the status of each section by key
+        """
+        content = {key: None for key, _, _ in sections}
+        status = {key: "ok" for key, _, _ in sections}
+
+        if get_combined_concurrent():
+            self._retrieve_sections_concurrently(sections, content, status)
+        else:
+            self._retrieve_sections_sequentially(sections, content, status)
+        return content, status
+
+    def _retrieve_sections_sequentially(self, sections, content, status):
+        for key, name, section in sections:
+            try:
+                content[key] = self._measured(name, section)
+            except Exception as error:
+                status[key] = self._section_status(key, error)
+
+    def _retrieve_sections_concurrently(self, sections, content, status):
+        executor = get_executor("combined", get_combined_max_workers())
+        futures = {key: submit(executor, self._measured, name, section) for key, name, section in sections}
+        wait(futures.values(), timeout=remaining())
+
+        for key, future in futures.items():
+            if not future.done():
+                # Cancel the section if it has not started yet, a running section will run into its own timeout
+                future.cancel()
+                status[key] = self._section_status(key, DeadlineExceeded('Request deadline exceeded'))
+            elif future.exception() is not None:
+                status[key] = self._section_status(key, future.exception())
+            else:
+                content[key] = future.result()
+
     def combined(self):
-        """ Gets all jaaropgaven for the BSN that is encoded in the header SAML token. """
+        """
+        Gets all jaaropgaven for the BSN that is encoded in the header SAML token.
+        Sections that could not be retrieved are left empty, their status tells why ("timeout" or "error")
+        """
 
         try:
             bsn = get_bsn_from_request(request)
         except Exception as error:
             return self._parameter_error_response(error)
 
-        try:
-            with MeasureTime("jaaropgaven"):
-                jaaropgaven = self._focus_connection.jaaropgaven(bsn=bsn, url_root=request.script_root)
-            with MeasureTime("uitkeringspecificaties"):
-                uitkeringsspec = self._focus_connection.uitkeringsspecificaties(bsn=bsn, url_root=request.script_root)
-            with MeasureTime("tozo documenten"):
-                tozo_documents = self._focus_connection.EAanvragenTozo(bsn=bsn, url_root=request.script_root)
-            with MeasureTime("stadspas"):
-                stadspas = self._collect_stadspas_data(bsn)
-
-            return {
-                "status": "OK",
-                "content": {
-                    "jaaropgaven": jaaropgaven,
-                    "uitkeringsspecificaties": uitkeringsspec,
-                    "tozodocumenten": tozo_documents,
-                    "stadspassaldo": stadspas,
-                }
-            }
-        except ConnectionError as error:
-            logger.exception("Failed to retrieve combined: {}".format(type(error)), exc_info=error)
-            return self._no_connection_response()
-        except Exception as error:
-            logger.exception("Failed to retrieve combined (unknown error): {} {}".format(type(error), str(error)), exc_info=error)
+        # The request context is not available in the executor threads
+        url_root = request.script_root
+        sections = [
+            ("jaaropgaven", "jaaropgaven",
+             partial(self._focus_connection.jaaropgaven, bsn=bsn, url_root=url_root)),
+            ("uitkeringsspecificaties", "uitkeringspecificaties",
+             partial(self._focus_connection.uitkeringsspecificaties, bsn=bsn, url_root=url_root)),
+            ("tozodocumenten", "tozo documenten",
+             partial(self._focus_connection.EAanvragenTozo, bsn=bsn, url_root=url_root)),
+            ("stadspassaldo", "stadspas",
+             partial(self._collect_stadspas_data, bsn)),
+        ]
+
+        content, status = self._retrieve_sections(sections)
+
+        if all(section_status != "ok" for section_status in status.values()):
             return self._no_connection_response()
 
+        self._count_sections(content)
+        with MeasureTime("json"):
+            return jsonify({
+                "status": "OK",
+                "content": content,
+                "sections": status,
+            })
+
     def document(self):
         """
         Gets a specific aanvraag document for the BSN that is encoded in the header SAML token
@@ -188,8 +273,9 @@ class FocusServer:
             return "Document not received from source.", 404
 
         # flask.send_file() won't work with content from memory and uWSGI. It expects a file on disk.
-        # Craft a manual request instead
+        # Craft a manual request instead, the contents are streamed when they are not in memory
         response = make_response(document["contents"])
+        response.headers["Content-Length"] = document["size"]
         response.headers["Content-Disposition"] = f'attachment; filename="{document["fileName"]}"'  # make sure it is a download
         response.headers["Content-Type"] = document["mime_type"]
 
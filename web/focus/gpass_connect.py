@@ -1,29 +1,88 @@
 import logging
+import re
+import threading
+from concurrent.futures import wait
+from http.cookiejar import DefaultCookiePolicy
 from pprint import pprint
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from focus.cache import cache_key, cached, revalidated
+from focus.circuit_breaker import get_breaker
+from focus.concurrency import get_executor, submit
+from focus.config import get_gpass_max_workers, get_gpass_pool_connections, get_gpass_pool_maxsize, get_single_flight
 from focus.crypto import encrypt
+from focus.deadline import DeadlineExceeded, get_timeout, remaining
 
 from focus.measure_time import MeasureTime
+from focus.single_flight import get_flights
+from focus.tracing import REQUEST_ID_HEADER, get_request_id
 
 LOG_RAW = False
 
 logger = logging.getLogger(__name__)
 
+# The connections to GPASS are kept alive and shared by all threads of the process
+_adapter = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_adapter():
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(pool_connections=get_gpass_pool_connections(), pool_maxsize=get_gpass_pool_maxsize())
+        return _adapter
+
+
+def get_session():
+    """
+    The session of this thread for calling GPASS
+    A session is not guaranteed to be thread safe, but the sessions of all threads share the connection pool
+    The session is used for the calls of all citizens, so it does not keep cookies
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount("https://", _get_adapter())
+        session.mount("http://", _get_adapter())
+        _local.session = session
+    return session
+
 
 class GpassConnection:
     def __init__(self, api_location, bearer_token):
         self.api_location = api_location
         self.bearer_token = bearer_token
 
-    def _get(self, path, admin_number):
+    def _get(self, path, admin_number, operation):
+        """
+        Call GPASS, identical concurrent calls are coalesced
+        :param operation: the name of the operation, each operation has its own circuit breaker
+        """
+        if not get_single_flight():
+            return self._request(path, admin_number, operation)
+        return get_flights().do(cache_key("gpass", admin_number, path=path),
+                                lambda: self._request(path, admin_number, operation))
+
+    def _request(self, path, admin_number, operation):
+        # The path without the query and the pas number, to measure the calls by path
+        template = re.sub(r"/\d+", "/{pasnummer}", path.split("?")[0])
         path = f"{self.api_location}{path}"
         headers = {
             "Authorization": f"AppBearer {self.bearer_token},{admin_number}"
         }
-        # stricter limit, it all needs to arrive within 9 seconds in the frontend.
-        response = requests.get(path, headers=headers, timeout=5)
+        request_id = get_request_id()
+        if request_id is not None:
+            headers[REQUEST_ID_HEADER] = request_id
+        with get_breaker(f"gpass {operation}").guard() as call, MeasureTime("gpass", path=template):
+            # stricter limit, it all needs to arrive within 9 seconds in the frontend.
+            response = get_session().get(path, headers=headers, timeout=get_timeout(5))
+            if response.status_code >= 500:
+                call.failed()
         if LOG_RAW:
             print("url", path, "adminnumber", admin_number, self.bearer_token)
             print("status", response.status_code)
@@ -53,54 +112,70 @@ class GpassConnection:
             "budgets": budgets,
         }
 
-    def get_stadspassen(self, admin_number):
+    @revalidated('pashouder', key='admin_number')
+    def _get_pashouder(self, admin_number):
+        """ The pashouder with its sub pashouders, they share the administration number and so its cache entry """
         path = "/rest/sales/v1/pashouder?addsubs=true"
-        with MeasureTime(f"stadspas gpas {path}"):
-            response = self._get(path, admin_number)
+        response = self._get(path, admin_number, "pashouder")
         if response.status_code != 200:
             print("status code", response.status_code)
             # unknown user results in a invalid token?
-            return []
-        data = response.json()
+            return None
+        return response.json()
+
+    def get_stadspassen(self, admin_number):
+        data = self._get_pashouder(admin_number)
         if not data:
             return []
 
-        passes = self._format_pasholder(data, admin_number)
-        for sub_holder in data['sub_pashouders']:
-            passes += self._format_pasholder(sub_holder, admin_number)
+        pas_holders = [data] + data['sub_pashouders']
+        passen = [(self._get_naam(pas_holder), pas) for pas_holder in pas_holders for pas in self._active_passen(pas_holder)]
+
+        # The details of all passes are retrieved concurrently, the order of the passes is kept
+        executor = get_executor("gpass", get_gpass_max_workers())
+        futures = [submit(executor, self._get_pas_data, pas['pasnummer'], admin_number) for _, pas in passen]
+        # Wait no longer than the request deadline, so that a busy GPASS executor does not hold the caller's thread
+        _, not_done = wait(futures, timeout=remaining())
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            raise DeadlineExceeded('Request deadline exceeded')
+
+        passes = []
+        for (naam, _), future in zip(passen, futures):
+            pas_data = future.result()
+            if pas_data is not None:
+                passes.append(self._format_pas_data(naam, pas_data, admin_number))
+            else:
+                # TODO: implement me
+                pass
 
         return passes
 
-    def _format_pasholder(self, pas_holder, admin_number):
+    @staticmethod
+    def _get_naam(pas_holder):
         try:
-            naam = pas_holder['volledige_naam']
+            return pas_holder['volledige_naam']
         except KeyError:
             # TODO: remove me when gpass prod is updated to provide volledige_naam
             try:
-                naam = f'{pas_holder["initialen"]} {pas_holder["achternaam"]}'
+                return f'{pas_holder["initialen"]} {pas_holder["achternaam"]}'
             except KeyError as e:
                 logger.error(f"{type(e)} avaiable: {pas_holder.keys()}")
                 raise e
 
-        passen = pas_holder['passen']
+    @staticmethod
+    def _active_passen(pas_holder):
+        return [pas for pas in pas_holder['passen'] if pas['actief'] is True]
 
-        passen = [pas for pas in passen if pas['actief'] is True]
-        passen_result = []
-
-        for i, pas in enumerate(passen):
-            pasnummer = pas['pasnummer']
-            path = f'/rest/sales/v1/pas/{pasnummer}?include_balance=true'
-            with MeasureTime(f"stadspas gpas pas data i: {i}"):
-                response = self._get(path, admin_number)
-
-            if response.status_code == 200:
-                passen_result.append(self._format_pas_data(naam, response.json(), admin_number))
-            else:
-                # TODO: implement me
-                pass
-
-        # TODO: also include sub-passen
-        return passen_result
+    @revalidated('pas', key='admin_number')
+    def _get_pas_data(self, pasnummer, admin_number):
+        """ The pas with the balance of its budgets """
+        path = f'/rest/sales/v1/pas/{pasnummer}?include_balance=true'
+        response = self._get(path, admin_number, "pas")
+        if response.status_code != 200:
+            return None
+        return response.json()
 
     def _format_transaction(self, transaction):
         date = transaction['transactiedatum']  # parse and convert to date
@@ -111,10 +186,10 @@ class GpassConnection:
             "date": date,
         }
 
+    @cached('stadspastransacties', key='admin_number')
     def get_transactions(self, admin_number, pas_number, budget_code):
         path = f"/rest/transacties/v1/budget?pasnummer={pas_number}&budgetcode={budget_code}&sub_transactions=true"
-        with MeasureTime("stadspas gpas get transactions"):
-            response = self._get(path, admin_number)
+        response = self._get(path, admin_number, "transacties")
 
         if response.status_code != 200:
             return None
@@ -1,14 +1,65 @@
 import time
+from contextvars import ContextVar
+
+from .metrics import observe
+from .tracing import span
+
+# The durations that have been measured for the current request, None when they are not collected
+_spans = ContextVar('spans', default=None)
 
 
 class MeasureTime:
-    def __init__(self, name: str):
+    """
+    Measure the duration of a block and record it in the histogram of name and labels, see metrics.py
+    A block that raises an exception is also counted as an error
+    When the spans of the request are collected, see collect_spans, the duration is added to them as well
+    When the request is traced the block is a span of the trace, see tracing.py
+    """
+
+    def __init__(self, name: str, **labels):
         self.name = name
+        self.labels = labels
+        self._span = span(name, **labels)
 
     def __enter__(self):
+        self._span.__enter__()
         self._start_time = time.perf_counter()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         end = time.perf_counter()
+        self._span.__exit__(exc_type, exc_val, exc_tb)
+
+        observe(self.name, self.labels, end - self._start_time, error=exc_type is not None)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((self.name, self.labels, end - self._start_time))
+
+
+def collect_spans():
+    """
+    Collect the durations that are measured from now on in the current context, including the executor threads
+    that are started from it (see concurrency.submit)
+    :return: token to hand to stop_collecting_spans
+    """
+    return _spans.set([])
+
+
+def stop_collecting_spans(token):
+    """
+    :return: list of (name, labels, seconds) tuples in the order in which the blocks have finished
+    """
+    spans = _spans.get()
+    _spans.reset(token)
+    return spans
+
 
-        print("Elapsed", self.name, end - self._start_time)
+def format_server_timing(spans):
+    """ The Server-Timing header value of spans, the labels of a span are its description """
+    entries = []
+    for name, labels, seconds in spans:
+        entry = name
+        if labels:
+            description = " ".join(str(value) for value in labels.values()).replace("\\", "\\\\").replace('"', '\\"')
+            entry += f';desc="{description}"'
+        entries.append(f"{entry};dur={seconds * 1000:.1f}")
+    return ", ".join(entries)
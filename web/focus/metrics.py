@@ -0,0 +1,218 @@
+""" Metrics
+
+This module holds the latency histograms and error counters that are recorded by MeasureTime, per SOAP operation,
+per GPASS path and per Flask endpoint. They are exposed in the Prometheus text format at /status/metrics, with the
+state and the transitions of the circuit breakers.
+
+When the application runs in uWSGI each worker publishes its metrics to the uWSGI cache (see uwsgi.ini), at most
+once per PUBLISH_INTERVAL seconds. The metrics endpoint adds up the metrics of all workers of the node, the state of a
+circuit breaker is the worst state of its breakers in the workers.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_breakers
+from .config import get_cache_name
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running in uWSGI
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+# The upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The minimum number of seconds between two publications of the metrics of a worker
+PUBLISH_INTERVAL = 5
+# The values of the circuit state gauge
+CIRCUIT_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+HELP = {
+    "soap": "Duration of the Focus SOAP calls by operation",
+    "gpass": "Duration of the GPASS calls by path",
+    "http": "Duration of the requests by endpoint and status",
+    "section": "Duration of the sections of the combined response",
+    "parse": "Duration of parsing and converting the Focus SOAP responses by operation",
+    "saml": "Duration of getting the BSN from the SAML token",
+    "json": "Duration of encoding the responses as JSON",
+    "pool_wait": "Duration of checking out a Focus SOAP client from the pool",
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+
+class Registry:
+    """ The histograms of a worker, by metric name and labels """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._published_at = 0
+
+    def observe(self, name, labels, seconds, error=False):
+        """
+        :param name: name of the metric, e.g. "soap"
+        :param labels: dict of label names and values
+        :param seconds: the measured duration
+        :param error: whether the measured call failed
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds, error)
+        if uwsgi is not None and time.monotonic() - self._published_at >= PUBLISH_INTERVAL:
+            self.publish()
+
+    def snapshot(self):
+        """ The metrics as a list that can be serialized to JSON """
+        with self._lock:
+            return [[name, list(labels), histogram.counts, histogram.sum, histogram.errors]
+                    for (name, labels), histogram in self._histograms.items()]
+
+    def publish(self):
+        """ Publish the metrics of this worker, so that the metrics endpoint of any worker can read them """
+        self._published_at = time.monotonic()
+        for kind, snapshot in (("metrics", self.snapshot()), ("circuits", circuit_snapshot())):
+            data = json.dumps(snapshot)
+            if not uwsgi.cache_update(f"{kind}:{uwsgi.worker_id()}", data, 0, get_cache_name()):
+                logger.debug(f"Failed to publish {len(data)} bytes of {kind}")
+
+
+_registry = Registry()
+
+
+def get_registry():
+    """ The metrics of this worker """
+    return _registry
+
+
+def observe(name, labels, seconds, error=False):
+    _registry.observe(name, labels, seconds, error)
+
+
+def circuit_snapshot():
+    """ The state and the transitions of the circuit breakers of this worker, as a list that can be serialized """
+    snapshot = []
+    for name, breaker in get_breakers().items():
+        stats = breaker.stats()
+        snapshot.append([name, stats["state"], stats["transitions"]])
+    return snapshot
+
+
+def _collect(kind, snapshot):
+    if uwsgi is None:
+        return snapshot()
+
+    _registry.publish()
+    snapshots = []
+    for worker_id in range(1, uwsgi.numproc + 1):
+        data = uwsgi.cache_get(f"{kind}:{worker_id}", get_cache_name())
+        if data:
+            snapshots += json.loads(data)
+    return snapshots
+
+
+def collect():
+    """ The metrics of all workers of the node, or of this process when not running in uWSGI """
+    return _collect("metrics", _registry.snapshot)
+
+
+def collect_circuits():
+    """ The circuit breakers of all workers of the node, or of this process when not running in uWSGI """
+    return _collect("circuits", circuit_snapshot)
+
+
+def merge(snapshot):
+    """ Add up the histograms with the same name and labels """
+    merged = {}
+    for name, labels, counts, total, errors in snapshot:
+        key = (name, tuple(tuple(label) for label in labels))
+        histogram = merged.get(key)
+        if histogram is None:
+            histogram = merged[key] = Histogram()
+        histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+        histogram.sum += total
+        histogram.errors += errors
+    return merged
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _render_histograms(name, histograms):
+    metric = f"focus_{name}_duration_seconds"
+    lines = [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} histogram"]
+    for labels, histogram in histograms:
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f"{metric}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+
+    errors = f"focus_{name}_errors_total"
+    lines += [f"# HELP {errors} Number of failed calls, see {metric}", f"# TYPE {errors} counter"]
+    lines += [f"{errors}{_format_labels(labels)} {histogram.errors}" for labels, histogram in histograms]
+    return lines
+
+
+def _render_circuits(circuits):
+    states = {}
+    transitions = {}
+    for name, state, counts in circuits:
+        states[name] = max(states.get(name, 0), CIRCUIT_STATES[state])
+        for to, count in counts.items():
+            transitions[(name, to)] = transitions.get((name, to), 0) + count
+
+    gauge = "focus_circuit_state"
+    lines = [f"# HELP {gauge} State of the circuit breaker by operation: 0 closed, 1 half open, 2 open",
+             f"# TYPE {gauge} gauge"]
+    lines += [f"{gauge}{_format_labels([('name', name)])} {state}" for name, state in sorted(states.items())]
+
+    counter = "focus_circuit_transitions_total"
+    lines += [f"# HELP {counter} Number of transitions of the circuit breaker by operation and new state",
+              f"# TYPE {counter} counter"]
+    lines += [f"{counter}{_format_labels([('name', name), ('state', to)])} {count}"
+              for (name, to), count in sorted(transitions.items())]
+    return lines
+
+
+def render(snapshot, circuits=()):
+    """
+    The metrics in the Prometheus text format
+    :param snapshot: the histograms, see collect
+    :param circuits: the circuit breakers, see collect_circuits
+    """
+    by_name = {}
+    for (name, labels), histogram in sorted(merge(snapshot).items()):
+        by_name.setdefault(name, []).append((labels, histogram))
+
+    lines = []
+    for name, histograms in by_name.items():
+        lines += _render_histograms(name, histograms)
+    if circuits:
+        lines += _render_circuits(circuits)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,154 @@
+""" Negative cache
+
+This module remembers for which citizens a section is empty, e.g. most citizens have no TOZO documents and no
+stadspas. A lookup of an empty section returns the empty section without calling Focus.
+
+The hashed BSNs are kept in a bloom filter per section, so that hundreds of thousands of citizens take less than a
+megabyte per section. A bloom filter may tell that a section is empty while it is not (false positive), at the
+configured error rate. The filters are rotated periodically, so that a section that is no longer empty (e.g. a new
+stadspas) and false positives are forgotten after at most two intervals.
+
+The negative cache is disabled by default, see config.py
+"""
+import math
+import threading
+import time
+from functools import wraps
+from hashlib import sha256
+
+from .cache import call_key
+from .config import get_negative_cache, get_negative_cache_capacity, get_negative_cache_error_rate, \
+    get_negative_cache_interval
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        """
+        :param capacity: the number of items at which the error rate is reached
+        :param error_rate: the probability of a false positive at capacity
+        """
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, digest):
+        """ The bit indexes of an item, by double hashing its digest (at least 16 bytes) """
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, digest):
+        for index in self._indexes(digest):
+            self._bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(digest))
+
+    def __len__(self):
+        """ The size in bytes """
+        return len(self._bits)
+
+
+class RotatingBloomFilter:
+    """
+    A bloom filter that forgets its items after one to two intervals
+    Items are added to the current filter and looked up in the current and the previous filter
+    """
+
+    def __init__(self, capacity, error_rate, interval, timer=time.monotonic):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._interval = interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._rotated_at = timer()
+        self.hits = 0
+        self.lookups = 0
+        self.rotations = 0
+
+    def _rotate(self):
+        if self._timer() - self._rotated_at < self._interval:
+            return
+        with self._lock:
+            now = self._timer()
+            if now - self._rotated_at < self._interval:
+                return
+            # Both filters are dropped when there has been no rotation for two intervals
+            self._previous = self._current if now - self._rotated_at < 2 * self._interval else None
+            self._current = BloomFilter(self._capacity, self._error_rate)
+            self._rotated_at = now
+            self.rotations += 1
+
+    def add(self, digest):
+        self._rotate()
+        self._current.add(digest)
+
+    def __contains__(self, digest):
+        self._rotate()
+        self.lookups += 1
+        previous = self._previous
+        found = digest in self._current or (previous is not None and digest in previous)
+        if found:
+            self.hits += 1
+        return found
+
+    def stats(self):
+        previous = self._previous
+        return {
+            "items": self._current.count + (0 if previous is None else previous.count),
+            "bytes": len(self._current) + (0 if previous is None else len(previous)),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "rotations": self.rotations,
+        }
+
+
+_filters = {}
+_filters_lock = threading.Lock()
+
+
+def get_filter(section):
+    """ Get the filter of the empty sections, create it on first use """
+    with _filters_lock:
+        bloom_filter = _filters.get(section)
+        if bloom_filter is None:
+            bloom_filter = RotatingBloomFilter(get_negative_cache_capacity(), get_negative_cache_error_rate(),
+                                               get_negative_cache_interval())
+            _filters[section] = bloom_filter
+        return bloom_filter
+
+
+def get_negative_cache_stats():
+    with _filters_lock:
+        return {section: bloom_filter.stats() for section, bloom_filter in _filters.items()}
+
+
+def negative_cached(section, empty=list, key="bsn"):
+    """
+    Skip the FocusConnection operation of a section when it has been empty for the citizen before
+    :param section: name of the section
+    :param empty: function that returns the empty section, a result that equals it is remembered
+    :param key: name of the argument that identifies the citizen
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not get_negative_cache():
+                return method(self, *args, **kwargs)
+
+            bloom_filter = get_filter(section)
+            # The key holds the hashed BSN and the other arguments of the call
+            digest = sha256(call_key(method, section, key, (self, *args), kwargs).encode()).digest()
+            if digest in bloom_filter:
+                return empty()
+
+            result = method(self, *args, **kwargs)
+            if result == empty():
+                bloom_filter.add(digest)
+            return result
+        return wrapper
+    return decorator
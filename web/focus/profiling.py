@@ -0,0 +1,129 @@
+""" Profiling
+
+This module profiles single requests on demand, to find out why the request of a specific citizen is slow.
+A request is profiled when profiling is enabled (FOCUS_PROFILING) and the request has an X-Focus-Profile header and
+comes from one of the allowed networks (FOCUS_PROFILE_NETWORKS). The networks are checked against the address of the
+direct peer, behind a proxy that is the proxy, so the networks should be a narrow admin range. The profile covers the
+complete request, from the SAML token to the JSON response.
+
+Two profilers are available (FOCUS_PROFILER):
+- cprofile (default) profiles the thread of the request, the stats are written as a .prof file (pstats format),
+  e.g. for flameprof or snakeviz
+- sampling samples the stacks of all threads, including the executor threads of the combined sections. The stacks
+  are written as a .folded file (collapsed stacks), e.g. for flamegraph.pl or speedscope
+
+When profiling is disabled the middleware is not installed, see server.py
+"""
+import cProfile
+import ipaddress
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from .config import get_profile_dir, get_profile_networks, get_profiler
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "HTTP_X_FOCUS_PROFILE"
+# The interval in seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+
+class SamplingProfiler:
+    """ Samples the stacks of all threads, except its own """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.stacks = Counter()
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump_stats(self, path):
+        """ Write the stacks in the collapsed format, one stack and its number of samples per line """
+        with open(path, "w") as fp:
+            for stack, count in self.stacks.items():
+                fp.write(f"{stack} {count}\n")
+
+
+PROFILERS = {
+    "cprofile": (cProfile.Profile, "prof"),
+    "sampling": (SamplingProfiler, "folded"),
+}
+
+
+class ProfilingMiddleware:
+    """ WSGI middleware that profiles the requests that ask for it """
+
+    def __init__(self, app):
+        self._app = app
+        self._networks = [ipaddress.ip_network(network.strip(), strict=False)
+                          for network in get_profile_networks().split(",") if network.strip()]
+        self._profiler, self._extension = PROFILERS[get_profiler()]
+        self._directory = get_profile_dir()
+
+    def _is_internal(self, address):
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self._networks)
+
+    def __call__(self, environ, start_response):
+        if PROFILE_HEADER not in environ:
+            return self._app(environ, start_response)
+        if not self._is_internal(environ.get("REMOTE_ADDR", "")):
+            logger.warning(f"Profile requested by {environ.get('REMOTE_ADDR')}, which is not internal")
+            return self._app(environ, start_response)
+
+        profiler = self._profiler()
+        profiler.enable()
+        try:
+            # The response is read within the profile, so that its encoding is profiled as well
+            response = self._app(environ, start_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            profiler.disable()
+            self._dump(profiler, environ.get("PATH_INFO", ""))
+        return body
+
+    def _dump(self, profiler, path):
+        # The path is not part of the file name as is, it may contain personal data (e.g. an encrypted admin number)
+        name = re.sub(r"[^A-Za-z0-9]+", "_", "_".join(path.strip("/").split("/")[:2])) or "root"
+        os.makedirs(self._directory, exist_ok=True)
+        file = os.path.join(self._directory,
+                            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}-{name}.{self._extension}")
+        try:
+            profiler.dump_stats(file)
+            logger.info(f"Profile written to {file}")
+        except OSError as error:
+            logger.error(f"Failed to write profile {file}: {error}")
@@ -0,0 +1,89 @@
+""" Slow request log
+
+This module logs the requests that take longer than the configured threshold (FOCUS_SLOW_REQUEST_THRESHOLD), one JSON
+line per request, to relate the duration of a request to the size of its payload. The line tells:
+- the endpoint, status and total duration of the request
+- the duration of each stage: the MeasureTime blocks (SAML, SOAP calls, parsing, GPASS calls, sections, JSON), both
+  by stage and one by one
+- the size in bytes of the Focus responses by SOAP operation
+- the cardinalities of the payload, e.g. the number of producten, documenten, stadspassen and budgets
+
+The durations of the stages are summed by stage, the sections of a combined request run concurrently so their sum may
+exceed the total duration. The sizes and cardinalities are recorded by the code that handles the payload, with
+record_size and count. They are only recorded when the call is made during the request, not when it is cached.
+"""
+import json
+import logging
+import threading
+from contextvars import ContextVar
+
+from .config import get_slow_request_threshold
+
+logger = logging.getLogger(__name__)
+
+# The payload shape of the current request, None when it is not recorded
+_shape = ContextVar('shape', default=None)
+
+
+class PayloadShape:
+    """ The sizes and cardinalities of a request, shared with the executor threads of the request """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sizes = {}
+        self.counts = {}
+
+    def add(self, totals, name, amount):
+        with self._lock:
+            totals[name] = totals.get(name, 0) + amount
+
+
+def start_request_log():
+    """
+    Record the payload shape of the current request, when the slow request log is enabled
+    :return: token to hand to finish_request_log, or None when the log is disabled
+    """
+    if not get_slow_request_threshold():
+        return None
+    return _shape.set(PayloadShape())
+
+
+def record_size(operation, size):
+    """ Add the size in bytes of a response of operation to the current request """
+    shape = _shape.get()
+    if shape is not None:
+        shape.add(shape.sizes, operation, size)
+
+
+def count(name, amount=1):
+    """ Add amount items of name (e.g. "producten") to the current request """
+    shape = _shape.get()
+    if shape is not None:
+        shape.add(shape.counts, name, amount)
+
+
+def finish_request_log(token, seconds, spans, **attributes):
+    """
+    Stop recording the payload shape and log the request when it is slow
+    :param token: the token of start_request_log
+    :param seconds: the total duration of the request
+    :param spans: the (name, labels, seconds) tuples of the request, see measure_time.collect_spans
+    :param attributes: attributes of the request, e.g. its endpoint and status
+    """
+    shape = _shape.get()
+    _shape.reset(token)
+    if seconds < get_slow_request_threshold():
+        return
+
+    stages = {}
+    for name, _, duration in spans:
+        stages[name] = stages.get(name, 0) + duration
+    logger.warning(json.dumps({
+        "message": "slow request",
+        **attributes,
+        "ms": round(seconds * 1000, 1),
+        "stages": {name: round(duration * 1000, 1) for name, duration in stages.items()},
+        "calls": [{"stage": name, **labels, "ms": round(duration * 1000, 1)} for name, labels, duration in spans],
+        "bytes": shape.sizes,
+        "counts": shape.counts,
+    }))
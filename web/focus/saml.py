@@ -1,19 +1,46 @@
 """ SAML logic
 
 This module interprets and verifies SAML tokens
+
+A portal session sends the same token with each of its requests. A token that has been verified successfully is
+remembered (by its digest) until its assertion expires, so that it is verified on its first request in a worker only.
 """
-from tma_saml import get_digi_d_bsn
+from datetime import datetime, timezone
+from functools import lru_cache
+from hashlib import sha256
+
+from tma_saml import TMA_SAML_HEADER, get_digi_d_bsn, get_session_valid_until
+
+from focus.cache import MISSING, TTLCache
+from focus.config import get_TMA_certificate, get_saml_cache_size
+from focus.measure_time import MeasureTime
+
+_verified_tokens = TTLCache(get_saml_cache_size())
 
-from focus.config import get_TMA_certificate
+
+@lru_cache(maxsize=1)
+def get_tma_certificate():
+    """ The TMA certificate, read once per worker """
+    return get_TMA_certificate()
 
 
 def get_bsn_from_request(request):
     """
     Get the BSN based on a request, expecting a SAML token in the headers
     """
-    # Load the TMA certificate
-    tma_certificate = get_TMA_certificate()
+    with MeasureTime("saml"):
+        return _get_bsn(request)
+
+
+def _get_bsn(request):
+    token = request.headers.get(TMA_SAML_HEADER)
+    digest = sha256(token.encode()).digest() if token else None
+    bsn = _verified_tokens.get(digest) if digest else MISSING
+    if bsn is not MISSING:
+        return bsn
 
-    # Decode the BSN from the request with the TMA certificate
-    bsn = get_digi_d_bsn(request, tma_certificate)
+    certificate = get_tma_certificate()
+    bsn = get_digi_d_bsn(request, certificate)
+    valid_until = get_session_valid_until(request, certificate)
+    _verified_tokens.set(digest, bsn, (valid_until - datetime.now(timezone.utc)).total_seconds())
     return bsn
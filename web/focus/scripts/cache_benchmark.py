@@ -0,0 +1,36 @@
+"""
+Compares the hit latency of the caches with a plain dict, for a converted aanvragen result
+
+Per process cache only:
+    python -m focus.scripts.cache_benchmark
+Including the uWSGI cache that is shared by the workers:
+    uwsgi --cache2 name=focus,items=2000,blocks=8000,blocksize=4096,bitmap=1,purge_lru=1 \
+        --pythonpath . --pyrun focus/scripts/cache_benchmark.py
+"""
+import os
+import timeit
+
+from focus.cache import TTLCache, UwsgiCache, cache_key, uwsgi
+from focus.config import BASE_PATH
+from focus.focusinterpreter import parse_aanvragen
+
+NUMBER = 10000
+
+with open(os.path.join(BASE_PATH, 'tests', 'responses', 'aanvragen.xml'), 'rb') as fp:
+    value, _ = parse_aanvragen(fp.read(), '/')
+
+key = cache_key('aanvragen', '123456789', url_root='/')
+
+caches = {
+    'dict': {key: value},
+    'TTLCache': TTLCache(1000),
+}
+caches['TTLCache'].set(key, value, 60)
+if uwsgi is not None:
+    caches['UwsgiCache'] = UwsgiCache('focus')
+    caches['UwsgiCache'].set(key, value, 60)
+
+for name, cache in caches.items():
+    assert cache.get(key) == value
+    seconds = timeit.timeit(lambda: cache.get(key), number=NUMBER)
+    print(f"{name:12} {seconds / NUMBER * 1e6:8.1f} us per hit")
@@ -38,8 +38,8 @@ for i in aanvragen:  # noqa C901
                 print("  url:", doc['$ref'])
                 command = f'python focus/scripts/get_doc.py {bsn} {docId} {isDms} {isBulk}'
                 print("  command:", command)
-                with focus_connection._client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
-                    raw_doc = focus_connection._client.service.getDocument(id=docId, bsn=bsn, isBulk=isBulk, isDms=isDms)
+                with focus_connection._pool.client() as client, client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
+                    raw_doc = client.service.getDocument(id=docId, bsn=bsn, isBulk=isBulk, isDms=isDms)
                     tree = BeautifulSoup(raw_doc.content, features="lxml-xml")
                     data = tree.find('dataHandler')
                     try:
@@ -60,8 +60,8 @@ for i in jaaropvragen + uitkeringsspecificaties + tozo_documents:
     command = f'python focus/scripts/get_doc.py {bsn} {docId} {isDms} {isBulk}'
     print("command:", command)
 
-    with focus_connection._client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
-        raw_doc = focus_connection._client.service.getDocument(id=docId, bsn=bsn, isBulk=isBulk, isDms=isDms)
+    with focus_connection._pool.client() as client, client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
+        raw_doc = client.service.getDocument(id=docId, bsn=bsn, isBulk=isBulk, isDms=isDms)
         tree = BeautifulSoup(raw_doc.content, features="lxml-xml")
         data = tree.find('dataHandler')
         try:
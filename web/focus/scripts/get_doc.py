@@ -41,8 +41,8 @@ isBulk = argv[4]
 
 print("Getting doc", bsn, docid, isDms, isBulk)
 
-with focus_connection._client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
-    raw_doc = focus_connection._client.service.getDocument(id=docid, bsn=bsn, isBulk=isBulk, isDms=isDms)
+with focus_connection._pool.client() as client, client.settings(raw_response=True, extra_http_headers={'Accept': 'application/xop+xml'}):
+    raw_doc = client.service.getDocument(id=docid, bsn=bsn, isBulk=isBulk, isDms=isDms)
     content_bytesio = BytesIO(raw_doc.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
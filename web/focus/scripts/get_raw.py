@@ -11,32 +11,32 @@ focus_connection = FocusConnection(config, credentials)
 bsn = sys.argv[1]
 
 
-with focus_connection._client.settings(raw_response=True):
-    raw_aanvragen = focus_connection._client.service.getAanvragen(bsn=bsn)
+with focus_connection._pool.client() as client, client.settings(raw_response=True):
+    raw_aanvragen = client.service.getAanvragen(bsn=bsn)
     content_bytesio = BytesIO(raw_aanvragen.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
     print(formatted_xml.decode())
     #
-    raw_aanvragen = focus_connection._client.service.getJaaropgaven(bsn=bsn)
+    raw_aanvragen = client.service.getJaaropgaven(bsn=bsn)
     content_bytesio = BytesIO(raw_aanvragen.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
     print(formatted_xml.decode())
     #
-    raw_aanvragen = focus_connection._client.service.getStadspas(bsn=bsn)
+    raw_aanvragen = client.service.getStadspas(bsn=bsn)
     content_bytesio = BytesIO(raw_aanvragen.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
     print(formatted_xml.decode())
     #
-    raw_aanvragen = focus_connection._client.service.getUitkeringspecificaties(bsn=bsn)
+    raw_aanvragen = client.service.getUitkeringspecificaties(bsn=bsn)
     content_bytesio = BytesIO(raw_aanvragen.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
     print(formatted_xml.decode())
 
-    raw_aanvragen = focus_connection._client.service.getEAanvraagTOZO(bsn=bsn)
+    raw_aanvragen = client.service.getEAanvraagTOZO(bsn=bsn)
     content_bytesio = BytesIO(raw_aanvragen.content)
     tree = etree.parse(content_bytesio)
     formatted_xml = etree.tostring(tree, pretty_print=True)
@@ -0,0 +1,91 @@
+"""
+Compares the latency of GPASS calls with a new connection per call (requests.get)
+to calls with the pooled keep-alive session of gpass_connect
+
+A local stand-in for GPASS is served over TLS with a self signed certificate:
+    python -m focus.scripts.gpass_session_benchmark [number of calls]
+"""
+import datetime
+import json
+import os
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from focus.config import BASE_PATH
+from focus.gpass_connect import get_session
+
+with open(os.path.join(BASE_PATH, 'tests', 'responses', 'gpass', 'pashouder.json')) as fp:
+    BODY = fp.read().encode()
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_certificate(directory):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.utcnow()
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256())
+
+    path = os.path.join(directory, 'standin.pem')
+    with open(path, 'wb') as fp:
+        fp.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                   serialization.NoEncryption()))
+        fp.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return path
+
+
+def serve(directory):
+    server = ThreadingHTTPServer(('localhost', 0), StandIn)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(write_certificate(directory))
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"https://localhost:{server.server_port}/rest/sales/v1/pashouder?addsubs=true"
+
+
+def measure(get, url, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        response = get(url, timeout=5, verify=False)
+        json.loads(response.content)
+    return (time.perf_counter() - start) / number
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        url = serve(directory)
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+
+    results = {
+        'requests.get': measure(requests.get, url, number),
+        'pooled session': measure(get_session().get, url, number),
+    }
+    for name, seconds in results.items():
+        print(f"{name:15} {seconds * 1000:6.2f} ms per call")
@@ -1,18 +1,36 @@
 import logging
+import threading
+import time
+
 import sentry_sdk
 from sentry_sdk.integrations.flask import FlaskIntegration
 
-from flask import Flask, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 
 from focus.gpass_connect import GpassConnection
 
+from focus.cache import get_cache_stats
+from focus.circuit_breaker import get_breakers
 from focus.crypto import decrypt
+from focus.deadline import request_deadline
+from focus.measure_time import MeasureTime, collect_spans, format_server_timing, stop_collecting_spans
+from focus.metrics import collect, collect_circuits, observe, render
+from focus.profiling import ProfilingMiddleware
+from focus.request_log import count, finish_request_log, start_request_log
+from focus.tracing import REQUEST_ID_HEADER, finish_trace, get_request_id, start_trace
+from focus.negative_cache import get_negative_cache_stats
 from .config import check_env, config, credentials, urls, get_TMA_certificate, SENTRY_DSN, get_gpass_bearer_token, \
-    get_gpass_api_location
+    get_gpass_api_location, get_preload, get_profiling, get_server_timing
 from .focusconnect import FocusConnection
 from .focusserver import FocusServer
 
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # Not running in uWSGI
+    postfork = None
+
 
 if SENTRY_DSN:
     sentry_sdk.init(
@@ -31,26 +49,81 @@ application.logger.addHandler(log_handler)
 
 CORS(app=application, send_wildcard=True)
 
+if get_profiling():
+    # Profile the requests that ask for it, see profiling.py
+    application.wsgi_app = ProfilingMiddleware(application.wsgi_app)
+
 # Main
 # Check the environment, will raise an exception if the server is not supplied with sufficient info
 check_env()
 # Initialize server to None, instantiate on first call to focus_server
+# The server is shared by the threads of the worker, its connection holds a pool of Focus clients
 focus_server = None
+focus_server_lock = threading.Lock()
 
 
 def server():
     """
     Gets a server to execute the request.
-    If the server is not alive (failing connection) a new server is created automatically
+    If the connection of the server fails it is re-established in the background, see FocusConnection.reset
     :return:
     """
     global focus_server
-    if focus_server is None or not focus_server.is_alive():
-        # Establish a (new) connection with the FOCUS system
-        focus_connection = FocusConnection(config, credentials)
-        # Serve the FOCUS requests that are exposed by this server
-        focus_server = FocusServer(focus_connection, get_TMA_certificate())
-    return focus_server
+    with focus_server_lock:
+        if focus_server is None:
+            # Establish a connection with the FOCUS system
+            focus_connection = FocusConnection(config, credentials)
+            # Serve the FOCUS requests that are exposed by this server
+            focus_server = FocusServer(focus_connection, get_TMA_certificate())
+        return focus_server
+
+
+if postfork is not None and get_preload():
+    # Build the Focus client when the worker starts, instead of on the first request
+    postfork(server)
+
+
+@application.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+    g.request_log_token = start_request_log()
+    if get_server_timing() or g.request_log_token is not None:
+        g.spans_token = collect_spans()
+    rule = request.url_rule.rule if request.url_rule else None
+    g.trace_token = start_trace(request.endpoint or "unknown", request.headers.get(REQUEST_ID_HEADER),
+                                method=request.method, rule=rule)
+
+
+@application.after_request
+def measure_request(response):
+    """
+    Record the duration of the request by endpoint and status, see metrics.py
+    Add the durations that have been measured during the request in the Server-Timing header, when enabled
+    Log the request when it is slow, see request_log.py
+    Finish the trace of the request, when enabled
+    """
+    endpoint = request.endpoint or "unknown"
+    start_time = g.pop("start_time", None)
+    seconds = 0 if start_time is None else time.perf_counter() - start_time
+    if start_time is not None:
+        labels = {"endpoint": endpoint, "status": str(response.status_code)}
+        observe("http", labels, seconds, error=response.status_code >= 500)
+
+    spans_token = g.pop("spans_token", None)
+    spans = [] if spans_token is None else stop_collecting_spans(spans_token)
+    if spans and get_server_timing():
+        response.headers["Server-Timing"] = format_server_timing(spans)
+
+    request_log_token = g.pop("request_log_token", None)
+    if request_log_token is not None:
+        finish_request_log(request_log_token, seconds, spans, endpoint=endpoint, status=response.status_code,
+                           request_id=get_request_id())
+
+    trace_token = g.pop("trace_token", None)
+    if trace_token is not None:
+        response.headers[REQUEST_ID_HEADER] = get_request_id()
+        finish_trace(trace_token, status=response.status_code)
+    return response
 
 
 @application.route(urls["swagger"])
@@ -68,7 +141,28 @@ def status_data():
     return server().status_data()
 
 
+@application.route(urls["metrics"])
+def status_metrics():
+    return Response(render(collect(), collect_circuits()), content_type="text/plain; version=0.0.4")
+
+
+@application.route(urls["circuits"])
+def status_circuits():
+    return {name: breaker.stats() for name, breaker in get_breakers().items()}
+
+
+@application.route(urls["cache"])
+def status_cache():
+    return dict(get_cache_stats(), negative=get_negative_cache_stats())
+
+
+@application.route(urls["pool"])
+def status_pool():
+    return server().pool_stats()
+
+
 @application.route(urls["aanvragen"])
+@request_deadline
 def aanvragen():
     return server().aanvragen()
 
@@ -79,11 +173,13 @@ def document():
 
 
 @application.route(urls["combined"])
+@request_deadline
 def combined():
     return server().combined()
 
 
 @application.route(urls["stadspastransacties"])
+@request_deadline
 def stadspastransactions(encrypted_admin_pasnummer):
     budget_code, admin_number, stadspas_number = decrypt(encrypted_admin_pasnummer)
 
@@ -91,11 +187,13 @@ def stadspastransactions(encrypted_admin_pasnummer):
     stadspas_transations = gpass_con.get_transactions(admin_number, stadspas_number, budget_code)
     if stadspas_transations is None:
         return {}, 204
+    count("transacties", len(stadspas_transations))
 
-    return {
-        "status": "ok",
-        "content": stadspas_transations,
-    }
+    with MeasureTime("json"):
+        return jsonify({
+            "status": "ok",
+            "content": stadspas_transations,
+        })
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+""" Single flight
+
+This module coalesces identical concurrent calls of the Focus and GPASS operations. While a call is in flight
+the same call from another thread of the worker waits for its result instead of calling the backend again.
+Focus calls are identified by the operation and the hashed BSN, GPASS calls by the hashed administration number
+and the path.
+
+Across the workers of a node the calls are coalesced by the cache, see cached() in cache.py
+"""
+import logging
+import threading
+from functools import wraps
+
+from .cache import call_key
+from .config import get_single_flight
+from .deadline import DeadlineExceeded, get_timeout
+
+logger = logging.getLogger(__name__)
+
+# The maximum time in seconds to wait for a call in flight when the request has no deadline
+MAX_WAIT = 9
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ The calls in flight by key """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, function):
+        """
+        Call function, unless a call with the same key is in flight already, then wait for its result
+        :return: the result of the call, an exception of the call is raised in all waiting threads
+        :raises DeadlineExceeded: when the call in flight does not finish before the deadline of the request
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(get_timeout(MAX_WAIT)):
+                raise DeadlineExceeded('Coalesced call did not finish in time')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+            }
+
+
+_flights = SingleFlight()
+
+
+def get_flights():
+    """ The calls in flight of this worker """
+    return _flights
+
+
+def coalesced(operation, key="bsn"):
+    """
+    Coalesce identical concurrent calls of a FocusConnection or GpassConnection operation
+    :param operation: name of the operation
+    :param key: name of the argument that identifies the citizen
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not get_single_flight():
+                return method(self, *args, **kwargs)
+            flight_key = call_key(method, operation, key, (self, *args), kwargs)
+            return _flights.do(flight_key, lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
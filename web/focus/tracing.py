@@ -0,0 +1,224 @@
+""" Tracing
+
+This module records the spans of a request: a root span per request with child spans for the SOAP calls, the parsing
+of their responses and the GPASS calls. Each MeasureTime block is a span, code that is not measured can be traced with
+span or traced. The spans of the executor threads of a request are children of the span that started them.
+
+A request is identified by its X-Request-ID header, or by a new id if it has none. The id is passed on to Focus and
+GPASS and returned in the response.
+
+The spans of a request are exported when the request is finished. Tracing is disabled by default, it is enabled by
+choosing an exporter (FOCUS_TRACE_EXPORTER), see config.py. Another exporter can be installed with set_exporter.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+
+from .config import get_trace_exporter, get_trace_file
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# The span of the current context, None when the request is not traced
+_current_span = ContextVar('span', default=None)
+
+_valid_request_id = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class Trace:
+    """ The spans of a request """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.spans = []
+        self.finished = False
+        # Guards spans and finished, the spans of executor threads may finish while the trace is being exported
+        self.lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, trace, parent_id, attributes):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = type(error).__name__
+        with self.trace.lock:
+            finished = self.trace.finished
+            if not finished:
+                self.trace.spans.append(self)
+        if finished:
+            # A span of an executor thread that has finished after its request
+            _export([self])
+
+    def to_dict(self):
+        return {
+            "request_id": self.trace.request_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "thread": self.thread,
+            "start": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+        }
+
+
+class _SpanScope:
+    def __init__(self, name, attributes):
+        self._name = name
+        self._attributes = attributes
+        self._span = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            self._span = Span(self._name, parent.trace, parent.span_id, self._attributes)
+            self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._span is not None:
+            _current_span.reset(self._token)
+            self._span.finish(exc_val)
+
+
+def span(name, **attributes):
+    """
+    Context manager that records a child span of the current span, nothing is recorded when the request is not traced
+    """
+    return _SpanScope(name, attributes)
+
+
+def traced(name):
+    """ Decorator that records a span for each call of the function """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(name, request_id=None, **attributes):
+    """
+    Start the root span of a request, if tracing is enabled
+    :param request_id: the id of the request, a new id is used when it is missing or invalid
+    :return: token to hand to finish_trace, or None when tracing is disabled
+    """
+    if get_exporter() is None:
+        return None
+    if not request_id or not _valid_request_id.match(request_id):
+        request_id = uuid.uuid4().hex
+    root = Span(name, Trace(request_id), None, attributes)
+    return _current_span.set(root)
+
+
+def finish_trace(token, **attributes):
+    """ Finish the root span of a request and export the spans of the request """
+    root = _current_span.get()
+    _current_span.reset(token)
+    root.attributes.update(attributes)
+    root.finish()
+    with root.trace.lock:
+        root.trace.finished = True
+    _export(root.trace.spans)
+
+
+def get_request_id():
+    """ The id of the current request, None when the request is not traced """
+    current = _current_span.get()
+    return None if current is None else current.trace.request_id
+
+
+class JsonLinesExporter:
+    """ Appends the spans to a file, one JSON object per line """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        data = "".join(json.dumps(span.to_dict()) + "\n" for span in spans)
+        with self._lock:
+            # A single write per request, so that the lines of the uWSGI workers are not interleaved
+            fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data.encode())
+            finally:
+                os.close(fd)
+
+
+class LogExporter:
+    """ Logs the spans, one JSON object per span """
+
+    def export(self, spans):
+        for span in spans:
+            logger.info(json.dumps(span.to_dict()))
+
+
+_exporter = None
+_exporter_configured = False
+_exporter_lock = threading.Lock()
+
+
+def _create_exporter():
+    name = get_trace_exporter()
+    if name == "jsonl":
+        return JsonLinesExporter(get_trace_file())
+    if name == "log":
+        return LogExporter()
+    if name:
+        logger.error(f"Unknown trace exporter {name}, tracing is disabled")
+    return None
+
+
+def get_exporter():
+    """ The exporter of the spans, created from the configuration on first use. None when tracing is disabled """
+    global _exporter, _exporter_configured
+    if not _exporter_configured:
+        with _exporter_lock:
+            if not _exporter_configured:
+                _exporter = _create_exporter()
+                _exporter_configured = True
+    return _exporter
+
+
+def set_exporter(exporter):
+    """
+    Install an exporter, an object with an export(spans) method
+    :param exporter: the exporter, None disables tracing
+    """
+    global _exporter, _exporter_configured
+    with _exporter_lock:
+        _exporter = exporter
+        _exporter_configured = True
+
+
+def _export(spans):
+    exporter = get_exporter()
+    if exporter is None or not spans:
+        return
+    try:
+        exporter.export(spans)
+    except Exception as error:
+        logger.warning(f"Failed to export {len(spans)} spans: {type(error)} {error}")
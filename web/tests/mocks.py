@@ -10,6 +10,7 @@ RESPONSES_PATH = os.path.join(BASE_PATH, 'tests', 'responses')
 
 class MockClient:
     def __init__(self, wsdl, transport):
+        self.wsdl = wsdl
         self.service = MockService()
 
     def settings(self, *args, **kwargs):
@@ -24,6 +25,7 @@ class MockClient:
 
 class MockClientEmpties:
     def __init__(self, wsdl, transport):
+        self.wsdl = wsdl
         self.service = MockServiceEmpties()
 
     def settings(self, *args, **kwargs):
@@ -36,6 +38,26 @@ class MockClientEmpties:
         pass
 
 
+class FixtureClient:
+    """ Soap client mock that answers every operation with the same response """
+    def __init__(self, reply):
+        self.wsdl = None
+        self.service = self
+        self._reply = reply
+
+    def __getattr__(self, name):
+        return lambda **kwargs: MockResponse(reply=self._reply)
+
+    def settings(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 class MockService:
     def getDocument(self, bsn, id, isBulk, isDms):
         return MockResponse(reply=get_document())
@@ -86,10 +108,17 @@ def get_response_mock(*args, **kwargs):
     return MockResponse(res_data)
 
 
+class MockSession:
+    """ The GPASS session, see gpass_connect.get_session """
+    def get(self, *args, **kwargs):
+        return get_response_mock(*args, **kwargs)
+
+
 class MockResponse:
     def __init__(self, reply, status_code=200):
         self.reply = reply
         self.status_code = status_code
+        self.headers = {}
 
     @property
     def content(self):
@@ -102,6 +131,23 @@ class MockResponse:
     def json(self):
         return self.data
 
+    def iter_content(self, chunk_size=1):
+        content = self.reply.encode() if isinstance(self.reply, str) else self.reply
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Clock:
+    """ A timer for the caches and circuit breakers that only moves when now is set """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
 
 # this document is from acc
 TEST_PDF_PATH = os.path.join(BASE_PATH, 'tests', 'test.pdf')
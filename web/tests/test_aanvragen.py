@@ -0,0 +1,137 @@
+import os
+import re
+from unittest import TestCase
+
+import xmltodict
+from mock import patch
+
+from .mocks import MockClient, aanvragen_response
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.config import config, credentials  # noqa: E402  Module level import not at top of file
+from focus.focusconnect import FocusConnection  # noqa: E402
+from focus.focusinterpreter import convert_aanvragen, parse_aanvragen  # noqa: E402
+
+
+def convert_with_xmltodict(content, url_root):
+    """ The decode/regex/xmltodict conversion that parse_aanvragen replaces """
+    raw_aanvragen = content.decode("utf-8").replace("\n", "")
+    xml_aanvragen = re.search(r"<return>.*<\/return>", raw_aanvragen).group(0)
+    return convert_aanvragen(xmltodict.parse(xml_aanvragen)["return"], url_root)
+
+
+single_product_response = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+    <S:Body>
+        <ns0:getAanvragenResponse xmlns:ns0="http://example.com/">
+            <return>
+                <bsn>123456789</bsn>
+                <soortProduct>
+                    <naam>Minimafonds</naam>
+                    <product>
+                        <dienstverleningstermijn>56</dienstverleningstermijn>
+                        <inspanningsperiode>28</inspanningsperiode>
+                        <naam type="regeling">Stadspas
+ toeslag</naam>
+                        <processtappen>
+                            <aanvraag>
+                                <datum>2019-01-01T15:05:51+02:00</datum>
+                                <document>
+                                    <id>60000000000004</id>
+                                    <isBulk>true</isBulk>
+                                    <isDms>false</isDms>
+                                </document>
+                            </aanvraag>
+                            <beslissing/>
+                        </processtappen>
+                    </product>
+                </soortProduct>
+            </return>
+        </ns0:getAanvragenResponse>
+    </S:Body>
+</S:Envelope>"""
+
+namespaced_response = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/"
+            xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+    <S:Body>
+        <ns0:getAanvragenResponse xmlns:ns0="http://example.com/">
+            <return>
+                <bsn>123456789</bsn>
+                <soortProduct xmlns:xs="http://www.w3.org/2001/XMLSchema">
+                    <naam>Minimafonds</naam>
+                    <product xmlns:ns2="http://example.com/product" xmlns="http://example.com/default">
+                        <dienstverleningstermijn>56</dienstverleningstermijn>
+                        <omschrijving xsi:nil="true"/>
+                        <typeBesluit xsi:type="xs:string">Toekenning</typeBesluit>
+                        <naam type="regeling" ns2:bron="focus" xml:lang="nl">Stadspas toeslag</naam>
+                        <processtappen>
+                            <aanvraag>
+                                <datum>2019-01-01T15:05:51+02:00</datum>
+                            </aanvraag>
+                        </processtappen>
+                    </product>
+                </soortProduct>
+            </return>
+        </ns0:getAanvragenResponse>
+    </S:Body>
+</S:Envelope>"""
+
+fault_response = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+    <S:Body>
+        <S:Fault>
+            <faultcode>S:Server</faultcode>
+            <faultstring>Internal error</faultstring>
+        </S:Fault>
+    </S:Body>
+</S:Envelope>"""
+
+
+class ParseAanvragenTest(TestCase):
+    def test_parity_with_xmltodict(self):
+        self.maxDiff = None
+        for content in [aanvragen_response, single_product_response, namespaced_response]:
+            self.assertEqual(
+                parse_aanvragen(content, "http://localhost/"),
+                (convert_with_xmltodict(content, "http://localhost/"), None))
+
+    def test_single_product(self):
+        producten, _ = parse_aanvragen(single_product_response, "/")
+
+        self.assertEqual(len(producten), 1)
+        self.assertEqual(producten[0]["_id"], "0-0")
+        self.assertEqual(producten[0]["_meest_recent"], "aanvraag")
+        self.assertEqual(producten[0]["naam"], {"@type": "regeling", "#text": "Stadspas toeslag"})
+        self.assertEqual(producten[0]["processtappen"]["aanvraag"]["document"], [{
+            "$ref": "/focus/document?id=60000000000004&isBulk=true&isDms=false",
+            "id": "60000000000004",
+            "isBulk": True,
+            "isDms": False,
+        }])
+
+    def test_namespaced_attributes(self):
+        producten, _ = parse_aanvragen(namespaced_response, "/")
+
+        product = producten[0]
+        self.assertEqual(product["@xmlns"], "http://example.com/default")
+        self.assertEqual(product["@xmlns:ns2"], "http://example.com/product")
+        self.assertEqual(product["omschrijving"], {"@xsi:nil": "true"})
+        self.assertEqual(product["typeBesluit"], {"@xsi:type": "xs:string", "#text": "Toekenning"})
+        self.assertEqual(product["naam"], {"@type": "regeling", "@ns2:bron": "focus", "@xml:lang": "nl",
+                                           "#text": "Stadspas toeslag"})
+
+    def test_no_return(self):
+        self.assertEqual(parse_aanvragen(fault_response, "/"), (None, "Internal error"))
+        self.assertEqual(parse_aanvragen(b"<html>Service Unavailable", "/"), (None, None))
+
+
+@patch('focus.focusconnect.Client', new=MockClient)
+class AanvragenTest(TestCase):
+    def test_connection(self):
+        focus_connection = FocusConnection(config, credentials)
+        result = focus_connection.aanvragen(bsn=1234, url_root='/')
+
+        self.assertEqual(result, convert_with_xmltodict(aanvragen_response, '/'))
+        self.assertFalse(any('bsn' in product for product in result))
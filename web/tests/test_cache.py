@@ -0,0 +1,289 @@
+import os
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from .mocks import Clock, MockClient, MockSession
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.cache import MISSING, TTLCache, UwsgiCache, cache_key, get_cache_stats, hash_bsn, \
+    revalidated  # noqa: E402  Module level import not at top of file
+from focus.config import config, credentials  # noqa: E402
+from focus.focusconnect import FocusConnection  # noqa: E402
+from focus.gpass_connect import GpassConnection  # noqa: E402
+
+TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
+
+
+class TTLCacheTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TTLCache(maxsize=2, timer=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.cache.set('a', 1, ttl=10)
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_expiry(self):
+        self.cache.set('a', 1, ttl=10)
+        self.cache.set('b', 2, ttl=20)
+        self.clock.now = 10
+
+        # Expired entries are removed, also when they are not accessed
+        self.cache.purge()
+        self.assertEqual(len(self.cache), 1)
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_expired_entries_are_not_counted(self):
+        self.cache.set('a', 1, ttl=10)
+        self.clock.now = 10
+
+        # Without waiting for the purge thread
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_replaced_entry_keeps_its_own_ttl(self):
+        self.cache.set('a', 1, ttl=10)
+        self.cache.set('a', 2, ttl=20)
+        self.clock.now = 15
+        self.assertEqual(self.cache.get('a'), 2)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1, ttl=10)
+        self.cache.set('b', 2, ttl=10)
+        self.cache.get('a')
+        self.cache.set('c', 3, ttl=10)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_disabled(self):
+        self.cache.set('a', 1, ttl=0)
+        self.assertIs(self.cache.get('a'), MISSING)
+
+
+@patch('focus.focusconnect.Client', new=MockClient)
+@patch('focus.cache.get_cache_ttl', lambda operation: 60)
+class CachedOperationTest(TestCase):
+    def setUp(self):
+        self.cache = TTLCache(maxsize=10)
+        patcher = patch('focus.cache.get_cache', lambda: self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        focus_connection = FocusConnection(config, credentials)
+        with focus_connection._pool.client() as client:
+            service = client.service = Mock(wraps=client.service)
+
+        first = focus_connection.jaaropgaven(bsn='123456789', url_root='/')
+        second = focus_connection.jaaropgaven(bsn='123456789', url_root='/')
+        focus_connection.jaaropgaven(bsn='123456789', url_root='/other/')
+
+        self.assertEqual(first, second)
+        self.assertEqual(service.getJaaropgaven.call_count, 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_bsn_is_hashed(self):
+        focus_connection = FocusConnection(config, credentials)
+        focus_connection.stadspas(bsn='123456789')
+
+        keys = list(self.cache._entries)
+        self.assertEqual(keys, [cache_key('stadspas', '123456789')])
+        self.assertEqual(keys, [f"stadspas:{hash_bsn('123456789')}:{{}}"])
+        self.assertNotIn('123456789', repr(keys))
+
+
+class FakeUwsgi:
+    """ The cache functions of the uwsgi module, only available when running in uWSGI """
+    def __init__(self):
+        self.caches = {}
+
+    def cache_get(self, key, name):
+        return self.caches.get(name, {}).get(key)
+
+    def cache_update(self, key, value, expires, name):
+        self.caches.setdefault(name, {})[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def cache_set(self, key, value, expires, name):
+        if self.cache_exists(key, name):
+            return None
+        return self.cache_update(key, value, expires, name)
+
+    def cache_exists(self, key, name):
+        return key in self.caches.get(name, {})
+
+    def cache_del(self, key, name):
+        self.caches.get(name, {}).pop(key, None)
+
+    def cache_clear(self, name):
+        self.caches.pop(name, None)
+
+
+class UwsgiCacheTest(TestCase):
+    def setUp(self):
+        self.uwsgi = FakeUwsgi()
+        patcher = patch('focus.cache.uwsgi', self.uwsgi)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock = Clock()
+        self.cache = UwsgiCache('focus', timer=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.cache.set('a', [{'id': 1}], ttl=10)
+        self.assertEqual(self.cache.get('a'), [{'id': 1}])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'failures': 0})
+
+    def test_not_returned_after_expiry(self):
+        # The uWSGI sweeper may not have removed the entry yet
+        self.cache.set('a', 1, ttl=0.5)
+        self.clock.now = 0.5
+        self.assertIs(self.cache.get('a'), MISSING)
+
+    def test_claim(self):
+        self.assertTrue(self.cache.claim('a', 10))
+        self.assertFalse(self.cache.claim('a', 10))
+        self.cache.release('a')
+        self.assertTrue(self.cache.claim('a', 10))
+
+    def test_wait_for_other_worker(self):
+        self.cache.claim('a', 10)
+
+        def sleep(seconds):
+            # The other worker caches the value meanwhile
+            self.cache.set('a', 1, ttl=10)
+            self.cache.release('a')
+
+        with patch('focus.cache.time.sleep', sleep):
+            self.assertEqual(self.cache.wait('a', 10), 1)
+
+    def test_wait_for_released_claim(self):
+        # The other worker has failed to retrieve the value
+        self.assertIs(self.cache.wait('a', 10), MISSING)
+
+    def test_cached_waits_for_other_worker(self):
+        connection = Mock()
+        self.cache.claim(cache_key('stadspas', '111222333'), 10)
+
+        def sleep(seconds):
+            self.cache.set(cache_key('stadspas', '111222333'), {'type': 'hoofdpashouder'}, ttl=10)
+
+        with patch('focus.cache.time.sleep', sleep), patch('focus.cache.get_cache', lambda: self.cache), \
+                patch('focus.cache.get_cache_ttl', lambda operation: 60):
+            stadspas = FocusConnection.stadspas.__wrapped__(connection, bsn='111222333')
+
+        self.assertEqual(stadspas, {'type': 'hoofdpashouder'})
+        self.assertFalse(connection._call.called)
+
+
+@patch('focus.cache.get_cache_ttl', lambda operation: 60)
+@patch("focus.crypto.get_key", lambda: TESTKEY)
+class CachedGpassTest(TestCase):
+    def test_cached(self):
+        session = Mock(wraps=MockSession())
+        cache = TTLCache(maxsize=10)
+        with patch('focus.cache.get_cache', lambda: cache), patch('focus.gpass_connect.get_session', lambda: session):
+            connection = GpassConnection('http://localhost', 'token')
+            first = connection.get_stadspassen('111111111')
+            calls = session.get.call_count
+            second = connection.get_stadspassen(admin_number='111111111')
+
+        self.assertEqual([pas['pasnummer'] for pas in first], [pas['pasnummer'] for pas in second])
+        self.assertEqual(session.get.call_count, calls)
+        # The passes are formatted on each call, so the transaction links are encrypted again
+        self.assertNotEqual(first[0]['budgets'][0]['urlTransactions'], second[0]['budgets'][0]['urlTransactions'])
+        self.assertNotIn('111111111', repr(list(cache._entries)))
+
+
+class ImmediateExecutor:
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class Backend:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    @revalidated('operation', key='admin_number')
+    def get(self, admin_number):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError()
+        return {'calls': self.calls}
+
+
+@patch('focus.cache.get_executor', lambda name, max_workers: ImmediateExecutor())
+@patch('focus.cache.get_cache_stale_ttl', lambda operation: 100)
+@patch('focus.cache.get_cache_ttl', lambda operation: 10)
+class RevalidatedTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TTLCache(maxsize=10, timer=self.clock)
+        patchers = [
+            patch('focus.cache.get_cache', lambda: self.cache),
+            patch('focus.cache.time', Mock(time=self.clock)),
+            patch('focus.cache._revalidations', {}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.backend = Backend()
+
+    def test_fresh(self):
+        self.assertEqual(self.backend.get('111111111'), {'calls': 1})
+        self.clock.now = 9
+        self.assertEqual(self.backend.get(admin_number='111111111'), {'calls': 1})
+        self.assertEqual(self.backend.calls, 1)
+
+    def test_stale_while_revalidate(self):
+        self.backend.get('111111111')
+        self.clock.now = 10
+        # The stale result is returned, the refreshed result is cached meanwhile
+        self.assertEqual(self.backend.get('111111111'), {'calls': 1})
+        self.assertEqual(self.backend.get('111111111'), {'calls': 2})
+
+        stats = get_cache_stats()['revalidated']['operation']
+        self.assertEqual(stats, {'hits': 1, 'stale': 1, 'misses': 1, 'refreshes': 1, 'refresh_failures': 0})
+
+    def test_failed_refresh(self):
+        self.backend.get('111111111')
+        self.clock.now = 10
+        self.backend.fail = True
+        self.assertEqual(self.backend.get('111111111'), {'calls': 1})
+        self.assertEqual(get_cache_stats()['revalidated']['operation']['refresh_failures'], 1)
+
+    def test_expired(self):
+        self.backend.get('111111111')
+        self.clock.now = 110
+        self.assertEqual(self.backend.get('111111111'), {'calls': 2})
+
+    def test_gpass_household(self):
+        """ The pashouder and the passes of the household are cached by the administration number """
+        session = Mock(wraps=MockSession())
+        with patch('focus.gpass_connect.get_session', lambda: session), patch("focus.crypto.get_key", lambda: TESTKEY):
+            connection = GpassConnection('http://localhost', 'token')
+            first = [pas['pasnummer'] for pas in connection.get_stadspassen('111111111')]
+            self.assertEqual(len(first), 3)
+            self.clock.now = 10
+            # The stale entries are refreshed in the background
+            passes = connection.get_stadspassen('111111111')
+            self.assertEqual([pas['pasnummer'] for pas in passes], first)
+            calls = session.get.call_count
+            self.clock.now = 11
+            connection.get_stadspassen('111111111')
+            self.assertEqual(session.get.call_count, calls)
+
+        self.assertNotIn('111111111', repr(list(self.cache._entries)))
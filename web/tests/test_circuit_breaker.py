@@ -0,0 +1,188 @@
+import os
+from unittest import TestCase
+
+from mock import MagicMock, patch
+from requests import ConnectionError, Timeout
+
+from .mocks import Clock, MockResponse
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, get_breaker, \
+    get_breakers, reset_breakers  # noqa: E402  Module level import not at top of file
+from focus.config import config, credentials  # noqa: E402
+from focus.deadline import DeadlineExceeded  # noqa: E402
+from focus.focusconnect import FocusConnection, InvalidResponseError  # noqa: E402
+from focus.server import application  # noqa: E402
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker("test", threshold=3, reset_timeout=10, timer=self.clock)
+
+    def fail(self):
+        with self.assertRaises(ValueError):
+            with self.breaker.guard():
+                raise ValueError()
+
+    def succeed(self):
+        with self.breaker.guard():
+            pass
+
+    def test_opens_after_threshold(self):
+        self.fail()
+        self.fail()
+        self.succeed()
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+        self.assertEqual(self.breaker.stats()['short_circuits'], 1)
+
+    def test_failed_call(self):
+        for _ in range(3):
+            with self.breaker.guard() as call:
+                call.failed()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_deadline_is_no_failure(self):
+        for _ in range(3):
+            with self.assertRaises(DeadlineExceeded):
+                with self.breaker.guard():
+                    raise DeadlineExceeded()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_closes(self):
+        for _ in range(3):
+            self.fail()
+        self.clock.now = 10
+
+        with self.breaker.guard():
+            self.assertEqual(self.breaker.state, HALF_OPEN)
+            # only one probe at a time
+            with self.assertRaises(CircuitOpenError):
+                self.succeed()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.stats()['transitions'], {CLOSED: 1, OPEN: 1, HALF_OPEN: 1})
+
+    def test_half_open_probe_reopens(self):
+        for _ in range(3):
+            self.fail()
+        self.clock.now = 10
+
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now = 15
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+        self.clock.now = 20
+        self.succeed()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class FocusCircuitBreakerTest(TestCase):
+    def setUp(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+
+    @patch('focus.circuit_breaker.get_breaker_threshold', lambda: 2)
+    def test_focus_breaker(self):
+        client = MagicMock()
+        client.service.getStadspas.side_effect = ConnectionError()
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: client):
+            focus_connection = FocusConnection(config, credentials)
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                focus_connection.stadspas(bsn='111222333')
+        self.assertEqual(client.service.getStadspas.call_count, 2)
+
+        with self.assertRaises(CircuitOpenError):
+            focus_connection.stadspas(bsn='111222333')
+        # The service has not been called
+        self.assertEqual(client.service.getStadspas.call_count, 2)
+
+        # The other operations are not affected
+        self.assertEqual(get_breaker("focus getAanvragen").state, CLOSED)
+
+    @patch('focus.circuit_breaker.get_breaker_threshold', lambda: 2)
+    def test_focus_breaker_opens_on_server_errors(self):
+        client = MagicMock()
+        client.service.getAanvragen.return_value = MockResponse(reply=b"<html>Internal Server Error</html>",
+                                                                status_code=500)
+        focus_connection = self.connection(client)
+
+        for _ in range(2):
+            with self.assertRaises(InvalidResponseError):
+                focus_connection.aanvragen(bsn='111222333', url_root='/')
+        self.assertEqual(get_breaker("focus getAanvragen").state, OPEN)
+
+        with self.assertRaises(CircuitOpenError):
+            focus_connection.aanvragen(bsn='111222333', url_root='/')
+        self.assertEqual(client.service.getAanvragen.call_count, 2)
+        # Server errors do not re-establish the connection, also not when they open the breaker
+        focus_connection.reset.assert_not_called()
+
+    @patch('focus.circuit_breaker.get_breaker_threshold', lambda: 2)
+    def test_soap_faults_are_no_failures(self):
+        fault = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+            <S:Body><S:Fault><faultcode>S:Server</faultcode><faultstring>Unknown bsn</faultstring></S:Fault></S:Body>
+        </S:Envelope>"""
+        client = MagicMock()
+        # SOAP 1.1 returns a fault with status 500
+        client.service.getJaaropgaven.return_value = MockResponse(reply=fault, status_code=500)
+        focus_connection = self.connection(client)
+
+        for _ in range(3):
+            with self.assertLogs('focus.focusconnect', level='ERROR'):
+                self.assertEqual(focus_connection.jaaropgaven(bsn='111222333', url_root='/'), [])
+        self.assertEqual(get_breaker("focus getJaaropgaven").state, CLOSED)
+        self.assertEqual(client.service.getJaaropgaven.call_count, 3)
+
+    def connection(self, client):
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: client):
+            focus_connection = FocusConnection(config, credentials)
+        focus_connection.reset = MagicMock()
+        return focus_connection
+
+    def test_reset_on_connection_error(self):
+        client = MagicMock()
+        client.service.getStadspas.side_effect = ConnectionError()
+        focus_connection = self.connection(client)
+
+        with self.assertRaises(ConnectionError):
+            focus_connection.stadspas(bsn='111222333')
+        focus_connection.reset.assert_called_once()
+
+    @patch('focus.circuit_breaker.get_breaker_threshold', lambda: 2)
+    def test_reset_when_breaker_opens(self):
+        client = MagicMock()
+        client.service.getStadspas.side_effect = Timeout()
+        focus_connection = self.connection(client)
+
+        # A timeout leaves the clients in place, until the breaker opens
+        with self.assertRaises(Timeout):
+            focus_connection.stadspas(bsn='111222333')
+        focus_connection.reset.assert_not_called()
+        with self.assertRaises(Timeout):
+            focus_connection.stadspas(bsn='111222333')
+        focus_connection.reset.assert_called_once()
+
+        # An open breaker does not reset the connection again
+        with self.assertRaises(CircuitOpenError):
+            focus_connection.stadspas(bsn='111222333')
+        focus_connection.reset.assert_called_once()
+
+    def test_status_circuits(self):
+        get_breaker("gpass pas")
+        response = application.test_client().get('/status/circuits')
+        self.assertEqual(response.json, {name: breaker.stats() for name, breaker in get_breakers().items()})
+        self.assertEqual(response.json["gpass pas"]["state"], CLOSED)
@@ -0,0 +1,99 @@
+import threading
+import time
+from unittest import TestCase
+
+from mock import ANY, patch
+from requests import ConnectionError
+
+from focus.client_pool import ClientPool
+from focus.deadline import DeadlineExceeded, deadline
+
+
+class Factory:
+    def __init__(self, fail=False):
+        self.created = 0
+        self.fail = fail
+
+    def __call__(self):
+        if self.fail:
+            return None
+        self.created += 1
+        return f"client {self.created}"
+
+
+class ClientPoolTest(TestCase):
+    def test_clients_are_reused(self):
+        pool = ClientPool(Factory(), 4)
+        for _ in range(3):
+            with pool.client() as client:
+                self.assertEqual(client, "client 1")
+
+        self.assertTrue(pool.is_alive())
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_clients_are_created_on_demand(self):
+        pool = ClientPool(Factory(), 2)
+        with pool.client() as first, pool.client() as second:
+            self.assertEqual({first, second}, {"client 1", "client 2"})
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    def test_wait_for_client(self):
+        pool = ClientPool(Factory(), 1)
+        checked_out = threading.Event()
+
+        def hold_client():
+            with pool.client():
+                checked_out.set()
+                time.sleep(0.2)
+
+        thread = threading.Thread(target=hold_client)
+        thread.start()
+        checked_out.wait()
+        with pool.client() as client:
+            self.assertEqual(client, "client 1")
+        thread.join()
+
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreater(stats['max_wait_time'], 0.1)
+
+    def test_wait_until_deadline(self):
+        pool = ClientPool(Factory(), 1)
+        with pool.client():
+            with deadline(0.1), self.assertRaises(DeadlineExceeded):
+                with pool.client():
+                    pass
+
+    def test_no_client(self):
+        factory = Factory(fail=True)
+        pool = ClientPool(factory, 2)
+        self.assertFalse(pool.is_alive())
+
+        with self.assertRaises(ConnectionError):
+            with pool.client():
+                pass
+        self.assertEqual(pool.stats()['created'], 0)
+
+    def test_wait_histogram(self):
+        pool = ClientPool(Factory(), 1)
+        with patch('focus.client_pool.observe') as observe:
+            with pool.client():
+                with deadline(0.1), self.assertRaises(DeadlineExceeded):
+                    with pool.client():
+                        pass
+
+        observe.assert_any_call("pool_wait", {}, ANY)
+        observe.assert_any_call("pool_wait", {}, ANY, error=True)
+        self.assertGreater(observe.call_args_list[-1].args[2], 0.05)
+
+    def test_close(self):
+        closed = []
+        pool = ClientPool(Factory(), 2, close=closed.append)
+        with pool.client() as used:
+            with pool.client():
+                pass
+            pool.close()
+            # The idle client is closed, the client in use is not
+            self.assertEqual(closed, ["client 2"])
+        self.assertEqual(closed, ["client 2", used])
+        self.assertEqual(pool.stats()['idle'], 0)
@@ -1,3 +1,4 @@
+import json
 import os.path
 
 # Prepare environment
@@ -5,9 +6,9 @@ from datetime import datetime
 
 from flask_testing import TestCase as FlaskTestCase
 from hiro import Timeline
-from mock import patch
+from mock import ANY, patch
 
-from .mocks import MockClient, get_response_mock
+from .mocks import MockClient, MockSession
 
 os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
 os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
@@ -21,7 +22,7 @@ TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
 
 @patch('focus.focusconnect.Client', new=MockClient)
 @patch('focus.focusserver.get_bsn_from_request', new=lambda s: 123456789)  # side step decoding the BSN from SAML token
-@patch('focus.gpass_connect.requests.get', get_response_mock)
+@patch('focus.gpass_connect.get_session', MockSession)
 @patch('focus.focusserver.get_gpass_api_location', lambda: 'http://localhost')
 @patch("focus.crypto.get_key", lambda: TESTKEY)
 class CombinedApiTest(FlaskTestCase):
@@ -29,6 +30,49 @@ class CombinedApiTest(FlaskTestCase):
         return application
 
     def test_combined_api(self):
+        self._assert_combined_api()
+
+    @patch('focus.focusserver.get_combined_concurrent', lambda: False)
+    def test_combined_api_sequential(self):
+        self._assert_combined_api()
+
+    def test_server_timing(self):
+        with patch('focus.server.get_server_timing', lambda: True), Timeline(start=datetime(2017, 5, 1, 1, 1, 1)):
+            response = self.client.get('/focus/combined')
+
+        stages = [entry.split(';dur=')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        for stage in ['soap;desc="getJaaropgaven"', 'parse;desc="getJaaropgaven"', 'gpass;desc="/rest/sales/v1/pashouder"',
+                      'gpass;desc="/rest/sales/v1/pas/{pasnummer}"', 'section;desc="stadspas"', 'json']:
+            self.assertIn(stage, stages)
+
+    def test_slow_request_log(self):
+        with patch('focus.request_log.get_slow_request_threshold', lambda: 0.000001), \
+                Timeline(start=datetime(2017, 5, 1, 1, 1, 1)), self.assertLogs('focus.request_log') as logs:
+            self.client.get('/focus/combined')
+
+        self.assertEqual(len(logs.records), 1)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['endpoint'], 'combined')
+        self.assertEqual(line['status'], 200)
+        for stage in ['soap', 'parse', 'gpass', 'section', 'json']:
+            self.assertIn(stage, line['stages'])
+        self.assertIn({'stage': 'soap', 'operation': 'getJaaropgaven', 'ms': ANY}, line['calls'])
+        self.assertEqual(set(line['bytes']), {'getJaaropgaven', 'getUitkeringspecificaties', 'getEAanvraagTOZO',
+                                              'getStadspas'})
+        self.assertTrue(all(size > 0 for size in line['bytes'].values()))
+        self.assertEqual(line['counts'], {'documenten': 10, 'stadspassen': 3, 'budgets': 3})
+
+    def test_fast_request_not_logged(self):
+        with patch('focus.request_log.get_slow_request_threshold', lambda: 60), \
+                patch('focus.request_log.logger') as logger:
+            self.client.get('/focus/combined')
+        logger.warning.assert_not_called()
+
+    def test_no_server_timing(self):
+        response = self.client.get('/focus/combined')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def _assert_combined_api(self):
         self.maxDiff = None
 
         with Timeline(start=datetime(2017, 5, 1, 1, 1, 1)):
@@ -169,6 +213,12 @@ class CombinedApiTest(FlaskTestCase):
                 ]
 
             },
+            'sections': {
+                'jaaropgaven': 'ok',
+                'uitkeringsspecificaties': 'ok',
+                'tozodocumenten': 'ok',
+                'stadspassaldo': 'ok',
+            },
             'status': 'OK'
         }
 
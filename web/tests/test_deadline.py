@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from flask_testing import TestCase as FlaskTestCase
+from mock import patch
+from requests import ConnectionError
+
+from .mocks import MockClient, MockResponse, MockSession
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.concurrency import get_executor, submit  # noqa: E402
+from focus.deadline import DeadlineExceeded, deadline, get_timeout, remaining  # noqa: E402
+from focus.gpass_connect import GpassConnection  # noqa: E402
+from focus.server import application  # noqa: E402
+
+TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
+
+
+class DeadlineTest(TestCase):
+    def test_without_deadline(self):
+        self.assertEqual(get_timeout(5), 5)
+        self.assertIsNone(remaining())
+
+    def test_timeout_is_limited_by_deadline(self):
+        with deadline(2):
+            self.assertLessEqual(get_timeout(5), 2)
+            self.assertEqual(get_timeout(1), 1)
+        self.assertEqual(get_timeout(5), 5)
+
+    def test_deadline_exceeded(self):
+        with deadline(0):
+            with self.assertRaises(DeadlineExceeded):
+                get_timeout(5)
+
+
+def slow_jaaropgaven(self, bsn, url_root):
+    time.sleep(0.5)
+    return []
+
+
+def failing_uitkeringsspecificaties(self, bsn, url_root):
+    raise ConnectionError('Connection refused')
+
+
+@patch('focus.focusconnect.Client', new=MockClient)
+@patch('focus.focusserver.get_bsn_from_request', new=lambda s: 123456789)  # side step decoding the BSN from SAML token
+@patch('focus.gpass_connect.get_session', MockSession)
+@patch('focus.focusserver.get_gpass_api_location', lambda: 'http://localhost')
+@patch("focus.crypto.get_key", lambda: TESTKEY)
+@patch('focus.focusconnect.FocusConnection.jaaropgaven', new=slow_jaaropgaven)
+@patch('focus.focusconnect.FocusConnection.uitkeringsspecificaties', new=failing_uitkeringsspecificaties)
+@patch('focus.deadline.get_request_deadline', lambda: 0.2)
+class CombinedDeadlineTest(FlaskTestCase):
+    def create_app(self):
+        return application
+
+    def test_partial_result(self):
+        response = self.client.get('/focus/combined')
+
+        self.assert200(response)
+        self.assertEqual(response.json['sections'], {
+            'jaaropgaven': 'timeout',
+            'uitkeringsspecificaties': 'error',
+            'tozodocumenten': 'ok',
+            'stadspassaldo': 'ok',
+        })
+        self.assertIsNone(response.json['content']['jaaropgaven'])
+        self.assertIsNone(response.json['content']['uitkeringsspecificaties'])
+        self.assertEqual(len(response.json['content']['tozodocumenten']), 6)
+
+    @patch('focus.focusserver.get_combined_concurrent', lambda: False)
+    def test_partial_result_sequential(self):
+        response = self.client.get('/focus/combined')
+
+        # The running section finishes, the sections after it are skipped
+        self.assert200(response)
+        self.assertEqual(response.json['sections'], {
+            'jaaropgaven': 'ok',
+            'uitkeringsspecificaties': 'timeout',
+            'tozodocumenten': 'timeout',
+            'stadspassaldo': 'timeout',
+        })
+
+    @patch('focus.focusserver.get_combined_concurrent', lambda: False)
+    def test_no_result(self):
+        with patch('focus.deadline.get_request_deadline', lambda: 0):
+            response = self.client.get('/focus/combined')
+
+        self.assertEqual(response.status_code, 500)
+
+
+PASHOUDER = {
+    "volledige_naam": "A. Burger",
+    "passen": [{"actief": True, "pasnummer": 1}, {"actief": True, "pasnummer": 2}],
+    "sub_pashouders": [],
+}
+
+
+class SectionSlotTest(TestCase):
+    def test_slow_section_frees_its_slot(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_get(self, path, *args):
+            if "pashouder" in path:
+                return MockResponse(PASHOUDER)
+            # The details of a pas
+            release.wait(5)
+            return MockResponse(None, status_code=404)
+
+        executor = get_executor("slot test", 1)
+        gpass = GpassConnection('http://localhost', 'token')
+
+        def section():
+            with deadline(0.2):
+                return gpass.get_stadspassen(admin_number='123')
+
+        with patch('focus.gpass_connect.GpassConnection._get', slow_get):
+            slow = submit(executor, section)
+            with self.assertRaises(DeadlineExceeded):
+                slow.result(timeout=2)
+            # The GPASS calls are still running, the slot of the section is free again
+            self.assertFalse(release.is_set())
+            self.assertEqual(submit(executor, lambda: "next").result(timeout=1), "next")
@@ -0,0 +1,122 @@
+import base64
+from io import BytesIO
+from unittest import TestCase
+
+from focus.document_reader import (
+    DocumentReader, InlineDocumentReader, MultipartDocumentReader, get_file_name, iter_document, read_document)
+
+from .mocks import MockResponse, get_document, get_empty_document, pdf_document
+
+BOUNDARY = "uuid:5ea1e7b4-1bd1-4fb8-a0a8-2f4fcd8fe4ec"
+
+ROOT_PART = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body><ns2:getDocumentResponse xmlns:ns2="http://example.com/"><return>
+<dataHandler><xop:Include xmlns:xop="http://www.w3.org/2004/08/xop/include" href="cid:doc%40example.com"/></dataHandler>
+<fileName>TestIKB\\TestBulk15.pdf</fileName>
+</return></ns2:getDocumentResponse></S:Body></S:Envelope>"""
+
+
+def multipart_response(document, transfer_encoding="binary"):
+    return b"\r\n".join([
+        b"--" + BOUNDARY.encode(),
+        b'Content-Type: application/xop+xml; charset=utf-8; type="text/xml"',
+        b"Content-ID: <root@example.com>",
+        b"",
+        ROOT_PART,
+        b"--" + BOUNDARY.encode(),
+        b"Content-Type: application/octet-stream",
+        b"Content-ID: <doc@example.com>",
+        b"Content-Transfer-Encoding: " + transfer_encoding.encode(),
+        b"",
+        document,
+        b"--" + BOUNDARY.encode() + b"--",
+        b"",
+    ])
+
+
+def read(reader, content, chunk_size):
+    for start in range(0, len(content), chunk_size):
+        reader.feed(content[start:start + chunk_size])
+    reader.close()
+    return reader
+
+
+class InlineDocumentReaderTest(TestCase):
+    def test_document(self):
+        content = get_document().encode()
+        for chunk_size in [1, 7, 1000, len(content)]:
+            with self.subTest(chunk_size=chunk_size):
+                reader = read(InlineDocumentReader(BytesIO()), content, chunk_size)
+
+                self.assertTrue(reader.found)
+                self.assertEqual(reader.spool.getvalue(), pdf_document)
+                self.assertEqual(get_file_name(reader.xml), 'TestIKB\\TestBulk15.pdf')
+                self.assertIsNone(reader.raw)
+
+    def test_no_document(self):
+        content = get_empty_document().encode()
+        reader = read(InlineDocumentReader(BytesIO()), content, 10)
+
+        self.assertFalse(reader.found)
+        self.assertEqual(reader.spool.getvalue(), b"")
+        self.assertEqual(reader.raw, content)
+
+    def test_incomplete(self):
+        content = get_document().encode()
+        with self.assertRaises(ValueError):
+            read(InlineDocumentReader(BytesIO()), content[:len(content) // 2], 100)
+
+
+class MultipartDocumentReaderTest(TestCase):
+    def test_binary(self):
+        content = multipart_response(pdf_document)
+        for chunk_size in [1, 13, 1000, len(content)]:
+            with self.subTest(chunk_size=chunk_size):
+                reader = read(MultipartDocumentReader(BytesIO(), BOUNDARY), content, chunk_size)
+
+                self.assertTrue(reader.found)
+                self.assertEqual(reader.spool.getvalue(), pdf_document)
+                self.assertEqual(get_file_name(reader.xml), 'TestIKB\\TestBulk15.pdf')
+
+    def test_base64(self):
+        content = multipart_response(base64.encodebytes(pdf_document), "base64")
+        reader = read(MultipartDocumentReader(BytesIO(), BOUNDARY), content, 100)
+
+        self.assertTrue(reader.found)
+        self.assertEqual(reader.spool.getvalue(), pdf_document)
+
+    def test_incomplete(self):
+        content = multipart_response(pdf_document)
+        with self.assertRaises(ValueError):
+            read(MultipartDocumentReader(BytesIO(), BOUNDARY), content[:-100], 100)
+
+
+class ReadDocumentTest(TestCase):
+    def test_multipart_response(self):
+        response = MockResponse(multipart_response(pdf_document))
+        response.headers = {
+            "Content-Type": f'multipart/related; type="application/xop+xml"; boundary="{BOUNDARY}"; start="<root@example.com>"'
+        }
+        reader = read_document(response, chunk_size=1000)
+
+        self.assertIsInstance(reader, MultipartDocumentReader)
+        self.assertEqual(b"".join(iter_document(reader, chunk_size=1000)), pdf_document)
+        self.assertTrue(reader.spool.closed)
+
+    def test_inline_response(self):
+        reader = read_document(MockResponse(get_document()))
+
+        self.assertIsInstance(reader, InlineDocumentReader)
+        self.assertEqual(b"".join(iter_document(reader)), pdf_document)
+
+
+class IncompleteReader(DocumentReader):
+    def feed(self, chunk):
+        self._retain(chunk)
+
+
+class DocumentReaderTest(TestCase):
+    def test_incomplete_reader(self):
+        # A reader without close fails when it is created, not halfway through a response
+        with self.assertRaises(TypeError):
+            IncompleteReader(BytesIO())
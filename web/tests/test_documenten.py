@@ -1,11 +1,14 @@
 import os.path
+from io import BytesIO
 from unittest import TestCase
 
 # Prepare environment
 from flask_testing import TestCase as FlaskTestCase
 from mock import patch
 
-from tests.mocks import MockClient, pdf_document
+from requests import Response
+
+from tests.mocks import MockClient, RESPONSES_PATH, get_document, get_empty_document, pdf_document
 
 os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
 os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
@@ -25,8 +28,40 @@ class DocumentTest(TestCase):
         doc = focus_connection.document(id=1, bsn="12345", isBulk=True, isDms=False)
         self.assertEqual(doc['fileName'], 'TestIKB\\TestBulk15.pdf')
         self.assertEqual(doc['mime_type'], 'application/pdf')
+        self.assertEqual(doc['size'], len(pdf_document))
+        self.assertEqual(b''.join(doc['contents']), pdf_document)
+
+
+def raw_response(content):
+    response = Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'text/xml; charset=utf-8'
+    response.raw = BytesIO(content)
+    return response
+
+
+class DocumentFallbackTest(TestCase):
+    """ A response in which the document is not recognized is deserialized by zeep """
+    def setUp(self):
+        self.focus_connection = FocusConnection(
+            dict(config, wsdl=os.path.join(RESPONSES_PATH, 'getdocument.wsdl')), credentials)
+
+    def document(self, content):
+        with patch('focus.focusconnect.FocusSession.post', return_value=raw_response(content)) as post:
+            doc = self.focus_connection.document(id=1, bsn="12345", isBulk=True, isDms=False)
+        self.assertEqual(post.call_count, 1)
+        return doc
+
+    def test_cdata(self):
+        content = get_document().replace('<dataHandler>', '<dataHandler><![CDATA[').replace('</dataHandler>', ']]></dataHandler>')
+        doc = self.document(content.encode())
+
+        self.assertEqual(doc['fileName'], 'TestIKB\\TestBulk15.pdf')
         self.assertEqual(doc['contents'], pdf_document)
 
+    def test_no_document(self):
+        self.assertIsNone(self.document(get_empty_document().encode()))
+
 
 # side step decoding the BSN from SAML token
 @patch('focus.focusserver.get_bsn_from_request', new=lambda s: '123456789')
@@ -38,6 +73,7 @@ class DocumentApiTest(FlaskTestCase):
     def test_document_api(self):
         response = self.client.get('/focus/document?id=1&isBulk=true&isDms=true')
         self.assertEqual(response.data, pdf_document)
+        self.assertEqual(response.headers['Content-Length'], str(len(pdf_document)))
         self.assertEqual(response.headers['Content-Disposition'], r'attachment; filename="TestIKB\TestBulk15.pdf"')
 
 
@@ -4,7 +4,7 @@ from unittest import TestCase
 # Prepare environment
 from mock import patch
 
-from .mocks import MockClient
+from .mocks import FixtureClient, MockClient
 
 os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
 os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
@@ -38,3 +38,26 @@ class JaaropgavenTest(TestCase):
         ]
 
         self.assertEqual(result, expected)
+
+
+fault_response = b"""<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+    <S:Body>
+        <S:Fault>
+            <faultcode>S:Server</faultcode>
+            <faultstring>Unknown nl.amsterdam.dwi.onlineklantbeeld.model.DocumentLocatie#1234</faultstring>
+        </S:Fault>
+    </S:Body>
+</S:Envelope>"""
+
+
+@patch('focus.focusconnect.Client', new=lambda wsdl, transport: FixtureClient(fault_response))
+class JaaropgavenFaultTest(TestCase):
+    def test_fault(self):
+        focus_connection = FocusConnection(config, credentials)
+        with self.assertLogs('focus.focusconnect', level='ERROR') as logs:
+            result = focus_connection.jaaropgaven(bsn=1234, url_root='/')
+
+        self.assertEqual(result, [])
+        self.assertEqual(logs.output, [
+            'ERROR:focus.focusconnect:no body jaaropgaven? Unknown nl.amsterdam.dwi.onlineklantbeeld.model.DocumentLocatie'
+        ])
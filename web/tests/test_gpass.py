@@ -1,19 +1,22 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from unittest import TestCase
 
 # Prepare environment
 from flask_testing import TestCase as FlaskTestCase
-from mock import patch
+from mock import Mock, patch
 
-from focus.gpass_connect import GpassConnection
+from focus.gpass_connect import GpassConnection, get_session
 from focus.server import application  # noqa: E402
 from focus.crypto import encrypt
 
-from .mocks import get_response_mock
+from .mocks import MockSession, get_response_mock
 
 TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
 
 
-@patch('focus.gpass_connect.requests.get', get_response_mock)
+@patch('focus.gpass_connect.get_session', MockSession)
 @patch('focus.server.get_gpass_api_location', lambda: 'http://localhost')
 @patch("focus.crypto.get_key", lambda: TESTKEY)
 class GpassConnectionTest(TestCase):
@@ -83,6 +86,22 @@ class GpassConnectionTest(TestCase):
 
         self.assertEqual(result, expected)
 
+    def test_get_stadspassen_concurrently(self):
+        def slow_get(url, **kwargs):
+            if '/pas/' in url:
+                # the first pas is the slowest
+                time.sleep(0.3 if '6011012604737' in url else 0.1)
+            return get_response_mock(url, **kwargs)
+
+        con = self._get_connection()
+        start = time.time()
+        with patch('focus.gpass_connect.get_session', lambda: Mock(get=slow_get)):
+            result = con.get_stadspassen(self.admin_number)
+
+        # Sequentially the 3 passes take 0.5 seconds
+        self.assertLess(time.time() - start, 0.45)
+        self.assertEqual([pas['naam'] for pas in result], ['J. Doe', 'P Achternaam2', 'J Achternaam3'])
+
     def test_get_transactions(self):
         pas_number = '6666666666666'
         budget_code = 'aaa'
@@ -106,7 +125,7 @@ class GpassConnectionTest(TestCase):
         self.assertEqual(result, None)
 
 
-@patch('focus.gpass_connect.requests.get', get_response_mock)
+@patch('focus.gpass_connect.get_session', MockSession)
 @patch('focus.server.get_gpass_api_location', lambda: 'http://localhost')
 @patch("focus.crypto.get_key", lambda: TESTKEY)
 class GpassApiTest(FlaskTestCase):
@@ -137,3 +156,45 @@ class GpassApiTest(FlaskTestCase):
 
         self.assert200(response)
         self.assertEqual(response.json, expected)
+
+
+class GpassSessionTest(TestCase):
+    def test_session_per_thread_with_shared_pool(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(get_session(), get_session())
+        self.assertIsNot(sessions[0], get_session())
+        self.assertIs(sessions[0].get_adapter('https://localhost'), get_session().get_adapter('https://localhost'))
+
+    def test_no_cookies(self):
+        cookies = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                cookies.append(self.headers.get("Cookie"))
+                self.send_response(200)
+                self.send_header("Set-Cookie", "session=citizen")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        # In a new thread, to use a new session
+        def get_twice():
+            for _ in range(2):
+                get_session().get(f"http://127.0.0.1:{server.server_port}/")
+        thread = threading.Thread(target=get_twice)
+        thread.start()
+        thread.join()
+
+        # The cookie of the first response is not sent with the second request
+        self.assertEqual(cookies, [None, None])
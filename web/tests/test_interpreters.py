@@ -0,0 +1,62 @@
+import glob
+import os
+from datetime import date
+from unittest import TestCase
+
+from mock import patch
+
+from .mocks import FixtureClient, RESPONSES_PATH
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.config import config, credentials  # noqa: E402  Module level import not at top of file
+from focus.focusconnect import FocusConnection  # noqa: E402
+
+
+OPERATIONS = {
+    'jaaropgaven': lambda connection: connection.jaaropgaven(bsn=1234, url_root='/'),
+    'uitkeringsspecificaties': lambda connection: connection.uitkeringsspecificaties(bsn=1234, url_root='/'),
+    'EAanvragenTozo': lambda connection: connection.EAanvragenTozo(bsn=1234, url_root='/'),
+    'stadspas': lambda connection: connection.stadspas(bsn=1234),
+}
+
+
+def convert(interpreter, reply, operation):
+    """ The result of the operation, or the type of error, when the reply is interpreted by the interpreter """
+    with patch('focus.focusconnect.Client', new=lambda wsdl, transport: FixtureClient(reply)):
+        connection = FocusConnection(dict(config, interpreter=interpreter), credentials)
+    try:
+        return OPERATIONS[operation](connection)
+    except Exception as error:
+        return type(error).__name__
+
+
+class InterpreterParityTest(TestCase):
+    def test_fixtures(self):
+        self.maxDiff = None
+        fixtures = glob.glob(os.path.join(RESPONSES_PATH, '*.xml'))
+        self.assertTrue(fixtures)
+
+        for fixture in fixtures:
+            with open(fixture, 'rb') as fp:
+                reply = fp.read()
+            for operation in OPERATIONS:
+                with self.subTest(fixture=os.path.basename(fixture), operation=operation):
+                    expected = convert('bs4', reply, operation)
+                    result = convert('lxml', reply, operation)
+                    if isinstance(expected, str):
+                        # Both interpreters fail on this combination
+                        self.assertIsInstance(result, str)
+                    else:
+                        self.assertEqual(result, expected)
+
+    def test_fixtures_have_content(self):
+        # Make sure that the parity test compares real results
+        with open(os.path.join(RESPONSES_PATH, 'stadspas.xml'), 'rb') as fp:
+            reply = fp.read()
+        with patch('focus.focusinterpreter.date') as mock_date:
+            mock_date.today.return_value = date(2017, 5, 1)
+            self.assertEqual(convert('lxml', reply, 'stadspas'), {'adminstratienummer': '8800000002', 'type': 'hoofpashouder'})
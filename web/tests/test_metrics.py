@@ -0,0 +1,151 @@
+import json
+import os
+from unittest import TestCase
+
+from mock import patch
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.circuit_breaker import get_breaker, reset_breakers  # noqa: E402  Module level import not at top of file
+from focus.concurrency import get_executor, submit  # noqa: E402
+from focus.measure_time import MeasureTime, collect_spans, format_server_timing, stop_collecting_spans  # noqa: E402
+from focus.metrics import Registry, collect, collect_circuits, merge, render  # noqa: E402
+from focus.server import application  # noqa: E402
+
+
+class FakeUwsgi:
+    """ The functions of the uwsgi module that are used by the metrics, only available when running in uWSGI """
+    numproc = 2
+
+    def __init__(self):
+        self.cache = {}
+        self.worker = 1
+
+    def worker_id(self):
+        return self.worker
+
+    def cache_update(self, key, value, expires, name):
+        self.cache[key] = value.encode()
+        return True
+
+    def cache_get(self, key, name):
+        return self.cache.get(key)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        patcher = patch('focus.metrics._registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render(self):
+        self.registry.observe("soap", {"operation": "getStadspas"}, 0.02)
+        self.registry.observe("soap", {"operation": "getStadspas"}, 3, error=True)
+        text = render(self.registry.snapshot())
+
+        self.assertIn('# TYPE focus_soap_duration_seconds histogram', text)
+        self.assertIn('focus_soap_duration_seconds_bucket{operation="getStadspas",le="0.01"} 0', text)
+        self.assertIn('focus_soap_duration_seconds_bucket{operation="getStadspas",le="0.025"} 1', text)
+        self.assertIn('focus_soap_duration_seconds_bucket{operation="getStadspas",le="5.0"} 2', text)
+        self.assertIn('focus_soap_duration_seconds_bucket{operation="getStadspas",le="+Inf"} 2', text)
+        self.assertIn('focus_soap_duration_seconds_sum{operation="getStadspas"} 3.02', text)
+        self.assertIn('focus_soap_duration_seconds_count{operation="getStadspas"} 2', text)
+        self.assertIn('# TYPE focus_soap_errors_total counter', text)
+        self.assertIn('focus_soap_errors_total{operation="getStadspas"} 1', text)
+
+    def test_label_escaping(self):
+        self.registry.observe("gpass", {"path": 'a"b\\c'}, 0.1)
+        self.assertIn('{path="a\\"b\\\\c",le="0.1"} 1', render(self.registry.snapshot()))
+
+    def test_measure_time(self):
+        with MeasureTime("gpass", path="/rest/sales/v1/pas/{pasnummer}"):
+            pass
+        with self.assertRaises(ValueError):
+            with MeasureTime("gpass", path="/rest/sales/v1/pas/{pasnummer}"):
+                raise ValueError()
+
+        [histogram] = merge(self.registry.snapshot()).values()
+        self.assertEqual(sum(histogram.counts), 2)
+        self.assertEqual(histogram.errors, 1)
+
+    def test_workers_are_added_up(self):
+        uwsgi = FakeUwsgi()
+        with patch('focus.metrics.uwsgi', uwsgi):
+            self.registry.observe("soap", {"operation": "getStadspas"}, 0.02)
+            uwsgi.cache["metrics:2"] = json.dumps(self.registry.snapshot()).encode()
+            snapshot = collect()
+
+        [histogram] = merge(snapshot).values()
+        self.assertEqual(sum(histogram.counts), 2)
+
+    def test_render_circuits(self):
+        circuits = [
+            ["focus getStadspas", "closed", {"closed": 1, "open": 1, "half_open": 1}],
+            # The breaker of another worker
+            ["focus getStadspas", "open", {"closed": 0, "open": 1, "half_open": 0}],
+        ]
+        text = render([], circuits)
+
+        self.assertIn('# TYPE focus_circuit_state gauge', text)
+        # The worst state of the workers
+        self.assertIn('focus_circuit_state{name="focus getStadspas"} 2', text)
+        self.assertIn('# TYPE focus_circuit_transitions_total counter', text)
+        self.assertIn('focus_circuit_transitions_total{name="focus getStadspas",state="open"} 2', text)
+        self.assertIn('focus_circuit_transitions_total{name="focus getStadspas",state="closed"} 1', text)
+
+    def test_circuits_of_workers(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        get_breaker("gpass pas")
+        uwsgi = FakeUwsgi()
+        with patch('focus.metrics.uwsgi', uwsgi):
+            uwsgi.cache["circuits:2"] = json.dumps([["gpass pas", "half_open", {}]]).encode()
+            circuits = collect_circuits()
+
+        self.assertEqual(circuits, [["gpass pas", "closed", {"closed": 0, "open": 0, "half_open": 0}],
+                                    ["gpass pas", "half_open", {}]])
+
+    def test_endpoint(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        get_breaker("gpass pas")
+        client = application.test_client()
+        client.get('/status/health')
+        response = client.get('/status/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('focus_http_duration_seconds_count{endpoint="status_health",status="200"} 1', response.text)
+        self.assertIn('focus_circuit_state{name="gpass pas"} 0', response.text)
+
+
+class SpansTest(TestCase):
+    def test_collect_spans(self):
+        token = collect_spans()
+        with MeasureTime("saml"):
+            pass
+        # Also in the executor threads that are started from the request
+        future = submit(get_executor("test", 1), self._measure)
+        future.result()
+        spans = stop_collecting_spans(token)
+
+        self.assertEqual([(name, labels) for name, labels, _ in spans],
+                         [("saml", {}), ("gpass", {"path": "/rest/sales/v1/pashouder"})])
+
+        # Not collected outside the request
+        with MeasureTime("saml"):
+            pass
+        self.assertEqual(len(spans), 2)
+
+    @staticmethod
+    def _measure():
+        with MeasureTime("gpass", path="/rest/sales/v1/pashouder"):
+            pass
+
+    def test_format_server_timing(self):
+        spans = [("saml", {}, 0.0012), ("gpass", {"path": '/a"b'}, 0.25)]
+        self.assertEqual(format_server_timing(spans), 'saml;dur=1.2, gpass;desc="/a\\"b";dur=250.0')
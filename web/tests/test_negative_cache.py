@@ -0,0 +1,133 @@
+import os
+from hashlib import sha256
+from unittest import TestCase
+
+from mock import MagicMock, Mock, patch
+
+from .mocks import Clock, MockResponse
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.circuit_breaker import reset_breakers  # noqa: E402  Module level import not at top of file
+from focus.config import config, credentials  # noqa: E402
+from focus.focusconnect import FocusConnection, InvalidResponseError  # noqa: E402
+from focus.negative_cache import BloomFilter, RotatingBloomFilter, get_negative_cache_stats  # noqa: E402
+
+
+def digest(i):
+    return sha256(str(i).encode()).digest()
+
+
+class BloomFilterTest(TestCase):
+    def test_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(digest(i))
+        self.assertTrue(all(digest(i) in bloom_filter for i in range(1000)))
+
+    def test_error_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(digest(i))
+        false_positives = sum(digest(i) in bloom_filter for i in range(1000, 11000))
+        self.assertLess(false_positives, 200)
+
+    def test_compact(self):
+        # About 1.8 bytes per item at an error rate of 1 in 1000
+        self.assertLess(len(BloomFilter(500000, 0.001)), 1000000)
+
+
+class RotatingBloomFilterTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.bloom_filter = RotatingBloomFilter(100, 0.01, interval=10, timer=self.clock)
+
+    def test_rotation(self):
+        self.bloom_filter.add(digest(1))
+        self.clock.now = 10
+        self.bloom_filter.add(digest(2))
+        self.assertIn(digest(1), self.bloom_filter)
+
+        self.clock.now = 20
+        self.assertNotIn(digest(1), self.bloom_filter)
+        self.assertIn(digest(2), self.bloom_filter)
+
+        self.clock.now = 40
+        self.assertNotIn(digest(2), self.bloom_filter)
+        self.assertEqual(self.bloom_filter.stats()['rotations'], 3)
+
+
+@patch('focus.negative_cache.get_negative_cache', lambda: True)
+class NegativeCachedTest(TestCase):
+    def setUp(self):
+        patcher = patch('focus.negative_cache._filters', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connection(self, call):
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: "Alive"):
+            focus_connection = FocusConnection(config, credentials)
+        focus_connection._call = call
+        return focus_connection
+
+    def test_empty_section_is_skipped(self):
+        call = Mock(return_value=None)
+        focus_connection = self.connection(call)
+
+        self.assertEqual(focus_connection.EAanvragenTozo(bsn='111222333', url_root='/'), [])
+        self.assertEqual(focus_connection.EAanvragenTozo(bsn='111222333', url_root='/'), [])
+        self.assertIsNone(focus_connection.stadspas(bsn='111222333'))
+        self.assertIsNone(focus_connection.stadspas(bsn='111222333'))
+        self.assertEqual(call.call_count, 2)
+
+        # Other citizens are not affected
+        focus_connection.EAanvragenTozo(bsn='123456782', url_root='/')
+        self.assertEqual(call.call_count, 3)
+
+        stats = get_negative_cache_stats()
+        self.assertEqual(stats['tozodocumenten']['items'], 2)
+        self.assertEqual(stats['tozodocumenten']['hits'], 1)
+
+    def test_section_with_content(self):
+        call = Mock(return_value='body')
+        focus_connection = self.connection(call)
+        focus_connection._interpreter = Mock(convert_e_aanvraag_TOZO=Mock(return_value=[{'id': '1'}]))
+
+        focus_connection.EAanvragenTozo(bsn='111222333', url_root='/')
+        focus_connection.EAanvragenTozo(bsn='111222333', url_root='/')
+        self.assertEqual(call.call_count, 2)
+
+    def test_error_is_not_remembered(self):
+        call = Mock(side_effect=ConnectionError())
+        focus_connection = self.connection(call)
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                focus_connection.stadspas(bsn='111222333')
+        self.assertEqual(call.call_count, 2)
+
+    def test_unavailable_is_not_remembered(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        client = MagicMock()
+        client.service.getEAanvraagTOZO.return_value = MockResponse(reply=b"<html>Service Unavailable</html>",
+                                                                    status_code=503)
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: client):
+            focus_connection = FocusConnection(config, credentials)
+
+        for _ in range(2):
+            with self.assertRaises(InvalidResponseError):
+                focus_connection.EAanvragenTozo(bsn='111222333', url_root='/')
+        self.assertEqual(client.service.getEAanvraagTOZO.call_count, 2)
+
+    def test_disabled(self):
+        call = Mock(return_value=None)
+        focus_connection = self.connection(call)
+
+        with patch('focus.negative_cache.get_negative_cache', lambda: False):
+            focus_connection.EAanvragenTozo(bsn='111222333', url_root='/')
+            focus_connection.EAanvragenTozo(bsn='111222333', url_root='/')
+        self.assertEqual(call.call_count, 2)
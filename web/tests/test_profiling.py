@@ -0,0 +1,91 @@
+import os
+import pstats
+import tempfile
+
+from flask_testing import TestCase as FlaskTestCase
+from mock import patch
+
+from .mocks import MockSession
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.crypto import encrypt  # noqa: E402  Module level import not at top of file
+from focus.profiling import ProfilingMiddleware  # noqa: E402
+from focus.server import application  # noqa: E402
+
+TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
+
+
+@patch('focus.focusconnect.FocusConnection._initialize_client', new=lambda s: "Alive")
+class ProfilingTest(FlaskTestCase):
+    def create_app(self):
+        return application
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.wsgi_app = application.wsgi_app
+        self.addCleanup(setattr, application, 'wsgi_app', self.wsgi_app)
+        patchers = [
+            patch('focus.crypto.get_key', lambda: TESTKEY),
+            patch('focus.gpass_connect.get_session', MockSession),
+            patch('focus.server.get_gpass_api_location', lambda: 'http://localhost'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def install(self, profiler='cprofile', networks='127.0.0.1/32'):
+        with patch('focus.profiling.get_profiler', return_value=profiler), \
+                patch('focus.profiling.get_profile_networks', return_value=networks), \
+                patch('focus.profiling.get_profile_dir', return_value=self.directory.name):
+            application.wsgi_app = ProfilingMiddleware(self.wsgi_app)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_cprofile(self):
+        self.install()
+        response = self.client.get('/status/health', headers={'X-Focus-Profile': '1'})
+        self.assert200(response)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('-status_health.prof'))
+        stats = pstats.Stats(os.path.join(self.directory.name, profiles[0]))
+        self.assertTrue(any(function == 'status_health' for _, _, function in stats.stats))
+
+    def test_sampling(self):
+        self.install(profiler='sampling')
+        response = self.client.get('/status/health', headers={'X-Focus-Profile': '1'})
+        self.assert200(response)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('-status_health.folded'))
+
+    def test_not_requested(self):
+        self.install()
+        self.assert200(self.client.get('/status/health'))
+        self.assertEqual(self.profiles(), [])
+
+    def test_external_address(self):
+        self.install()
+        response = self.client.get('/status/health', headers={'X-Focus-Profile': '1'},
+                                   environ_base={'REMOTE_ADDR': '192.0.2.1'})
+        self.assert200(response)
+        self.assertEqual(self.profiles(), [])
+
+    def test_path_is_not_in_file_name(self):
+        self.install(networks='127.0.0.0/8, ::1/128')
+        encrypted = encrypt('aaa', '111111111', '6666666666666')
+        response = self.client.get(f'/focus/stadspastransacties/{encrypted}', headers={'X-Focus-Profile': '1'})
+        self.assert200(response)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('-focus_stadspastransacties.prof'))
+        self.assertNotIn(encrypted, profiles[0])
@@ -0,0 +1,71 @@
+import json
+import os
+from unittest import TestCase
+
+from mock import patch
+
+from .mocks import aanvragen_response
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.focusinterpreter import parse_aanvragen  # noqa: E402  Module level import not at top of file
+from focus.request_log import count, finish_request_log, record_size, start_request_log  # noqa: E402
+
+
+@patch('focus.request_log.get_slow_request_threshold', lambda: 1)
+class RequestLogTest(TestCase):
+    def test_slow_request(self):
+        token = start_request_log()
+        record_size("getAanvragen", 100)
+        record_size("getAanvragen", 50)
+        count("producten", 3)
+        count("producten")
+        spans = [("saml", {}, 0.1), ("soap", {"operation": "getAanvragen"}, 1.0),
+                 ("parse", {"operation": "getAanvragen"}, 0.25), ("soap", {"operation": "getAanvragen"}, 0.5)]
+
+        with self.assertLogs('focus.request_log') as logs:
+            finish_request_log(token, 2, spans, endpoint="aanvragen", status=200)
+
+        self.assertEqual(json.loads(logs.records[0].getMessage()), {
+            "message": "slow request",
+            "endpoint": "aanvragen",
+            "status": 200,
+            "ms": 2000,
+            "stages": {"saml": 100, "soap": 1500, "parse": 250},
+            "calls": [
+                {"stage": "saml", "ms": 100},
+                {"stage": "soap", "operation": "getAanvragen", "ms": 1000},
+                {"stage": "parse", "operation": "getAanvragen", "ms": 250},
+                {"stage": "soap", "operation": "getAanvragen", "ms": 500},
+            ],
+            "bytes": {"getAanvragen": 150},
+            "counts": {"producten": 4},
+        })
+
+    def test_fast_request(self):
+        token = start_request_log()
+        with patch('focus.request_log.logger') as logger:
+            finish_request_log(token, 0.5, [], endpoint="aanvragen", status=200)
+        logger.warning.assert_not_called()
+
+    def test_not_recording(self):
+        # Outside a request the sizes and counts are ignored
+        record_size("getAanvragen", 100)
+        count("producten")
+
+    def test_disabled(self):
+        with patch('focus.request_log.get_slow_request_threshold', lambda: 0):
+            self.assertIsNone(start_request_log())
+
+    def test_count_producten(self):
+        token = start_request_log()
+        producten, _ = parse_aanvragen(aanvragen_response, "/")
+        with self.assertLogs('focus.request_log') as logs:
+            finish_request_log(token, 2, [])
+
+        counts = json.loads(logs.records[0].getMessage())["counts"]
+        self.assertEqual(counts["producten"], len(producten))
+        self.assertGreater(counts["processtappen"], 0)
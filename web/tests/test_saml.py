@@ -0,0 +1,71 @@
+import os
+from unittest import TestCase
+
+from mock import Mock, patch
+from tma_saml import InvalidBSNException, SamlVerificationException, TMA_SAML_HEADER
+from tma_saml.for_tests.cert_and_key import server_crt
+from tma_saml.for_tests.fixtures import generate_saml_token_for_bsn
+
+from .mocks import Clock
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+import focus.saml  # noqa: E402  Module level import not at top of file
+from focus.cache import TTLCache  # noqa: E402
+from focus.saml import get_bsn_from_request, get_tma_certificate  # noqa: E402
+
+
+class Request:
+    def __init__(self, token):
+        self.headers = {TMA_SAML_HEADER: token.decode()}
+
+
+class GetBsnFromRequestTest(TestCase):
+    def setUp(self):
+        get_tma_certificate.cache_clear()
+        self.addCleanup(get_tma_certificate.cache_clear)
+
+        self.clock = Clock()
+        patchers = [
+            patch('focus.saml.get_TMA_certificate', Mock(return_value=server_crt)),
+            patch('focus.saml.get_digi_d_bsn', Mock(wraps=focus.saml.get_digi_d_bsn)),
+            patch('focus.saml._verified_tokens', TTLCache(10, timer=self.clock)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_verified_once(self):
+        request = Request(generate_saml_token_for_bsn('111222333'))
+
+        self.assertEqual(get_bsn_from_request(request), '111222333')
+        self.assertEqual(get_bsn_from_request(request), '111222333')
+
+        self.assertEqual(focus.saml.get_digi_d_bsn.call_count, 1)
+        self.assertEqual(focus.saml.get_TMA_certificate.call_count, 1)
+
+    def test_eight_digit_bsn(self):
+        self.assertEqual(get_bsn_from_request(Request(generate_saml_token_for_bsn('11222335'))), '011222335')
+
+    def test_invalid_bsn(self):
+        with self.assertRaises(InvalidBSNException):
+            get_bsn_from_request(Request(generate_saml_token_for_bsn('123456789')))
+
+    def test_verified_again_after_expiry(self):
+        request = Request(generate_saml_token_for_bsn('111222333'))
+        get_bsn_from_request(request)
+
+        # The fixture tokens are valid for 15 minutes
+        self.clock.now = 15 * 60
+        get_bsn_from_request(request)
+        self.assertEqual(focus.saml.get_digi_d_bsn.call_count, 2)
+
+    def test_invalid_token_is_not_remembered(self):
+        token = generate_saml_token_for_bsn('111222333').replace(b'A', b'B', 1)
+        for _ in range(2):
+            with self.assertRaises(SamlVerificationException):
+                get_bsn_from_request(Request(token))
+        self.assertEqual(focus.saml.get_digi_d_bsn.call_count, 2)
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from .mocks import MockSession
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.config import config, credentials  # noqa: E402  Module level import not at top of file
+from focus.focusconnect import FocusConnection  # noqa: E402
+from focus.gpass_connect import GpassConnection  # noqa: E402
+from focus.single_flight import SingleFlight  # noqa: E402
+
+
+def run_concurrently(function, count):
+    """ Run function in count threads, returns the results """
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = function()
+        except Exception as error:
+            results[i] = error
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class Slow:
+    """ A function that does not finish before the other threads have joined its flight """
+
+    def __init__(self, flights, followers, result=None, error=None):
+        self.flights = flights
+        self.followers = followers
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        for _ in range(200):
+            if self.flights.stats()["coalesced"] >= self.followers:
+                break
+            time.sleep(0.01)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    def test_coalesced(self):
+        function = Slow(self.flights, 3, result=[1, 2])
+        results = run_concurrently(lambda: self.flights.do("key", function), 4)
+
+        self.assertEqual(function.calls, 1)
+        self.assertEqual(results, [[1, 2]] * 4)
+        self.assertEqual(self.flights.stats(), {"in_flight": 0, "calls": 1, "coalesced": 3})
+
+    def test_error(self):
+        error = ValueError()
+        function = Slow(self.flights, 1, error=error)
+        results = run_concurrently(lambda: self.flights.do("key", function), 2)
+
+        self.assertEqual(function.calls, 1)
+        self.assertEqual(results, [error, error])
+
+    def test_after_flight(self):
+        self.assertEqual(self.flights.do("key", lambda: 1), 1)
+        self.assertEqual(self.flights.do("key", lambda: 2), 2)
+
+    def test_other_key(self):
+        # Both calls have to be in flight at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=2)
+        results = run_concurrently(lambda: self.flights.do(f"key {threading.get_ident()}", barrier.wait), 2)
+        self.assertEqual(sorted(results), [0, 1])
+
+
+class CoalescedOperationTest(TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        patcher = patch('focus.single_flight._flights', self.flights)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_focus(self):
+        call = Slow(self.flights, 2)
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: "Alive"), \
+                patch.object(FocusConnection, '_call', new=call):
+            focus_connection = FocusConnection(config, credentials)
+            results = run_concurrently(lambda: focus_connection.jaaropgaven(bsn='111222333', url_root='/'), 3)
+
+        self.assertEqual(call.calls, 1)
+        self.assertEqual(results, [[]] * 3)
+
+    def test_focus_other_bsn(self):
+        barrier = threading.Barrier(2, timeout=2)
+        bsns = iter(['111222333', '123456782'])
+
+        def call(*args, **kwargs):
+            barrier.wait()
+
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: "Alive"), \
+                patch.object(FocusConnection, '_call', new=call):
+            focus_connection = FocusConnection(config, credentials)
+            results = run_concurrently(lambda: focus_connection.jaaropgaven(bsn=next(bsns), url_root='/'), 2)
+
+        self.assertEqual(results, [[], []])
+
+    def test_gpass(self):
+        session = MockSession()
+        session.get = Mock(wraps=Slow(self.flights, 1, result=session.get('/unknown')))
+        with patch('focus.gpass_connect.get_session', lambda: session):
+            connection = GpassConnection('http://localhost', 'token')
+            results = run_concurrently(
+                lambda: connection.get_transactions(admin_number='111111111', pas_number='1', budget_code='A'), 2)
+
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual(results, [None, None])
+
+    @patch('focus.single_flight.get_single_flight', lambda: False)
+    def test_disabled(self):
+        call = Mock(return_value=None)
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: "Alive"), \
+                patch.object(FocusConnection, '_call', new=call):
+            focus_connection = FocusConnection(config, credentials)
+            run_concurrently(lambda: focus_connection.jaaropgaven(bsn='111222333', url_root='/'), 2)
+
+        self.assertEqual(call.call_count, 2)
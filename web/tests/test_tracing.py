@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from flask_testing import TestCase as FlaskTestCase
+from hiro import Timeline
+from mock import Mock, patch
+
+from .mocks import MockClient, MockSession
+
+os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
+os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
+os.environ['FOCUS_WSDL'] = 'focus/focus.wsdl'
+os.environ['TMA_CERTIFICATE'] = __file__
+
+from focus.concurrency import get_executor, submit  # noqa: E402  Module level import not at top of file
+from focus.server import application  # noqa: E402
+from focus.tracing import JsonLinesExporter, finish_trace, get_request_id, set_exporter, span, \
+    start_trace  # noqa: E402
+
+TESTKEY = "z4QXWk3bjwFST2HRRVidnn7Se8VFCaHscK39JfODzNs="
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans += [item.to_dict() for item in spans]
+
+
+class TracingTest(TestCase):
+    def setUp(self):
+        self.exporter = MemoryExporter()
+        set_exporter(self.exporter)
+        self.addCleanup(set_exporter, None)
+
+    def test_spans(self):
+        token = start_trace("request", "abc-123")
+        with span("soap", operation="getStadspas"):
+            self.assertEqual(get_request_id(), "abc-123")
+            with span("parse"):
+                pass
+            # Executor threads continue the span that submits them
+            submit(get_executor("test", 1), self._gpass).result()
+        finish_trace(token, status=200)
+
+        spans = {item['name']: item for item in self.exporter.spans}
+        self.assertEqual(set(spans), {"request", "soap", "parse", "gpass"})
+        self.assertEqual({item['request_id'] for item in spans.values()}, {"abc-123"})
+        self.assertIsNone(spans['request']['parent_id'])
+        self.assertEqual(spans['request']['attributes'], {"status": 200})
+        self.assertEqual(spans['soap']['parent_id'], spans['request']['span_id'])
+        self.assertEqual(spans['soap']['attributes'], {"operation": "getStadspas"})
+        self.assertEqual(spans['parse']['parent_id'], spans['soap']['span_id'])
+        self.assertEqual(spans['gpass']['parent_id'], spans['soap']['span_id'])
+        self.assertNotEqual(spans['gpass']['thread'], spans['soap']['thread'])
+        self.assertIsNone(get_request_id())
+
+    @staticmethod
+    def _gpass():
+        with span("gpass"):
+            pass
+
+    def test_error(self):
+        token = start_trace("request")
+        with self.assertRaises(ValueError):
+            with span("soap"):
+                raise ValueError()
+        finish_trace(token)
+        self.assertEqual(self.exporter.spans[0]['error'], 'ValueError')
+
+    def test_spans_finishing_with_the_trace(self):
+        # The spans of executor threads that finish while the trace is exported are exported once, none are lost
+        executor = get_executor("finish test", 4)
+        for _ in range(100):
+            token = start_trace("request")
+            futures = [submit(executor, self._gpass) for _ in range(4)]
+            finish_trace(token)
+            for future in futures:
+                future.result()
+        self.assertEqual(len(self.exporter.spans), 500)
+        self.assertEqual(len({item['span_id'] for item in self.exporter.spans}), 500)
+
+    def test_invalid_request_id(self):
+        token = start_trace("request", "not a valid id\n")
+        self.assertRegex(get_request_id(), r"^[0-9a-f]{32}$")
+        finish_trace(token)
+
+    def test_not_traced(self):
+        with span("soap") as current:
+            self.assertIsNone(current)
+        set_exporter(None)
+        self.assertIsNone(start_trace("request"))
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_json_lines_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+            set_exporter(JsonLinesExporter(path))
+            for _ in range(2):
+                token = start_trace("request")
+                with span("soap"):
+                    pass
+                finish_trace(token)
+
+            with open(path) as fp:
+                spans = [json.loads(line) for line in fp]
+        self.assertEqual([item['name'] for item in spans], ["soap", "request", "soap", "request"])
+
+
+@patch('focus.focusconnect.Client', new=MockClient)
+@patch('focus.focusserver.get_bsn_from_request', new=lambda s: 123456789)
+@patch('focus.focusserver.get_gpass_api_location', lambda: 'http://localhost')
+@patch("focus.crypto.get_key", lambda: TESTKEY)
+class TracedRequestTest(FlaskTestCase):
+    def create_app(self):
+        return application
+
+    def setUp(self):
+        self.exporter = MemoryExporter()
+        set_exporter(self.exporter)
+        self.addCleanup(set_exporter, None)
+
+    def test_combined(self):
+        session = Mock(wraps=MockSession())
+        with patch('focus.gpass_connect.get_session', lambda: session), Timeline(start=datetime(2017, 5, 1, 1, 1, 1)):
+            response = self.client.get('/focus/combined', headers={'X-Request-ID': 'request-1'})
+
+        self.assertEqual(response.headers['X-Request-ID'], 'request-1')
+        self.assertEqual(session.get.call_args.kwargs['headers']['X-Request-ID'], 'request-1')
+
+        spans = self.exporter.spans
+        by_id = {item['span_id']: item for item in spans}
+        [root] = [item for item in spans if item['parent_id'] is None]
+        self.assertEqual(root['name'], 'combined')
+        self.assertEqual(root['attributes'], {'method': 'GET', 'rule': '/focus/combined', 'status': 200})
+
+        names = {item['name'] for item in spans}
+        self.assertTrue({'section', 'soap', 'parse', 'gpass', 'json'} <= names)
+        for item in spans:
+            if item['name'] == 'gpass':
+                self.assertEqual(by_id[item['parent_id']]['attributes'], {'section': 'stadspas'})
+            # A parse is a single span, the parse functions are not traced within it
+            self.assertNotEqual(by_id.get(item['parent_id'], {}).get('name'), 'parse')
+
+    def test_not_traced(self):
+        set_exporter(None)
+        response = self.client.get('/status/health')
+        self.assertNotIn('X-Request-ID', response.headers)
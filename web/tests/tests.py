@@ -1,13 +1,15 @@
 
 import os
 import json
+import time
 
 from flask_testing.utils import TestCase
 from mock import patch
+from requests import ConnectionError
 
 
 # Prepare environment
-from tests.mocks import MockClient
+from tests.mocks import MockClient, RESPONSES_PATH
 
 os.environ['FOCUS_USERNAME'] = 'FOCUS_USERNAME'
 os.environ['FOCUS_PASSWORD'] = 'FOCUS_PASSWORD'
@@ -111,6 +113,58 @@ class TestConnection(TestCase):
         FocusConnection(config, credentials)
         self.assertTrue(mocked_set_client.called)
 
+    @patch('focus.focusconnect.get_reconnect_delay', lambda: 0.05)
+    def test_reconnect_in_background(self):
+        """
+        A failed connection is re-established in the background, meanwhile calls fail immediately
+        """
+        attempts = []
+
+        def connect(s):
+            attempts.append(time.time())
+            return "Alive" if len(attempts) > 2 else None
+
+        with patch.object(FocusConnection, '_initialize_client', new=connect):
+            focus_connection = FocusConnection(config, credentials)
+            replaced = focus_connection._pool
+            with self.assertRaises(ConnectionError):
+                focus_connection.stadspas(bsn='111222333')
+
+            for _ in range(100):
+                if focus_connection.is_alive():
+                    break
+                time.sleep(0.01)
+
+        self.assertTrue(focus_connection.is_alive())
+        self.assertTrue(replaced._closed)
+        self.assertEqual(len(attempts), 3)
+        # The delay doubles
+        self.assertGreater(attempts[2] - attempts[1], attempts[1] - attempts[0])
+
+    def test_one_reconnect_at_a_time(self):
+        with patch.object(FocusConnection, '_initialize_client', new=lambda s: "Alive"):
+            focus_connection = FocusConnection(config, credentials)
+            with patch('focus.focusconnect.threading.Thread') as thread:
+                focus_connection.reset()
+                focus_connection.reset()
+        self.assertEqual(thread.call_count, 1)
+
+    def test_wsdl_is_parsed_once(self):
+        """
+        The clients share the parsed WSDL, also after a reset
+        """
+        focus_connection = FocusConnection(dict(config, wsdl=os.path.join(RESPONSES_PATH, 'getdocument.wsdl')), credentials)
+        replaced = focus_connection._pool
+        with replaced.client() as client:
+            replaced_client, wsdl = client, client.wsdl
+
+        # Reconnect synchronously, reset() reconnects in a background thread
+        focus_connection._reconnect()
+        self.assertIsNot(focus_connection._pool, replaced)
+        with focus_connection._pool.client() as client:
+            self.assertIsNot(client, replaced_client)
+            self.assertIs(client.wsdl, wsdl)
+
 
 @patch('focus.server.get_TMA_certificate', new=get_fake_tma_cert)
 @patch('focus.focusconnect.FocusConnection._initialize_client', new=lambda s: "Alive")
@@ -144,6 +198,13 @@ class TestData(TestCase):
         response = self.client.get('/status/data')
         self.assertEqual(response.status_code, 200)
 
+    @patch('focus.focusconnect.FocusConnection._initialize_client', new=lambda s: "Dummy")
+    def test_pool_stats(self):
+        response = self.client.get('/status/pool')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['created'], 1)
+        self.assertIn('max_wait_time', response.json)
+
     @patch('focus.focusconnect.FocusConnection._initialize_client', new=lambda s: None)
     def test_data_without_connection(self):
         """